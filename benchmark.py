@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Analysis Benchmark Suite
+========================
+Times every analysis stage and records its peak memory on seeded synthetic
+data that follows the pseudo_facebook.csv schema and distributions, at any
+size from 100k to 100M users. Results are compared against a stored
+baseline so scaling claims and regressions can be checked before upgrades:
+
+    python3 benchmark.py --size 100k                    # generate, run, compare
+    python3 benchmark.py --size 10m --density --save-baseline
+    python3 benchmark.py --size 100m --no-visualizations
+    python3 benchmark.py --size 10m --readers           # also serial vs prefetching reader
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import facebook_eda_analysis as fea
+
+SIZES = {
+    '100k': 100_000,
+    '10m': 10_000_000,
+    '100m': 100_000_000,
+}
+
+STAGES = [
+    'load_data',
+    'create_engagement_score',
+    'analyze_demographics',
+    'analyze_platform_usage',
+    'identify_valuable_users',
+    'create_visualizations',
+    'save_valuable_users',
+]
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# A stage regresses when it is this much slower, or uses this much more
+# memory, than the baseline
+TIME_THRESHOLD = 0.25
+MEMORY_THRESHOLD = 0.10
+
+# Timings shorter than this are too noisy to flag
+MIN_SECONDS = 0.05
+
+def _id_multiplier(n_users):
+    """Return a step coprime with n_users, so i * step % n_users permutes the ids."""
+    step = 2_654_435_761 % n_users or 1
+    while math.gcd(step, n_users) != 1:
+        step += 1
+    return step
+
+def generate_users(n_users, seed=0, start=0, total=None):
+    """
+    Generate users start..start+n_users of a synthetic dataset of total users.
+    Shapes follow pseudo_facebook.csv: young-skewed ages, long-tailed friend
+    and like counts with many zeros, about 58% male, a few missing genders
+    and tenures. Chunks of the same dataset are independent of each other.
+    """
+    total = total or start + n_users
+    rng = np.random.default_rng([seed, start])
+    index = np.arange(start, start + n_users, dtype=np.int64)
+
+    age = np.clip(np.round(13 + rng.lognormal(2.7, 0.8, n_users)), 13, 113).astype(np.int64)
+    friend_count = np.minimum(np.round(rng.lognormal(4.4, 1.4, n_users)), 4923).astype(np.int64)
+    friend_count[rng.random(n_users) < 0.02] = 0
+    engaged = rng.random(n_users) >= 0.22  # share of users who have ever liked anything
+    likes = np.where(engaged, np.minimum(np.round(rng.lognormal(3.3, 1.9, n_users)), 25111), 0)
+    likes_received = np.minimum(np.round(rng.lognormal(2.6, 2.1, n_users)), 261197)
+    likes_received[rng.random(n_users) < 0.25] = 0
+    mobile_share = rng.beta(2.0, 1.0, n_users)
+    received_share = rng.beta(1.5, 1.0, n_users)
+    mobile_likes = np.round(likes * mobile_share).astype(np.int64)
+    mobile_received = np.round(likes_received * received_share).astype(np.int64)
+
+    df = pd.DataFrame({
+        'userid': 1_000_000 + index * _id_multiplier(total) % total,
+        'age': age,
+        'dob_day': rng.integers(1, 32, n_users),
+        'dob_year': 2013 - age,
+        'dob_month': rng.integers(1, 13, n_users),
+        'gender': np.where(rng.random(n_users) < 0.58, 'male', 'female').astype(object),
+        'tenure': np.minimum(np.round(rng.gamma(1.3, 420, n_users)), 3139),
+        'friend_count': friend_count,
+        'friendships_initiated': np.round(friend_count * rng.beta(3, 2.5, n_users)).astype(np.int64),
+        'likes': likes.astype(np.int64),
+        'likes_received': likes_received.astype(np.int64),
+        'mobile_likes': mobile_likes,
+        'mobile_likes_received': mobile_received,
+        'www_likes': likes.astype(np.int64) - mobile_likes,
+        'www_likes_received': likes_received.astype(np.int64) - mobile_received,
+    })
+    df.loc[rng.random(n_users) < 0.0018, 'gender'] = np.nan
+    df.loc[rng.random(n_users) < 0.00002, 'tenure'] = np.nan
+    return df
+
+def write_synthetic_csv(filepath, n_users, seed=0, chunksize=1_000_000):
+    """Write a synthetic dataset chunk by chunk, so any size fits in memory."""
+    for start in range(0, n_users, chunksize):
+        chunk = generate_users(min(chunksize, n_users - start), seed, start, n_users)
+        chunk.to_csv(filepath, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    return filepath
+
+@contextlib.contextmanager
+def _measure(results, stage, rows):
+    """Record wall time and traced peak memory of the enclosed block."""
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    results[stage] = {'seconds': seconds, 'peak_mb': (peak - before) / 2**20, 'rows': rows}
+
+def _run_stages(data_path, output_dir, density, visualizations, use_cache):
+    results = {}
+    tracemalloc.start()
+    try:
+        with _measure(results, 'load_data', None):
+            df = fea.load_data(data_path, use_cache=use_cache)
+        rows = len(df)
+        results['load_data']['rows'] = rows
+
+        with _measure(results, 'create_engagement_score', rows):
+            df = fea.create_engagement_score(df)
+        with _measure(results, 'analyze_demographics', rows):
+            df = fea.analyze_demographics(df)
+        with _measure(results, 'analyze_platform_usage', rows):
+            df = fea.analyze_platform_usage(df)
+        with _measure(results, 'identify_valuable_users', rows):
+            valuable_users = fea.identify_valuable_users(df)
+        if visualizations:
+            import matplotlib
+            matplotlib.use('Agg')
+            fea.load_plotting()  # import cost is not part of the stage
+            with _measure(results, 'create_visualizations', rows):
+                fea.create_visualizations(df, valuable_users, density=density,
+                                          output_dir=output_dir)
+        with _measure(results, 'save_valuable_users', len(valuable_users)):
+            fea.save_valuable_users(valuable_users,
+                                    os.path.join(output_dir, 'valuable_users_list.csv'))
+    finally:
+        tracemalloc.stop()
+    return results
+
+def run_benchmark(data_path, output_dir, density=False, visualizations=True, use_cache=False,
+                  repeat=1):
+    """
+    Run every stage on data_path repeat times and return {stage: seconds,
+    peak_mb, rows}, keeping the fastest time and the largest peak. peak_mb
+    is the memory a stage allocated above what was live when it started.
+    Stage reports are silenced so printing does not count.
+    """
+    results = {}
+    for _ in range(repeat):
+        run = _run_stages(data_path, output_dir, density, visualizations, use_cache)
+        for stage, result in run.items():
+            best = results.setdefault(stage, result)
+            best['seconds'] = min(best['seconds'], result['seconds'])
+            best['peak_mb'] = max(best['peak_mb'], result['peak_mb'])
+    return results
+
+def load_baseline(filepath=BASELINE_PATH):
+    """Return the stored baselines ({size label: results}), or an empty dict."""
+    if not os.path.exists(filepath):
+        return {}
+    with open(filepath) as f:
+        return json.load(f)
+
+def save_baseline(label, results, filepath=BASELINE_PATH):
+    """Store results as the baseline for one size label."""
+    baselines = load_baseline(filepath)
+    baselines[label] = results
+    with open(filepath, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+
+def compare_to_baseline(results, baseline, time_threshold=TIME_THRESHOLD,
+                        memory_threshold=MEMORY_THRESHOLD):
+    """Return a list of regression messages for stages slower or larger than baseline."""
+    regressions = []
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        base = baseline[stage]
+        if (result['seconds'] > MIN_SECONDS
+                and result['seconds'] > base['seconds'] * (1 + time_threshold)):
+            regressions.append(f"{stage}: {result['seconds']:.3f}s vs baseline "
+                               f"{base['seconds']:.3f}s")
+        if result['peak_mb'] > base['peak_mb'] * (1 + memory_threshold) + 1:
+            regressions.append(f"{stage}: {result['peak_mb']:.1f} MB vs baseline "
+                               f"{base['peak_mb']:.1f} MB")
+    return regressions
+
+def print_results(label, results, baseline=None):
+    print("\n" + "="*80)
+    print(f"BENCHMARK RESULTS ({label})")
+    print("="*80)
+    print(f"\n{'Stage':<26}{'Seconds':>10}{'Peak MB':>10}{'Rows/s':>14}{'vs Baseline':>14}")
+    for stage in STAGES:
+        if stage not in results:
+            continue
+        result = results[stage]
+        rate = result['rows'] / result['seconds'] if result['seconds'] else float('nan')
+        change = ''
+        if baseline and stage in baseline:
+            change = f"{result['seconds'] / baseline[stage]['seconds'] - 1:+.0%}"
+        print(f"{stage:<26}{result['seconds']:>10.3f}{result['peak_mb']:>10.1f}"
+              f"{rate:>14,.0f}{change:>14}")
+
+def print_reader_results(results, chunksize):
+    print("\n" + "="*80)
+    print(f"CHUNK READER THROUGHPUT (read + score, chunks of {chunksize:,} rows)")
+    print("="*80)
+    print(f"\n{'Reader':<26}{'Seconds':>10}{'Rows/s':>14}{'MB/s':>10}{'Speedup':>10}")
+    for reader, result in results.iterrows():
+        print(f"{reader:<26}{result['seconds']:>10.3f}{result['rows_per_s']:>14,.0f}"
+              f"{result['mb_per_s']:>10.1f}{result['speedup']:>9.2f}x")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis stages")
+    parser.add_argument('--size', default='100k',
+                        help="number of users, or one of " + ', '.join(SIZES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', help="where generated datasets are kept (default: temp dir)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage; the fastest counts")
+    parser.add_argument('--density', action='store_true', help="draw scatters as density grids")
+    parser.add_argument('--no-visualizations', action='store_true',
+                        help="skip create_visualizations (e.g. scatter plots at 100M users)")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline JSON file")
+    parser.add_argument('--save-baseline', action='store_true', help="store results as the baseline")
+    parser.add_argument('--time-threshold', type=float, default=TIME_THRESHOLD)
+    parser.add_argument('--memory-threshold', type=float, default=MEMORY_THRESHOLD)
+    parser.add_argument('--readers', action='store_true',
+                        help="also compare the serial and prefetching chunk readers")
+    parser.add_argument('--chunksize', type=int, default=1_000_000,
+                        help="rows per chunk for --readers")
+    args = parser.parse_args(argv)
+
+    label = args.size.lower()
+    n_users = SIZES.get(label) or int(args.size)
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='facebook_eda_bench_')
+    os.makedirs(data_dir, exist_ok=True)
+    data_path = os.path.join(data_dir, f'synthetic_{label}_seed{args.seed}.csv')
+    if not os.path.exists(data_path):
+        print(f"Generating {n_users:,} synthetic users in '{data_path}'...")
+        write_synthetic_csv(data_path, n_users, args.seed)
+
+    results = run_benchmark(data_path, data_dir, density=args.density,
+                            visualizations=not args.no_visualizations, repeat=args.repeat)
+    baseline = load_baseline(args.baseline).get(label)
+    print_results(label, results, baseline)
+    if args.readers:
+        from chunk_reader import compare_readers
+        print_reader_results(compare_readers(data_path, args.chunksize, prefetch=(1, 2, 4),
+                                             repeat=args.repeat), args.chunksize)
+
+    if args.save_baseline:
+        save_baseline(label, results, args.baseline)
+        print(f"\nBaseline for '{label}' saved to '{args.baseline}'")
+        return 0
+    if baseline is None:
+        print(f"\nNo baseline for '{label}'; run with --save-baseline to store one")
+        return 0
+    regressions = compare_to_baseline(results, baseline, args.time_threshold,
+                                      args.memory_threshold)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    print(f"\n{len(regressions)} regression(s) against the '{label}' baseline")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Memory-Mapped Column Store
+==========================
+Converts pseudo_facebook.csv (or a scored output) into one raw typed array
+file per column:
+
+    pseudo_facebook.csv.columns/
+        _source.json        size, mtime and hash of the CSV it was built from
+        userid.col          256-byte header (magic + JSON dtype/rows/categories)
+        age.col             followed by the column's values as a raw array
+        ...
+
+Loading maps only the requested columns with np.memmap: nothing is parsed
+or copied, so a fresh process reaches scoring in milliseconds and every
+process reading the same store shares the same page-cache pages.
+Categorical columns are stored as integer codes with their labels in the
+header.
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from columnar_output import CategoryEncoder, is_encoded
+from source_files import is_fresh, source_record
+
+MAGIC = b'FBCOL\x01'
+HEADER_SIZE = 256
+STORE_VERSION = 1
+SOURCE_NAME = '_source.json'
+
+def default_store_dir(filepath):
+    """Return where the column store for a CSV lives."""
+    return filepath + '.columns'
+
+def _write_header(f, dtype, rows, categories):
+    header = json.dumps({'dtype': np.dtype(dtype).str, 'rows': rows,
+                         'categories': categories}).encode()
+    if len(MAGIC) + len(header) + 1 > HEADER_SIZE:
+        raise ValueError("column header too large (too many categories)")
+    f.seek(0)
+    f.write(MAGIC + header + b' ' * (HEADER_SIZE - len(MAGIC) - len(header) - 1) + b'\n')
+
+def read_header(path):
+    """Return the header dict of a column file."""
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if not raw.startswith(MAGIC):
+        raise ValueError(f"'{path}' is not a column file")
+    return json.loads(raw[len(MAGIC):].decode())
+
+class ColumnStoreWriter:
+    """Append chunks column by column, then finalise the headers on close()."""
+
+    def __init__(self, store_dir, source=None):
+        self.store_dir = store_dir
+        self.source = source
+        self.rows = 0
+        self._files = {}
+        self._dtypes = {}
+        self._encoder = CategoryEncoder()
+        self._tmp_dir = store_dir.rstrip(os.sep) + '.tmp'
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        os.makedirs(self._tmp_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            for f in self._files.values():
+                f.close()
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def _encode(self, col, series):
+        """Return the raw values of a column chunk, coding categories consistently."""
+        if is_encoded(series):
+            return self._encoder.encode(col, series)
+        return series.to_numpy()
+
+    def write(self, chunk):
+        """Append a chunk; every chunk must have the same columns."""
+        for col in chunk.columns:
+            values = self._encode(col, chunk[col])
+            if col not in self._files:
+                self._files[col] = open(os.path.join(self._tmp_dir, f'{col}.col'), 'w+b')
+                self._files[col].write(b'\0' * HEADER_SIZE)
+                self._dtypes[col] = values.dtype
+            elif values.dtype != self._dtypes[col]:
+                # Codes may widen as labels accumulate; rewrite what is stored so far
+                values = values.astype(np.promote_types(values.dtype, self._dtypes[col]))
+                self._widen(col, values.dtype)
+            self._files[col].write(np.ascontiguousarray(values).tobytes())
+        self.rows += len(chunk)
+        return self
+
+    def _widen(self, col, dtype):
+        f = self._files[col]
+        f.seek(HEADER_SIZE)
+        stored = np.frombuffer(f.read(), dtype=self._dtypes[col]).astype(dtype)
+        f.seek(HEADER_SIZE)
+        f.truncate()
+        f.write(stored.tobytes())
+        self._dtypes[col] = dtype
+
+    def close(self):
+        """Write headers and the source record, then swap the store into place."""
+        for col, f in self._files.items():
+            _write_header(f, self._dtypes[col], self.rows, self._encoder.categories.get(col))
+            f.close()
+        with open(os.path.join(self._tmp_dir, SOURCE_NAME), 'w') as f:
+            json.dump({'version': STORE_VERSION, 'rows': self.rows,
+                       'columns': list(self._files), 'source': self.source}, f, indent=1)
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+        os.replace(self._tmp_dir, self.store_dir)
+        return self.store_dir
+
+def convert_csv(filepath, store_dir=None, chunksize=1_000_000, prefetch=0):
+    """Convert a CSV into a column store, chunk by chunk; returns the store dir."""
+    from chunk_reader import csv_chunks
+    store_dir = store_dir or default_store_dir(filepath)
+    source = {'path': os.path.abspath(filepath), **source_record(filepath)}
+    with ColumnStoreWriter(store_dir, source) as writer:
+        for chunk in csv_chunks(filepath, chunksize=chunksize, prefetch=prefetch):
+            writer.write(chunk)
+    return store_dir
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, SOURCE_NAME))
+
+def store_is_fresh(store_dir, filepath):
+    """Return True if store_dir was converted from filepath as it is now."""
+    if not is_store(store_dir):
+        return False
+    with open(os.path.join(store_dir, SOURCE_NAME)) as f:
+        meta = json.load(f)
+    source = meta.get('source')
+    if meta.get('version') != STORE_VERSION or not source:
+        return False
+    return is_fresh(source, filepath)
+
+def store_columns(store_dir):
+    """Return the columns of a store in their original order."""
+    with open(os.path.join(store_dir, SOURCE_NAME)) as f:
+        return json.load(f)['columns']
+
+def open_column(store_dir, col):
+    """Map one column read-only; categorical columns come back as pd.Categorical."""
+    path = os.path.join(store_dir, f'{col}.col')
+    header = read_header(path)
+    values = np.memmap(path, dtype=np.dtype(header['dtype']), mode='r',
+                       offset=HEADER_SIZE, shape=(header['rows'],))
+    if header['categories'] is not None:
+        return pd.Categorical.from_codes(values, header['categories'])
+    return values
+
+def load_columns(store_dir, columns=None):
+    """Return a DataFrame over memory-mapped columns, without copying them."""
+    columns = store_columns(store_dir) if columns is None else columns
+    return pd.DataFrame({col: open_column(store_dir, col) for col in columns}, copy=False)
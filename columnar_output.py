@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Columnar Scored-User Output
+===========================
+Writes the full scored user table as a compressed, columnar, partitioned
+dataset and reads it back with partition and row-group skipping:
+
+    scored_users/
+        _manifest.json
+        user_category=High/primary_platform=Mobile/part-00000.npz
+        ...
+
+Each part file is one row group: every column is stored as its own
+compressed array, with text and categorical columns dictionary-encoded.
+The manifest records each row group's partition values, row count and
+per-column statistics (min/max/null count, or the distinct values of
+encoded columns), so readers can skip files that cannot match a filter
+without opening them. Rows are written chunk by chunk, so the full frame
+never has to be in memory.
+"""
+
+import json
+import operator
+import os
+import shutil
+import zipfile
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+MANIFEST_NAME = '_manifest.json'
+# Directory name for missing partition values (users without a score)
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+FORMAT_VERSION = 1
+
+PARTITION_COLUMNS = ['user_category', 'primary_platform']
+
+# Rows per part file. Partitions buffer up to this many rows before
+# flushing, so peak memory is bounded by partitions x ROW_GROUP_SIZE rows.
+ROW_GROUP_SIZE = 250_000
+
+# zlib level for part files; level 1 is several times faster to write than
+# numpy's default and the files are only slightly larger
+COMPRESS_LEVEL = 1
+
+# Intermediate columns that are not part of the published table
+EXCLUDED_COLUMNS = ['mobile_preference', 'www_preference']
+
+_OPERATORS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le,
+    '>': operator.gt, '>=': operator.ge,
+}
+
+def _json_value(value):
+    """Convert numpy scalars and NaN to JSON-friendly values."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+def _save_arrays(path, arrays):
+    """Write arrays as a compressed .npz file that np.load can read."""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as zf:
+        for name, array in arrays.items():
+            with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=False)
+
+def is_encoded(series):
+    """Whether a column is stored as codes into a label list (text and categoricals)."""
+    return isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object
+
+def code_dtype(n_labels):
+    """Smallest signed integer dtype for codes 0..n_labels-1 and -1 for missing."""
+    return next(dtype for dtype in (np.int8, np.int16, np.int32, np.int64)
+                if n_labels <= np.iinfo(dtype).max + 1)
+
+class CategoryEncoder:
+    """
+    Codes text and categorical columns against one label list per column
+    that grows chunk by chunk, so codes from every chunk agree. Labels are
+    strings; missing values get code -1.
+    """
+
+    def __init__(self):
+        self.categories = {}
+
+    def update(self, col, series):
+        """Add a chunk's labels of col and return the column's label list."""
+        labels = self.categories.setdefault(col, [])
+        # Keep category order from the source; text columns in first-seen order
+        values = (series.cat.categories if isinstance(series.dtype, pd.CategoricalDtype)
+                  else series.dropna().unique())
+        known = set(labels)
+        labels += [label for label in dict.fromkeys(str(v) for v in values) if label not in known]
+        return labels
+
+    def encode(self, col, series):
+        """Codes of a chunk of col, in the smallest dtype that holds every label."""
+        labels = self.update(col, series)
+        codes = pd.Categorical(series.astype(str).where(series.notna()), categories=labels).codes
+        return codes.astype(code_dtype(len(labels)))
+
+class PartitionedWriter:
+    """Stream scored chunks into a partitioned columnar table at root."""
+
+    def __init__(self, root, partition_cols=PARTITION_COLUMNS, row_group_size=ROW_GROUP_SIZE):
+        self.root = root
+        self.partition_cols = list(partition_cols)
+        self.row_group_size = row_group_size
+        self.schema = {}
+        self.encoder = CategoryEncoder()
+        self.row_groups = []
+        self._buffers = {}
+        self._parts = {}
+
+        # Only a table this module wrote may be replaced
+        if os.path.exists(os.path.join(root, MANIFEST_NAME)):
+            shutil.rmtree(root)
+        elif os.path.isdir(root) and os.listdir(root):
+            raise ValueError(f"'{root}' exists and is not a scored table")
+        os.makedirs(root, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def _update_schema(self, chunk):
+        for col in chunk.columns:
+            series = chunk[col]
+            if col not in self.schema:
+                self.schema[col] = ({'kind': 'category', 'categories': []}
+                                    if isinstance(series.dtype, pd.CategoricalDtype)
+                                    else {'kind': 'text', 'categories': []}
+                                    if series.dtype == object
+                                    else {'kind': 'numeric', 'dtype': series.dtype.str})
+            entry = self.schema[col]
+            if entry['kind'] != 'numeric':
+                entry['categories'] = self.encoder.update(col, series)
+
+    def write(self, chunk):
+        """Add a chunk of scored users (must include the partition columns)."""
+        chunk = chunk.drop(columns=[col for col in EXCLUDED_COLUMNS if col in chunk.columns])
+        self._update_schema(chunk)
+        keys = [chunk[col] for col in self.partition_cols]
+        for key, group in chunk.groupby(keys, sort=False, dropna=False, observed=True):
+            # NaN keys differ from each other, so map them to one None key
+            key = tuple(None if pd.isna(value) else value
+                        for value in (key if isinstance(key, tuple) else (key,)))
+            buffered = self._buffers.setdefault(key, [])
+            buffered.append(group.drop(columns=self.partition_cols))
+            if sum(len(frame) for frame in buffered) >= self.row_group_size:
+                self._flush(key)
+        return self
+
+    def _flush(self, key):
+        frames = self._buffers.pop(key, [])
+        if not frames:
+            return
+        frame = pd.concat(frames, ignore_index=True)
+        for start in range(0, len(frame), self.row_group_size):
+            self._write_row_group(key, frame.iloc[start:start + self.row_group_size])
+
+    def _write_row_group(self, key, frame):
+        partition = {col: _json_value(value) for col, value in zip(self.partition_cols, key)}
+        directory = os.path.join(*[
+            f"{col}={NULL_PARTITION if value is None else quote(str(value), safe='')}"
+            for col, value in partition.items()])
+        part = self._parts.get(key, 0)
+        self._parts[key] = part + 1
+        path = os.path.join(directory, f'part-{part:05d}.npz')
+        os.makedirs(os.path.join(self.root, directory), exist_ok=True)
+
+        arrays, dictionaries, stats = {}, {}, {}
+        for col in frame.columns:
+            series = frame[col]
+            if is_encoded(series):
+                codes, uniques = pd.factorize(series)
+                arrays[col] = codes.astype(code_dtype(len(uniques)))
+                dictionaries[col] = [str(v) for v in uniques]
+                stats[col] = {'values': dictionaries[col],
+                              'nulls': int((codes < 0).sum())}
+            else:
+                values = series.to_numpy()
+                arrays[col] = values
+                present = values[~np.isnan(values)] if values.dtype.kind == 'f' else values
+                stats[col] = {'min': _json_value(present.min()) if len(present) else None,
+                              'max': _json_value(present.max()) if len(present) else None,
+                              'nulls': len(values) - len(present)}
+        arrays['__meta__'] = np.array(json.dumps({'dictionaries': dictionaries}))
+        _save_arrays(os.path.join(self.root, path), arrays)
+
+        self.row_groups.append({'path': path, 'rows': len(frame), 'partition': partition,
+                                'stats': stats})
+
+    def close(self):
+        """Flush every partition and write the manifest; returns the manifest."""
+        for key in list(self._buffers):
+            self._flush(key)
+        manifest = {
+            'version': FORMAT_VERSION,
+            'partition_columns': self.partition_cols,
+            'schema': self.schema,
+            'rows': sum(group['rows'] for group in self.row_groups),
+            'row_groups': self.row_groups,
+        }
+        tmp_path = os.path.join(self.root, MANIFEST_NAME + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.root, MANIFEST_NAME))
+        return manifest
+
+def write_scored_table(chunks, root, partition_cols=PARTITION_COLUMNS,
+                       row_group_size=ROW_GROUP_SIZE):
+    """Write a scored DataFrame or an iterable of scored chunks to root."""
+    if isinstance(chunks, pd.DataFrame):
+        chunks = [chunks]
+    writer = PartitionedWriter(root, partition_cols, row_group_size)
+    for chunk in chunks:
+        writer.write(chunk)
+    return writer.close()
+
+def load_manifest(root):
+    """Return the manifest of the table at root."""
+    with open(os.path.join(root, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+def _may_match(group, col, op, value):
+    """Return False only if no row of the row group can satisfy col op value."""
+    if col in group['partition']:
+        value_at = group['partition'][col]
+        stats = {'values': [None if value_at is None else str(value_at)]}
+    else:
+        stats = group['stats'].get(col)
+    if stats is None:
+        return True
+    if 'values' in stats:
+        present = [v for v in stats['values'] if v is not None]
+        if op == 'in':
+            return any(str(v) in present for v in value)
+        if op == '!=':
+            return present != [str(value)] or stats.get('nulls', 0) > 0
+        if op == '==':
+            return str(value) in present
+        return True
+    low, high = stats['min'], stats['max']
+    if low is None:
+        return op == '!='
+    if op == 'in':
+        return any(low <= v <= high for v in value)
+    return {'==': low <= value <= high, '!=': not (low == high == value),
+            '<': low < value, '<=': low <= value,
+            '>': high > value, '>=': high >= value}[op]
+
+def _decode(arrays, meta, col, entry):
+    if entry['kind'] == 'numeric':
+        return arrays[col]
+    dictionary = np.array(meta['dictionaries'][col] + [np.nan], dtype=object)
+    values = dictionary[arrays[col]]  # code -1 picks the trailing NaN
+    if entry['kind'] == 'category':
+        return pd.Categorical(values, categories=entry['categories'])
+    return values
+
+def read_scored_table(root, columns=None, filters=None):
+    """
+    Read the table at root. filters is a list of (column, op, value) with op
+    one of ==, !=, <, <=, >, >=, in; row groups whose partition values or
+    statistics rule out a match are skipped without being opened.
+    """
+    manifest = load_manifest(root)
+    schema = manifest['schema']
+    columns = list(schema) if columns is None else list(columns)
+    filters = filters or []
+    # Filter columns are needed for the exact row mask, even if not returned
+    needed = list(dict.fromkeys(columns + [col for col, _, _ in filters]))
+
+    frames = []
+    for group in manifest['row_groups']:
+        if not all(_may_match(group, col, op, value) for col, op, value in filters):
+            continue
+        data = {}
+        with np.load(os.path.join(root, group['path'])) as arrays:
+            meta = json.loads(str(arrays['__meta__']))
+            for col in needed:
+                if col in group['partition']:
+                    value = group['partition'][col]
+                    data[col] = np.full(group['rows'], np.nan if value is None else value,
+                                        dtype=object)
+                    if schema[col]['kind'] == 'category':
+                        data[col] = pd.Categorical(data[col], categories=schema[col]['categories'])
+                else:
+                    data[col] = _decode(arrays, meta, col, schema[col])
+        frame = pd.DataFrame(data, columns=needed)
+        mask = np.ones(len(frame), dtype=bool)
+        for col, op, value in filters:
+            mask &= (frame[col].isin(value) if op == 'in'
+                     else _OPERATORS[op](frame[col], value)).to_numpy(dtype=bool)
+        frames.append(frame[mask])
+
+    if not frames:
+        return pd.DataFrame({col: pd.Series(dtype=object if schema[col]['kind'] == 'text'
+                                            else 'category' if schema[col]['kind'] == 'category'
+                                            else schema[col]['dtype'])
+                             for col in columns})
+    result = pd.concat(frames, ignore_index=True)
+    for col in result.columns:
+        if schema[col]['kind'] == 'category':
+            result[col] = pd.Categorical(result[col], categories=schema[col]['categories'])
+    return result[columns]
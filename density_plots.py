@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Density Rendering
+=================
+Pre-binned 2D grids and 1D histograms for the full-population panels in
+create_visualizations. Points are counted into fixed bins with one
+vectorised pass per chunk, grids from different chunks add up, and drawing
+costs depend on the number of bins rather than the number of users.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Scatter panels drawn from every user: name -> (x column, y column)
+SCATTER_PANELS = {
+    'friend_count_vs_score': ('friend_count', 'engagement_score'),
+    'tenure_vs_score': ('tenure', 'engagement_score'),
+    'likes_vs_likes_received': ('likes', 'likes_received'),
+    'mobile_vs_www_likes': ('mobile_likes', 'www_likes'),
+    'friend_count_vs_friendships_initiated': ('friend_count', 'friendships_initiated'),
+}
+
+# Histogram panels drawn from every user: column -> number of bins
+HISTOGRAM_PANELS = {
+    'engagement_score': 50,
+    'age': 30,
+}
+
+def _bin_index(values, edges):
+    """Return the bin of each value, or -1 for missing and out-of-range values."""
+    values = np.asarray(values, dtype=np.float64)
+    n_bins = len(edges) - 1
+    low, high = edges[0], edges[-1]
+    span = (high - low) or 1.0
+    index = np.floor((values - low) * (n_bins / span))
+    index[values == high] = n_bins - 1
+    index[~((values >= low) & (values <= high))] = -1
+    return index.astype(np.int64)
+
+class Histogram1D:
+    """Counts over fixed bin edges, mergeable across chunks."""
+
+    def __init__(self, value_range, bins=50):
+        self.edges = np.linspace(value_range[0], value_range[1], bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def update(self, values):
+        """Count a chunk of values."""
+        index = _bin_index(values, self.edges)
+        self.counts += np.bincount(index[index >= 0], minlength=len(self.counts))
+        return self
+
+    def merge(self, other):
+        """Add another histogram with the same edges."""
+        self.counts += other.counts
+        return self
+
+    def draw(self, ax, **kwargs):
+        """Draw the histogram on a matplotlib axes."""
+        style = {'fill': True, 'edgecolor': 'black', 'alpha': 0.7}
+        style.update(kwargs)
+        ax.stairs(self.counts, self.edges, **style)
+
+class DensityGrid:
+    """2D point counts over a fixed grid, mergeable across chunks."""
+
+    def __init__(self, x_range, y_range, bins=200):
+        x_bins, y_bins = (bins, bins) if np.isscalar(bins) else bins
+        self.x_edges = np.linspace(x_range[0], x_range[1], x_bins + 1)
+        self.y_edges = np.linspace(y_range[0], y_range[1], y_bins + 1)
+        self.counts = np.zeros((x_bins, y_bins), dtype=np.int64)
+
+    def update(self, x, y):
+        """Count a chunk of (x, y) points."""
+        x_index = _bin_index(x, self.x_edges)
+        y_index = _bin_index(y, self.y_edges)
+        valid = (x_index >= 0) & (y_index >= 0)
+        flat = x_index[valid] * self.counts.shape[1] + y_index[valid]
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+        return self
+
+    def merge(self, other):
+        """Add another grid with the same edges."""
+        self.counts += other.counts
+        return self
+
+    def draw(self, ax, cmap='viridis'):
+        """Draw the grid as a log-scaled image on a matplotlib axes."""
+        from matplotlib.colors import LogNorm
+        counts = np.ma.masked_equal(self.counts.T, 0)
+        extent = [self.x_edges[0], self.x_edges[-1], self.y_edges[0], self.y_edges[-1]]
+        ax.imshow(counts, origin='lower', extent=extent, aspect='auto', cmap=cmap,
+                  norm=LogNorm(vmin=1, vmax=max(int(self.counts.max()), 1)),
+                  interpolation='nearest')
+
+def density_columns():
+    """Return every column the density panels read."""
+    columns = [col for pair in SCATTER_PANELS.values() for col in pair]
+    return list(dict.fromkeys(columns + list(HISTOGRAM_PANELS)))
+
+def column_ranges(df, columns=None):
+    """Return the (min, max) of each density column in df."""
+    columns = density_columns() if columns is None else columns
+    return {col: (df[col].min(), df[col].max()) for col in columns}
+
+def merge_ranges(ranges, other):
+    """Combine two sets of column ranges, ignoring missing values."""
+    if ranges is None:
+        return other
+    return {col: (np.fmin(ranges[col][0], other[col][0]), np.fmax(ranges[col][1], other[col][1]))
+            for col in ranges}
+
+def build_density_grids(chunks, ranges=None, bins=200):
+    """
+    Bin every density panel from a DataFrame or an iterable of chunks.
+    Streaming callers must pass ranges (e.g. merged column_ranges from a
+    first pass) so every chunk uses the same bins.
+    """
+    if isinstance(chunks, pd.DataFrame):
+        ranges = column_ranges(chunks) if ranges is None else ranges
+        chunks = [chunks]
+    grids = {name: DensityGrid(ranges[x], ranges[y], bins)
+             for name, (x, y) in SCATTER_PANELS.items()}
+    grids.update({col: Histogram1D(ranges[col], n_bins)
+                  for col, n_bins in HISTOGRAM_PANELS.items()})
+    for chunk in chunks:
+        for name, (x, y) in SCATTER_PANELS.items():
+            grids[name].update(chunk[x].values, chunk[y].values)
+        for col in HISTOGRAM_PANELS:
+            grids[col].update(chunk[col].values)
+    return grids
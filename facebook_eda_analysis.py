@@ -6,26 +6,220 @@ This script performs exploratory data analysis on Facebook user data to identify
 valuable users that can be focused on to increase business.
 """
 
+import json
+import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 import warnings
+from column_store import default_store_dir, is_store, load_columns, store_is_fresh
+from density_plots import build_density_grids
+from quantile_sketch import QuantileSketch, GroupedQuantileSketch
+from segment_cube import SegmentCube, category_codes, cut_codes
+from source_files import is_fresh, source_record
+from summary_stats import SummaryStats
+from score_ranking import ScoreRanking
+from tracing import span, traced, traced_chunks
 warnings.filterwarnings('ignore')
 
-# Set style for better visualizations
-plt.style.use('seaborn-v0_8-darkgrid')
-sns.set_palette("husl")
+# Default location of the dataset and generated outputs; override with the
+# FACEBOOK_EDA_DIR environment variable or the data_path/output_dir arguments
+BASE_DIR = os.environ.get('FACEBOOK_EDA_DIR', '/home/runner/work/Facebook-eda/Facebook-eda')
+DATA_PATH = os.path.join(BASE_DIR, 'pseudo_facebook.csv')
 
-def load_data(filepath):
-    """Load the Facebook dataset."""
-    df = pd.read_csv(filepath)
+# Compact dtypes for the pseudo_facebook.csv schema. Counts fit comfortably
+# in int32; tenure stays float because it has missing values.
+COLUMN_DTYPES = {
+    'userid': 'int32',
+    'age': 'int16',
+    'dob_day': 'int8',
+    'dob_year': 'int16',
+    'dob_month': 'int8',
+    'gender': 'category',
+    'tenure': 'float32',
+    'friend_count': 'int32',
+    'friendships_initiated': 'int32',
+    'likes': 'int32',
+    'likes_received': 'int32',
+    'mobile_likes': 'int32',
+    'mobile_likes_received': 'int32',
+    'www_likes': 'int32',
+    'www_likes_received': 'int32',
+}
+
+# Columns each pipeline stage reads, so callers can load only what they need
+STAGE_COLUMNS = {
+    'score': ['userid', 'friend_count', 'friendships_initiated', 'likes', 'likes_received',
+              'tenure', 'mobile_likes', 'www_likes', 'mobile_likes_received',
+              'www_likes_received'],
+    'demographics': ['age', 'gender'],
+    'platform': ['mobile_likes', 'www_likes'],
+    'valuable_users': ['userid', 'age', 'gender', 'tenure', 'friend_count',
+                       'friendships_initiated', 'likes', 'likes_received'],
+}
+
+CACHE_VERSION = 2
+
+def stage_columns(*stages):
+    """Return the union of the columns needed by the given stages, in schema order."""
+    needed = set()
+    for stage in stages:
+        needed.update(STAGE_COLUMNS[stage])
+    return [col for col in COLUMN_DTYPES if col in needed]
+
+def _save_cache(cache_path, arrays, meta):
+    arrays['__meta__'] = np.array(json.dumps(meta))
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, cache_path)
+
+def _cache_meta(cache_path, filepath):
+    """Return the metadata of the cache for filepath, or None if it is missing or stale."""
+    if not os.path.exists(cache_path):
+        return None
+    with np.load(cache_path) as cache:
+        meta = json.loads(str(cache['__meta__']))
+    if meta['version'] != CACHE_VERSION or not is_fresh(meta, filepath):
+        return None
+    stat = os.stat(filepath)
+    if meta['mtime_ns'] != stat.st_mtime_ns:
+        # Same content under a new mtime (copied or touched): record the new
+        # mtime so later loads skip hashing again
+        meta['mtime_ns'] = stat.st_mtime_ns
+        try:
+            with np.load(cache_path) as cache:
+                arrays = {name: cache[name] for name in cache.files if name != '__meta__'}
+            _save_cache(cache_path, arrays, meta)
+        except OSError:
+            pass
+    return meta
+
+def _cache_covers(meta, columns):
+    """Whether a cache holds the columns (all of the CSV's when columns is None)."""
+    if meta is None:
+        return False
+    return meta['complete'] if columns is None else set(columns) <= set(meta['columns'])
+
+def _read_cache(cache_path, meta, columns):
+    """Return the cached columns (all when columns is None) as a frame."""
+    data = {}
+    with np.load(cache_path) as cache:
+        for col in (columns or meta['columns']):
+            if col in meta['categories']:
+                data[col] = pd.Categorical.from_codes(cache[col], meta['categories'][col])
+            else:
+                data[col] = cache[col]
+    return pd.DataFrame(data)
+
+def _write_cache(cache_path, filepath, df, complete=True):
+    """
+    Write df to a columnar binary cache keyed on the source file. complete
+    marks a cache holding every column of the CSV.
+    """
+    meta = {
+        'version': CACHE_VERSION,
+        **source_record(filepath),
+        'columns': list(df.columns),
+        'complete': complete,
+        'categories': {},
+    }
+    arrays = {}
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            meta['categories'][col] = [str(c) for c in df[col].cat.categories]
+            arrays[col] = df[col].cat.codes.values
+        else:
+            arrays[col] = df[col].values
+    _save_cache(cache_path, arrays, meta)
+
+def read_typed_csv(filepath, columns=None, **kwargs):
+    """Parse a CSV with the compact schema dtypes."""
+    return pd.read_csv(filepath, usecols=columns, dtype=COLUMN_DTYPES, **kwargs)
+
+@traced
+def load_data(filepath, columns=None, use_cache=True, cache_path=None):
+    """
+    Load the Facebook dataset.
+    Columns are parsed with compact dtypes and the parsed frame is cached in
+    a binary columnar file next to the CSV, so later loads skip parsing.
+    Pass columns (e.g. stage_columns('score')) to load only what is needed;
+    only those columns, plus any already cached, are parsed on a cache miss.
+    filepath may also be a column store (see column_store.py); a fresh store
+    next to the CSV is memory-mapped instead of reading the cache.
+    """
+    df = None
+    store_dir = filepath if is_store(filepath) else default_store_dir(filepath)
+    if is_store(filepath) or (use_cache and store_is_fresh(store_dir, filepath)):
+        df = load_columns(store_dir, columns)
+        print("Dataset memory-mapped from column store!")
+    elif use_cache:
+        cache_path = cache_path or filepath + '.cache.npz'
+        try:
+            meta = _cache_meta(cache_path, filepath)
+            df = _read_cache(cache_path, meta, columns) if _cache_covers(meta, columns) else None
+        except (OSError, ValueError, KeyError):
+            meta, df = None, None
+        if df is not None:
+            print("Dataset loaded from cache!")
+        else:
+            # Keep the columns already cached, so the cache grows to what is used
+            parse = None if columns is None else list(dict.fromkeys(
+                list(columns) + (meta['columns'] if meta is not None else [])))
+            df = read_typed_csv(filepath, parse)
+            try:
+                _write_cache(cache_path, filepath, df, complete=parse is None)
+            except OSError as e:
+                print(f"Could not write cache '{cache_path}': {e}")
+            if columns is not None:
+                df = df[columns]
+    else:
+        df = read_typed_csv(filepath, columns)
+    
     print("Dataset loaded successfully!")
     print(f"Shape: {df.shape}")
     return df
 
-def explore_data(df):
-    """Perform initial data exploration."""
+def describe_series(series, sketch_error=None):
+    """series.describe(), with sketched quartiles when sketch_error is set."""
+    if sketch_error is None:
+        return series.describe()
+    return QuantileSketch.from_values(series, sketch_error).describe(series.name)
+
+def grouped_summary(df, by, value, aggs, sketch_error=None):
+    """df.groupby(by)[value].agg(aggs), with sketched medians and percentiles when sketch_error is set."""
+    if sketch_error is None:
+        return df.groupby(by)[value].agg(aggs)
+    sketch = GroupedQuantileSketch(sketch_error)
+    valid = df[by].notna()
+    sketch.update(df.loc[valid, by].values, df.loc[valid, value].values)
+    index = df[by].cat.categories if isinstance(df[by].dtype, pd.CategoricalDtype) else None
+    summary = sketch.agg(aggs, index=index)
+    summary.index.name = by
+    return summary
+
+def print_summary(stats, quartiles=None):
+    """Print the exploration report from a summary_stats.SummaryStats."""
+    print("\nDataset Info:")
+    print(f"{stats.rows:,} entries, {len(stats.dtypes)} columns")
+    print(stats.info())
+    
+    print("\nStatistical Summary:")
+    print(stats.describe(quartiles))
+    
+    print("\nMissing Values:")
+    print(stats.nulls)
+    
+    if 'gender' in stats.counts:
+        print("\nGender Distribution:")
+        print(stats.value_counts('gender'))
+
+@traced
+def explore_data(df, sketch_error=None):
+    """
+    Perform initial data exploration.
+    Counts, nulls, moments and value counts come from one SummaryStats pass;
+    exact quartiles need their own pass unless sketch_error is set.
+    """
     print("\n" + "="*80)
     print("DATA EXPLORATION")
     print("="*80)
@@ -33,21 +227,146 @@ def explore_data(df):
     print("\nFirst 5 rows:")
     print(df.head())
     
-    print("\nDataset Info:")
-    print(df.info())
-    
-    print("\nStatistical Summary:")
-    print(df.describe())
-    
-    print("\nMissing Values:")
-    print(df.isnull().sum())
+    stats = SummaryStats.from_frame(df, sketch_error)
+    quartiles = None if sketch_error else df[stats.numeric].quantile([0.25, 0.5, 0.75])
+    print_summary(stats, quartiles)
     
-    print("\nGender Distribution:")
-    print(df['gender'].value_counts())
+    return df
+
+# Features that make up the engagement score and their weights.
+# Higher weights for active engagement (giving likes, initiating friendships)
+ENGAGEMENT_WEIGHTS = {
+    'friend_count': 0.25,
+    'friendships_initiated': 0.20,
+    'likes': 0.20,
+    'likes_received': 0.20,
+    'tenure': 0.15,
+}
+
+# Columns of the correlation heatmap
+CORRELATION_COLUMNS = ['friend_count', 'friendships_initiated', 'likes', 'likes_received',
+                       'tenure', 'engagement_score']
+
+CATEGORY_BINS = [0, 0.2, 0.5, 0.8, 1.0]
+CATEGORY_LABELS = ['Low Engagement', 'Medium Engagement',
+                   'High Engagement', 'Very High Engagement']
+
+# Columns of valuable_users_list.csv
+VALUABLE_USER_COLUMNS = ['userid', 'age', 'gender', 'tenure', 'friend_count',
+                         'friendships_initiated', 'likes', 'likes_received',
+                         'engagement_score', 'user_category', 'primary_platform']
+
+# Percentile cut points of the engagement_quantile categories (deciles)
+QUANTILE_CUT_POINTS = [i / 10 for i in range(11)]
+
+def compute_feature_bounds(df):
+    """Return the (min, max) of every engagement feature in df."""
+    return {col: (df[col].min(), df[col].max()) for col in ENGAGEMENT_WEIGHTS}
+
+def merge_feature_bounds(bounds, other):
+    """Combine two sets of feature bounds, ignoring missing values."""
+    if bounds is None:
+        return other
+    return {col: (np.fmin(bounds[col][0], other[col][0]),
+                  np.fmax(bounds[col][1], other[col][1]))
+            for col in ENGAGEMENT_WEIGHTS}
+
+def engagement_feature_matrix(df, dtype=np.float64):
+    """Return the engagement features of df as one column-contiguous matrix."""
+    features = np.empty((len(df), len(ENGAGEMENT_WEIGHTS)), dtype=dtype, order='F')
+    for j, col in enumerate(ENGAGEMENT_WEIGHTS):
+        features[:, j] = df[col].values
+    return features
+
+def score_feature_matrix(features, bounds, weights=None, out=None, block_size=65536):
+    """
+    Compute engagement scores from an (n_users, n_features) matrix.
+    Features are normalised with bounds and summed with weights block by
+    block, reusing one scratch buffer, so the only full-size allocation is
+    the output. In float64 the result is bit-identical to normalising each
+    column separately and adding up the weighted columns.
+    """
+    if weights is None:
+        weights = ENGAGEMENT_WEIGHTS
+    if isinstance(weights, dict):
+        weights = [weights[col] for col in ENGAGEMENT_WEIGHTS]
+    dtype = features.dtype
+    mins = [dtype.type(bounds[col][0]) for col in ENGAGEMENT_WEIGHTS]
+    denoms = [dtype.type(float(bounds[col][1]) - float(bounds[col][0]) + 1e-10)
+              for col in ENGAGEMENT_WEIGHTS]
+    
+    n_users = features.shape[0]
+    if out is None:
+        out = np.empty(n_users, dtype=dtype)
+    scratch = np.empty(min(block_size, n_users), dtype=dtype)
+    
+    for start in range(0, n_users, block_size):
+        stop = min(start + block_size, n_users)
+        block_out = out[start:stop]
+        tmp = scratch[:stop - start]
+        block_out[:] = 0
+        for j, weight in enumerate(weights):
+            np.subtract(features[start:stop, j], mins[j], out=tmp)
+            np.divide(tmp, denoms[j], out=tmp)
+            np.multiply(tmp, weight, out=tmp)
+            np.add(block_out, tmp, out=block_out)
+    return out
+
+def apply_engagement_score(df, bounds, keep_intermediate=False, weights=None):
+    """
+    Score df in place using precomputed feature bounds.
+    Using the global bounds of the full population on every chunk gives
+    exactly the same scores as scoring the whole frame at once. The
+    *_norm and total_likes columns are only added if keep_intermediate is set.
+    weights overrides ENGAGEMENT_WEIGHTS (a dict keyed by feature).
+    """
+    df['engagement_score'] = score_feature_matrix(engagement_feature_matrix(df), bounds, weights)
+    
+    if keep_intermediate:
+        # Normalize features to 0-1 scale
+        for col in ENGAGEMENT_WEIGHTS:
+            col_min, col_max = (float(b) for b in bounds[col])
+            df[f'{col}_norm'] = (df[col].astype(np.float64) - col_min) / (col_max - col_min + 1e-10)
+        
+        # Calculate total engagement (mobile + www)
+        df['total_likes'] = df['mobile_likes'] + df['www_likes']
+        df['total_likes_received'] = df['mobile_likes_received'] + df['www_likes_received']
     
+    # Categorize users
+    df['user_category'] = pd.cut(df['engagement_score'], 
+                                   bins=CATEGORY_BINS,
+                                   labels=CATEGORY_LABELS)
     return df
 
-def create_engagement_score(df):
+def add_rank_columns(df, cut_points=None, labels=None):
+    """
+    Sort the scores once and add engagement_rank (1 = best, ties broken by
+    userid), dense_rank, percentile_rank and engagement_quantile (the
+    percentile bucket between cut_points, QUANTILE_CUT_POINTS by default).
+    Returns the ScoreRanking.
+    """
+    ranking = ScoreRanking.from_scores(df['engagement_score'].values, df['userid'].values)
+    df['engagement_rank'] = ranking.ranks()
+    df['dense_rank'] = ranking.dense_ranks()
+    df['percentile_rank'] = ranking.percentile_ranks()
+    df['engagement_quantile'] = ranking.quantile_categories(cut_points or QUANTILE_CUT_POINTS,
+                                                            labels)
+    return ranking
+
+def score_ranking(df):
+    """
+    Return the ScoreRanking of a scored frame. Frames ranked by
+    add_rank_columns carry engagement_rank, which is inverted in linear time
+    instead of sorting the scores again (unless the scores changed since).
+    """
+    if 'engagement_rank' in df.columns:
+        return ScoreRanking.from_ranks(df['engagement_rank'].values, df['engagement_score'].values,
+                                      df['userid'].values)
+    return ScoreRanking.from_scores(df['engagement_score'].values, df['userid'].values)
+
+@traced
+def create_engagement_score(df, keep_intermediate=False, sketch_error=None, weights=None,
+                            quantiles=None):
     """
     Create an engagement score to identify valuable users.
     Considers multiple factors:
@@ -55,139 +374,372 @@ def create_engagement_score(df):
     - Likes given and received
     - Mobile and web engagement
     - Tenure (loyalty)
+    Users are then ranked with one sort (see add_rank_columns); quantiles
+    overrides its QUANTILE_CUT_POINTS. Set keep_intermediate to also keep
+    the normalised feature columns, sketch_error to report quartiles from a
+    quantile sketch, and weights to override ENGAGEMENT_WEIGHTS.
     """
     print("\n" + "="*80)
     print("CREATING ENGAGEMENT SCORE")
     print("="*80)
     
-    # Normalize features to 0-1 scale
-    df['friend_count_norm'] = (df['friend_count'] - df['friend_count'].min()) / \
-                               (df['friend_count'].max() - df['friend_count'].min() + 1e-10)
-    
-    df['friendships_initiated_norm'] = (df['friendships_initiated'] - df['friendships_initiated'].min()) / \
-                                        (df['friendships_initiated'].max() - df['friendships_initiated'].min() + 1e-10)
-    
-    df['likes_norm'] = (df['likes'] - df['likes'].min()) / \
-                       (df['likes'].max() - df['likes'].min() + 1e-10)
+    apply_engagement_score(df, compute_feature_bounds(df), keep_intermediate, weights)
+    ranking = add_rank_columns(df, quantiles)
     
-    df['likes_received_norm'] = (df['likes_received'] - df['likes_received'].min()) / \
-                                 (df['likes_received'].max() - df['likes_received'].min() + 1e-10)
-    
-    df['tenure_norm'] = (df['tenure'] - df['tenure'].min()) / \
-                        (df['tenure'].max() - df['tenure'].min() + 1e-10)
+    print("\nEngagement Score Statistics:")
+    if sketch_error is None:
+        print(ranking.describe('engagement_score'))
+    else:
+        print(describe_series(df['engagement_score'], sketch_error))
     
-    # Calculate total engagement (mobile + www)
-    df['total_likes'] = df['mobile_likes'] + df['www_likes']
-    df['total_likes_received'] = df['mobile_likes_received'] + df['www_likes_received']
+    print("\nUser Category Distribution:")
+    print(df['user_category'].value_counts().sort_index())
     
-    # Create weighted engagement score
-    # Higher weights for active engagement (giving likes, initiating friendships)
-    df['engagement_score'] = (
-        0.25 * df['friend_count_norm'] +
-        0.20 * df['friendships_initiated_norm'] +
-        0.20 * df['likes_norm'] +
-        0.20 * df['likes_received_norm'] +
-        0.15 * df['tenure_norm']
-    )
+    print("\nEngagement Quantile Distribution:")
+    print(df['engagement_quantile'].value_counts().sort_index())
     
-    # Categorize users
-    df['user_category'] = pd.cut(df['engagement_score'], 
-                                   bins=[0, 0.2, 0.5, 0.8, 1.0],
-                                   labels=['Low Engagement', 'Medium Engagement', 
-                                          'High Engagement', 'Very High Engagement'])
+    return df
+
+@traced
+def compute_feature_bounds_chunked(filepath, chunksize=1_000_000, prefetch=0):
+    """First pass of out-of-core scoring: stream the CSV and collect feature bounds."""
+    from chunk_reader import csv_chunks
+    bounds = None
+    chunks = csv_chunks(filepath, list(ENGAGEMENT_WEIGHTS), chunksize, prefetch)
+    for chunk in traced_chunks('read_chunk', chunks):
+        bounds = merge_feature_bounds(bounds, compute_feature_bounds(chunk))
+    return bounds
+
+@traced
+def score_csv_chunked(filepath, output_path, chunksize=1_000_000, valuable_users=None,
+                      sketch_error=0.001, table=None, summary=None, prefetch=0):
+    """
+    Score a CSV that does not fit in memory.
+    The first pass collects global feature bounds, the second pass scores
+    each chunk and appends it to output_path (skipped if output_path is
+    None). Peak memory depends on chunksize only, and scores match
+    create_engagement_score exactly.
+    Pass a topk.TopKBuffer as valuable_users to collect the top users on the
+    way; they get the primary_platform column that save_valuable_users writes.
+    Pass a columnar_output.PartitionedWriter or userid_index.UseridIndexWriter
+    (or a list of them) as table to stream the full scored table, with
+    platform and age group columns, to it.
+    Pass a summary_stats.SummaryStats as summary to collect counts, moments,
+    correlations and value counts of the scored chunks in the same pass.
+    Score quartiles are reported from a quantile sketch with sketch_error.
+    With prefetch set, up to that many chunks are parsed on background
+    threads while the current one is scored (see chunk_reader.py).
+    """
+    from chunk_reader import csv_chunks
+    print("\n" + "="*80)
+    print("CREATING ENGAGEMENT SCORE (CHUNKED)")
+    print("="*80)
     
+    bounds = compute_feature_bounds_chunked(filepath, chunksize, prefetch)
+    
+    total_users = 0
+    category_counts = pd.Series(0, index=CATEGORY_LABELS)
+    score_sketch = QuantileSketch(sketch_error)
+    tables = [] if table is None else table if isinstance(table, list) else [table]
+    chunks = csv_chunks(filepath, chunksize=chunksize, prefetch=prefetch)
+    for i, chunk in enumerate(traced_chunks('read_chunk', chunks)):
+        with span('score_chunk', len(chunk), chunk=i):
+            apply_engagement_score(chunk, bounds)
+            if summary is not None:
+                summary.update(chunk)
+            if output_path is not None:
+                chunk.to_csv(output_path, mode='w' if i == 0 else 'a', header=(i == 0),
+                             index=False)
+            total_users += len(chunk)
+            score_sketch.update(chunk['engagement_score'].values)
+            category_counts += chunk['user_category'].value_counts().reindex(CATEGORY_LABELS)
+            if valuable_users is not None or tables:
+                add_platform_columns(chunk)
+            if valuable_users is not None:
+                valuable_users.update(chunk)
+            if tables:
+                add_age_group(chunk)
+            for writer in tables:
+                writer.write(chunk)
+    
+    print(f"\nScored {total_users:,} users in chunks of {chunksize:,}")
     print("\nEngagement Score Statistics:")
-    print(df['engagement_score'].describe())
-    
+    print(score_sketch.describe('engagement_score'))
     print("\nUser Category Distribution:")
-    print(df['user_category'].value_counts().sort_index())
+    print(category_counts)
+    if output_path is not None:
+        print(f"\nScored users saved to '{output_path}'")
     
+    return bounds
+
+def save_feature_bounds(bounds, filepath):
+    """Save feature bounds from a scoring run so later runs can rescore incrementally."""
+    with open(filepath, 'w') as f:
+        json.dump({col: [float(lo), float(hi)] for col, (lo, hi) in bounds.items()}, f, indent=2)
+
+def load_feature_bounds(filepath):
+    """Load feature bounds saved by save_feature_bounds."""
+    with open(filepath) as f:
+        return {col: tuple(value) for col, value in json.load(f).items()}
+
+@traced
+def rescore_incremental(df, delta, bounds):
+    """
+    Apply a delta of new and updated users to an already scored frame.
+    Only the delta rows are scored. If a delta row widens a feature's
+    bounds, the existing scores are corrected with a vectorised affine
+    adjustment for that feature rather than a full rescore. Bounds only
+    ever widen; run create_engagement_score to tighten them again.
+    Returns the updated frame and the new bounds.
+    """
+    print("\n" + "="*80)
+    print("INCREMENTAL RESCORING")
+    print("="*80)
+    
+    new_bounds = merge_feature_bounds(bounds, compute_feature_bounds(delta))
+    moved = [col for col in ENGAGEMENT_WEIGHTS
+             if tuple(map(float, new_bounds[col])) != tuple(map(float, bounds[col]))]
+    
+    # Each feature's term is affine in the feature value, so moving its
+    # bounds shifts every score by alpha * x + beta
+    if moved:
+        correction = np.zeros(len(df))
+        for col in moved:
+            weight = ENGAGEMENT_WEIGHTS[col]
+            old_min, old_max = map(float, bounds[col])
+            new_min, new_max = map(float, new_bounds[col])
+            old_denom = old_max - old_min + 1e-10
+            new_denom = new_max - new_min + 1e-10
+            alpha = weight * (1 / new_denom - 1 / old_denom)
+            beta = weight * (old_min / old_denom - new_min / new_denom)
+            correction += alpha * df[col].to_numpy(np.float64) + beta
+        df['engagement_score'] = df['engagement_score'].values + correction
+        df['user_category'] = pd.cut(df['engagement_score'], bins=CATEGORY_BINS,
+                                     labels=CATEGORY_LABELS)
+    
+    delta = delta.copy()
+    delta['engagement_score'] = score_feature_matrix(engagement_feature_matrix(delta), new_bounds)
+    delta['user_category'] = pd.cut(delta['engagement_score'], bins=CATEGORY_BINS,
+                                    labels=CATEGORY_LABELS)
+    
+    # Overwrite updated users in place, append the new ones
+    positions = pd.Index(df['userid']).get_indexer(delta['userid'])
+    is_update = positions >= 0
+    for col in delta.columns.intersection(df.columns):
+        df.iloc[positions[is_update], df.columns.get_loc(col)] = delta.loc[is_update, col].values
+    new_users = delta.loc[~is_update].reindex(columns=df.columns)
+    if len(new_users):
+        df = pd.concat([df, new_users], ignore_index=True)
+    # Every score may have moved, so ranks are recomputed with one new sort
+    if 'engagement_rank' in df.columns:
+        add_rank_columns(df)
+    
+    print(f"\nUpdated users: {is_update.sum():,}")
+    print(f"New users: {(~is_update).sum():,}")
+    print(f"Bounds moved: {', '.join(moved) if moved else 'none'}")
+    
+    return df, new_bounds
+
+AGE_BINS = [0, 18, 25, 35, 50, 100]
+AGE_LABELS = ['<18', '18-25', '26-35', '36-50', '50+']
+
+TENURE_BINS = [0, 100, 365, 730, 10000]
+TENURE_LABELS = ['<100d', '100-365d', '1-2y', '2y+']
+
+# Primary platforms in the order a groupby on the column lists them
+PLATFORM_LABELS = ['Both', 'Mobile', 'None', 'Web']
+
+# Score thresholds used by the recommendations
+HIGH_ENGAGEMENT_SCORE = 0.5
+LOW_ENGAGEMENT_SCORE = 0.2
+
+# Per-user values aggregated in the segment cube
+CUBE_MEASURES = ['engagement_score', 'age', 'friend_count', 'likes', 'tenure']
+
+# Measures the cube keeps values (or sketches) of, for medians
+CUBE_QUANTILE_MEASURES = ['engagement_score']
+
+def add_age_group(df, age_bins=None, age_labels=None):
+    """Add the age_group column used by the demographic reports."""
+    df['age_group'] = pd.cut(df['age'], bins=age_bins or AGE_BINS,
+                              labels=age_labels or AGE_LABELS)
     return df
 
-def analyze_demographics(df):
-    """Analyze demographics and their relationship with engagement."""
+@traced
+def analyze_demographics(df, sketch_error=None, age_bins=None, age_labels=None, cube=None):
+    """
+    Analyze demographics and their relationship with engagement.
+    With sketch_error set, medians and quartiles come from quantile sketches.
+    age_bins/age_labels override AGE_BINS/AGE_LABELS. Segment figures are
+    read from cube (see segment_cube), which is built here if not given.
+    """
     print("\n" + "="*80)
     print("DEMOGRAPHIC ANALYSIS")
     print("="*80)
     
     print("\nAge Distribution:")
-    print(df['age'].describe())
+    print(describe_series(df['age'], sketch_error))
+    
+    if cube is None or 'age_group' not in df.columns:
+        add_age_group(df, age_bins, age_labels)
+    if cube is None:
+        cube = segment_cube(df, sketch_error)
     
     print("\nEngagement by Gender:")
-    gender_engagement = df.groupby('gender')['engagement_score'].agg(['mean', 'median', 'std'])
+    gender_engagement = cube.agg('gender', 'engagement_score', ['mean', 'median', 'std'])
     print(gender_engagement)
     
     print("\nEngagement by Age Groups:")
-    df['age_group'] = pd.cut(df['age'], bins=[0, 18, 25, 35, 50, 100],
-                              labels=['<18', '18-25', '26-35', '36-50', '50+'])
-    age_engagement = df.groupby('age_group')['engagement_score'].agg(['mean', 'median', 'count'])
+    age_engagement = cube.agg('age_group', 'engagement_score', ['mean', 'median', 'count'])
     print(age_engagement)
     
     return df
 
-def identify_valuable_users(df, top_n=1000):
+@traced
+def identify_valuable_users(df, top_n=1000, sketch_error=None):
     """Identify the most valuable users based on engagement score."""
+    # Ties are broken by userid so the list does not depend on row order
+    valuable_users = df.iloc[score_ranking(df).top(top_n)]
+    report_valuable_users(valuable_users, top_n, sketch_error)
+    return valuable_users
+
+def report_valuable_users(valuable_users, top_n, sketch_error=None):
+    """Print the profile of the top_n valuable users, however they were selected."""
     print("\n" + "="*80)
     print(f"IDENTIFYING TOP {top_n} VALUABLE USERS")
     print("="*80)
     
-    valuable_users = df.nlargest(top_n, 'engagement_score')
-    
     print(f"\nTop {top_n} Users Statistics:")
     print("\nFriend Count:")
-    print(valuable_users['friend_count'].describe())
+    print(describe_series(valuable_users['friend_count'], sketch_error))
     
     print("\nLikes Given:")
-    print(valuable_users['likes'].describe())
+    print(describe_series(valuable_users['likes'], sketch_error))
     
     print("\nLikes Received:")
-    print(valuable_users['likes_received'].describe())
+    print(describe_series(valuable_users['likes_received'], sketch_error))
     
     print("\nTenure (days):")
-    print(valuable_users['tenure'].describe())
+    print(describe_series(valuable_users['tenure'], sketch_error))
     
     print("\nGender Distribution of Top Users:")
     print(valuable_users['gender'].value_counts())
     
     print("\nAge Distribution of Top Users:")
-    print(valuable_users['age'].describe())
+    print(describe_series(valuable_users['age'], sketch_error))
+
+def platform_preferences(df):
+    """Return each user's share of likes given on mobile and on the web."""
+    total = (df['mobile_likes'] + df['www_likes'] + 1e-10).to_numpy()
+    return df['mobile_likes'].to_numpy() / total, df['www_likes'].to_numpy() / total
+
+def platform_codes(mobile_preference, www_preference):
+    """Return codes into PLATFORM_LABELS: Both, else Web, else Mobile, else None."""
+    both = (mobile_preference >= 0.3) & (mobile_preference <= 0.7)
+    return np.select([both, www_preference > 0.7, mobile_preference > 0.7],
+                     [PLATFORM_LABELS.index('Both'), PLATFORM_LABELS.index('Web'),
+                      PLATFORM_LABELS.index('Mobile')],
+                     PLATFORM_LABELS.index('None')).astype(np.int8)
+
+def add_platform_columns(df):
+    """Add the platform preference and primary_platform columns."""
+    # Calculate platform preferences
+    df['mobile_preference'], df['www_preference'] = platform_preferences(df)
     
-    return valuable_users
+    # Identify primarily mobile or web users
+    codes = platform_codes(df['mobile_preference'].values, df['www_preference'].values)
+    df['primary_platform'] = np.array(PLATFORM_LABELS, dtype=object)[codes]
+    return df
+
+def segment_cube(df, sketch_error=None, age_bins=None, age_labels=None):
+    """
+    Build the segment cube the reports read from: counts, sums and sums of
+    squares of CUBE_MEASURES (plus high/low engagement indicators) over
+    every combination of age group, gender, tenure group, user category and
+    primary platform. Existing age_group, user_category and primary_platform
+    columns are used as they are; missing ones are derived without adding
+    them to df. Needs a scored frame.
+    """
+    if 'age_group' in df.columns and age_bins is None:
+        age_group = category_codes(df['age_group'])
+    else:
+        age_group = cut_codes(df['age'], age_bins or AGE_BINS), age_labels or AGE_LABELS
+    if 'user_category' in df.columns:
+        user_category = category_codes(df['user_category'])
+    else:
+        user_category = cut_codes(df['engagement_score'], CATEGORY_BINS), CATEGORY_LABELS
+    if 'primary_platform' in df.columns:
+        platform = category_codes(df['primary_platform'], PLATFORM_LABELS)
+    else:
+        platform = platform_codes(*platform_preferences(df)), PLATFORM_LABELS
+    
+    dimensions = {
+        'age_group': age_group,
+        'gender': category_codes(df['gender']),
+        'tenure_group': (cut_codes(df['tenure'], TENURE_BINS), TENURE_LABELS),
+        'user_category': user_category,
+        'primary_platform': platform,
+    }
+    measures = {col: df[col].to_numpy(np.float64) for col in CUBE_MEASURES}
+    score = measures['engagement_score']
+    measures['high_engagement'] = (score > HIGH_ENGAGEMENT_SCORE).astype(np.float64)
+    measures['low_engagement'] = (score < LOW_ENGAGEMENT_SCORE).astype(np.float64)
+    return SegmentCube(dimensions, measures, quantile_measures=CUBE_QUANTILE_MEASURES,
+                       observed=['primary_platform'], sketch_error=sketch_error)
 
-def analyze_platform_usage(df):
-    """Analyze mobile vs web platform usage."""
+@traced
+def analyze_platform_usage(df, sketch_error=None, cube=None):
+    """Analyze mobile vs web platform usage, reading segment figures from cube."""
     print("\n" + "="*80)
     print("PLATFORM USAGE ANALYSIS")
     print("="*80)
     
-    # Calculate platform preferences
-    df['mobile_preference'] = df['mobile_likes'] / (df['mobile_likes'] + df['www_likes'] + 1e-10)
-    df['www_preference'] = df['www_likes'] / (df['mobile_likes'] + df['www_likes'] + 1e-10)
-    
-    # Identify primarily mobile or web users
-    df['primary_platform'] = 'None'
-    df.loc[df['mobile_preference'] > 0.7, 'primary_platform'] = 'Mobile'
-    df.loc[df['www_preference'] > 0.7, 'primary_platform'] = 'Web'
-    df.loc[(df['mobile_preference'] >= 0.3) & (df['mobile_preference'] <= 0.7), 'primary_platform'] = 'Both'
+    if cube is None or 'primary_platform' not in df.columns:
+        add_platform_columns(df)
+    if cube is None:
+        cube = segment_cube(df, sketch_error)
     
     print("\nPrimary Platform Distribution:")
-    print(df['primary_platform'].value_counts())
+    print(cube.size('primary_platform').sort_values(ascending=False))
     
     print("\nEngagement Score by Platform:")
-    platform_engagement = df.groupby('primary_platform')['engagement_score'].agg(['mean', 'median', 'count'])
+    platform_engagement = cube.agg('primary_platform', 'engagement_score',
+                                   ['mean', 'median', 'count'])
     print(platform_engagement)
     
     return df
 
-def generate_recommendations(df, valuable_users):
+def recommendation_metrics(df, valuable_users, cube=None):
+    """Return the numbers behind the business recommendations as a dict."""
+    if cube is None:
+        cube = segment_cube(df)
+    avg_likes_all = cube.mean('likes')
+    platform_users = cube.size('primary_platform')
+    return {
+        'total_users': cube.size(),
+        'high_engagement': int(cube.total('high_engagement')),
+        'low_engagement': int(cube.total('low_engagement')),
+        'top_gender': valuable_users['gender'].mode()[0],
+        'avg_age_top': valuable_users['age'].mean(),
+        'mobile_users': int(platform_users.get('Mobile', 0)),
+        'web_users': int(platform_users.get('Web', 0)),
+        'both_users': int(platform_users.get('Both', 0)),
+        'friends_ratio': valuable_users['friend_count'].mean() / cube.mean('friend_count'),
+        'likes_ratio': (valuable_users['likes'].mean() / avg_likes_all
+                        if avg_likes_all > 0 else None),
+    }
+
+@traced
+def generate_recommendations(df, valuable_users, cube=None):
     """Generate business recommendations based on analysis."""
     print("\n" + "="*80)
     print("BUSINESS RECOMMENDATIONS")
     print("="*80)
     
-    total_users = len(df)
-    high_engagement = len(df[df['engagement_score'] > 0.5])
-    low_engagement = len(df[df['engagement_score'] < 0.2])
+    metrics = recommendation_metrics(df, valuable_users, cube)
+    total_users = metrics['total_users']
+    high_engagement = metrics['high_engagement']
+    low_engagement = metrics['low_engagement']
     
     print(f"\n1. USER SEGMENTATION INSIGHTS:")
     print(f"   - Total Users: {total_users:,}")
@@ -195,28 +747,24 @@ def generate_recommendations(df, valuable_users):
     print(f"   - Low Engagement Users (score < 0.2): {low_engagement:,} ({low_engagement/total_users*100:.1f}%)")
     
     print(f"\n2. TARGET DEMOGRAPHICS:")
-    top_gender = valuable_users['gender'].mode()[0]
-    avg_age = valuable_users['age'].mean()
+    top_gender = metrics['top_gender']
+    avg_age = metrics['avg_age_top']
     print(f"   - Most engaged gender: {top_gender}")
     print(f"   - Average age of top users: {avg_age:.1f} years")
     
     print(f"\n3. PLATFORM STRATEGY:")
-    mobile_users = len(df[df['primary_platform'] == 'Mobile'])
-    web_users = len(df[df['primary_platform'] == 'Web'])
-    both_users = len(df[df['primary_platform'] == 'Both'])
+    mobile_users = metrics['mobile_users']
+    web_users = metrics['web_users']
+    both_users = metrics['both_users']
     print(f"   - Mobile-first users: {mobile_users:,} ({mobile_users/total_users*100:.1f}%)")
     print(f"   - Web-first users: {web_users:,} ({web_users/total_users*100:.1f}%)")
     print(f"   - Cross-platform users: {both_users:,} ({both_users/total_users*100:.1f}%)")
     
     print(f"\n4. ENGAGEMENT DRIVERS:")
-    avg_friends_top = valuable_users['friend_count'].mean()
-    avg_friends_all = df['friend_count'].mean()
-    print(f"   - Top users have {avg_friends_top/avg_friends_all:.1f}x more friends than average")
+    print(f"   - Top users have {metrics['friends_ratio']:.1f}x more friends than average")
     
-    avg_likes_top = valuable_users['likes'].mean()
-    avg_likes_all = df['likes'].mean()
-    if avg_likes_all > 0:
-        print(f"   - Top users give {avg_likes_top/avg_likes_all:.1f}x more likes than average")
+    if metrics['likes_ratio'] is not None:
+        print(f"   - Top users give {metrics['likes_ratio']:.1f}x more likes than average")
     
     print(f"\n5. RECOMMENDATIONS:")
     print(f"   a) Focus retention efforts on the top {high_engagement:,} highly engaged users")
@@ -227,32 +775,63 @@ def generate_recommendations(df, valuable_users):
     
     return
 
-def create_visualizations(df, valuable_users):
-    """Create comprehensive visualizations."""
-    print("\n" + "="*80)
-    print("GENERATING VISUALIZATIONS")
-    print("="*80)
+def load_plotting():
+    """
+    Import matplotlib and seaborn and apply the dashboard style.
+    Plotting libraries are only imported here so scoring and reporting
+    do not pay their import time.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    
+    # Set style for better visualizations
+    plt.style.use('seaborn-v0_8-darkgrid')
+    sns.set_palette("husl")
+    return plt, sns
+
+DASHBOARD_FILES = ['facebook_eda_visualizations.png', 'facebook_eda_detailed_analysis.png']
+
+def _scatter_panel(df, grids, name, x, y):
+    """Draw a full-population scatter, or its pre-binned density grid."""
+    import matplotlib.pyplot as plt
+    if grids is None:
+        plt.scatter(df[x], df[y], alpha=0.1)
+    else:
+        grids[name].draw(plt.gca())
+
+def _histogram_panel(df, grids, col, bins):
+    """Draw a full-population histogram, pre-binned when grids are given."""
+    import matplotlib.pyplot as plt
+    if grids is None:
+        plt.hist(df[col], bins=bins, edgecolor='black', alpha=0.7)
+    else:
+        grids[col].draw(plt.gca())
+
+def _main_dashboard(df, valuable_users, grids, cube, output_dir):
+    """Draw the 9-panel overview dashboard."""
+    import matplotlib.pyplot as plt
     
     fig = plt.figure(figsize=(20, 16))
     
     # 1. Engagement Score Distribution
     plt.subplot(3, 3, 1)
-    plt.hist(df['engagement_score'], bins=50, edgecolor='black', alpha=0.7)
+    _histogram_panel(df, grids, 'engagement_score', bins=50)
     plt.xlabel('Engagement Score')
     plt.ylabel('Number of Users')
     plt.title('Distribution of User Engagement Scores')
-    plt.axvline(df['engagement_score'].median(), color='red', linestyle='--', label='Median')
+    plt.axvline(score_ranking(df).median(),
+                color='red', linestyle='--', label='Median')
     plt.legend()
     
     # 2. User Category Distribution
     plt.subplot(3, 3, 2)
-    category_counts = df['user_category'].value_counts()
+    category_counts = cube.size('user_category').sort_values(ascending=False)
     plt.pie(category_counts.values, labels=category_counts.index, autopct='%1.1f%%', startangle=90)
     plt.title('User Categories by Engagement Level')
     
     # 3. Engagement by Gender
     plt.subplot(3, 3, 3)
-    df.groupby('gender')['engagement_score'].mean().plot(kind='bar')
+    cube.agg('gender', 'engagement_score', ['mean'])['mean'].plot(kind='bar')
     plt.xlabel('Gender')
     plt.ylabel('Average Engagement Score')
     plt.title('Average Engagement Score by Gender')
@@ -260,7 +839,7 @@ def create_visualizations(df, valuable_users):
     
     # 4. Engagement by Age Group
     plt.subplot(3, 3, 4)
-    df.groupby('age_group')['engagement_score'].mean().plot(kind='bar')
+    cube.agg('age_group', 'engagement_score', ['mean'])['mean'].plot(kind='bar')
     plt.xlabel('Age Group')
     plt.ylabel('Average Engagement Score')
     plt.title('Average Engagement Score by Age Group')
@@ -268,14 +847,14 @@ def create_visualizations(df, valuable_users):
     
     # 5. Friend Count vs Engagement Score
     plt.subplot(3, 3, 5)
-    plt.scatter(df['friend_count'], df['engagement_score'], alpha=0.1)
+    _scatter_panel(df, grids, 'friend_count_vs_score', 'friend_count', 'engagement_score')
     plt.xlabel('Friend Count')
     plt.ylabel('Engagement Score')
     plt.title('Friend Count vs Engagement Score')
     
     # 6. Platform Usage Distribution
     plt.subplot(3, 3, 6)
-    platform_counts = df['primary_platform'].value_counts()
+    platform_counts = cube.size('primary_platform').sort_values(ascending=False)
     plt.bar(platform_counts.index, platform_counts.values)
     plt.xlabel('Primary Platform')
     plt.ylabel('Number of Users')
@@ -284,14 +863,14 @@ def create_visualizations(df, valuable_users):
     
     # 7. Tenure vs Engagement
     plt.subplot(3, 3, 7)
-    plt.scatter(df['tenure'], df['engagement_score'], alpha=0.1)
+    _scatter_panel(df, grids, 'tenure_vs_score', 'tenure', 'engagement_score')
     plt.xlabel('Tenure (days)')
     plt.ylabel('Engagement Score')
     plt.title('Tenure vs Engagement Score')
     
     # 8. Likes Given vs Received
     plt.subplot(3, 3, 8)
-    plt.scatter(df['likes'], df['likes_received'], alpha=0.1)
+    _scatter_panel(df, grids, 'likes_vs_likes_received', 'likes', 'likes_received')
     plt.xlabel('Likes Given')
     plt.ylabel('Likes Received')
     plt.title('Likes Given vs Likes Received')
@@ -306,23 +885,27 @@ def create_visualizations(df, valuable_users):
     plt.gca().invert_yaxis()
     
     plt.tight_layout()
-    plt.savefig('/home/runner/work/Facebook-eda/Facebook-eda/facebook_eda_visualizations.png', 
+    plt.savefig(os.path.join(output_dir, 'facebook_eda_visualizations.png'), 
                 dpi=150, bbox_inches='tight')
     print("\nVisualizations saved to 'facebook_eda_visualizations.png'")
+
+def _detailed_dashboard(df, valuable_users, grids, cube, summary, output_dir):
+    """Draw the 6-panel detailed analysis dashboard."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     
-    # Create additional detailed plots
     fig2 = plt.figure(figsize=(20, 10))
     
     # Mobile vs Web Engagement
     plt.subplot(2, 3, 1)
-    plt.scatter(df['mobile_likes'], df['www_likes'], alpha=0.1)
+    _scatter_panel(df, grids, 'mobile_vs_www_likes', 'mobile_likes', 'www_likes')
     plt.xlabel('Mobile Likes')
     plt.ylabel('Web Likes')
     plt.title('Mobile vs Web Platform Likes')
     
     # Age Distribution
     plt.subplot(2, 3, 2)
-    plt.hist(df['age'], bins=30, edgecolor='black', alpha=0.7)
+    _histogram_panel(df, grids, 'age', bins=30)
     plt.xlabel('Age')
     plt.ylabel('Number of Users')
     plt.title('Age Distribution of All Users')
@@ -336,16 +919,15 @@ def create_visualizations(df, valuable_users):
     
     # Friendships Initiated vs Friend Count
     plt.subplot(2, 3, 4)
-    plt.scatter(df['friend_count'], df['friendships_initiated'], alpha=0.1)
+    _scatter_panel(df, grids, 'friend_count_vs_friendships_initiated',
+                   'friend_count', 'friendships_initiated')
     plt.xlabel('Friend Count')
     plt.ylabel('Friendships Initiated')
     plt.title('Friend Count vs Friendships Initiated')
     
     # Engagement Score by Tenure Groups
     plt.subplot(2, 3, 5)
-    df['tenure_group'] = pd.cut(df['tenure'], bins=[0, 100, 365, 730, 10000],
-                                  labels=['<100d', '100-365d', '1-2y', '2y+'])
-    df.groupby('tenure_group')['engagement_score'].mean().plot(kind='bar')
+    cube.agg('tenure_group', 'engagement_score', ['mean'])['mean'].plot(kind='bar')
     plt.xlabel('Tenure Group')
     plt.ylabel('Average Engagement Score')
     plt.title('Engagement Score by Tenure Group')
@@ -353,62 +935,112 @@ def create_visualizations(df, valuable_users):
     
     # Correlation Heatmap
     plt.subplot(2, 3, 6)
-    corr_cols = ['friend_count', 'friendships_initiated', 'likes', 'likes_received', 
-                 'tenure', 'engagement_score']
-    correlation = df[corr_cols].corr()
+    if summary is None:
+        summary = SummaryStats.from_frame(df[CORRELATION_COLUMNS])
+    correlation = summary.correlation(CORRELATION_COLUMNS)
     sns.heatmap(correlation, annot=True, fmt='.2f', cmap='coolwarm', center=0)
     plt.title('Feature Correlation Heatmap')
     
     plt.tight_layout()
-    plt.savefig('/home/runner/work/Facebook-eda/Facebook-eda/facebook_eda_detailed_analysis.png', 
+    plt.savefig(os.path.join(output_dir, 'facebook_eda_detailed_analysis.png'), 
                 dpi=150, bbox_inches='tight')
     print("Detailed analysis saved to 'facebook_eda_detailed_analysis.png'")
+
+@traced
+def create_visualizations(df, valuable_users, sketch_error=None, density=False, grids=None,
+                          output_dir=BASE_DIR, summary=None, cube=None, figures=None):
+    """
+    Create comprehensive visualizations.
+    With density set, the full-population scatter plots and histograms are
+    drawn from pre-binned grids (density_plots.build_density_grids), so
+    render time does not grow with the number of users. Grids built from
+    chunks can be passed in directly, as can a SummaryStats of the scored
+    data (summary) for the correlation heatmap. Bar and pie charts read
+    from the segment cube, built here if not given. figures limits which
+    dashboards (file names in DASHBOARD_FILES) are drawn.
+    """
+    print("\n" + "="*80)
+    print("GENERATING VISUALIZATIONS")
+    print("="*80)
+    
+    load_plotting()
+    
+    if density and grids is None:
+        grids = build_density_grids(df)
+    if cube is None:
+        cube = segment_cube(df, sketch_error)
+    
+    if figures is None or DASHBOARD_FILES[0] in figures:
+        _main_dashboard(df, valuable_users, grids, cube, output_dir)
+    if figures is None or DASHBOARD_FILES[1] in figures:
+        _detailed_dashboard(df, valuable_users, grids, cube, summary, output_dir)
     
     return
 
+@traced
 def save_valuable_users(valuable_users, filepath):
     """Save the list of valuable users to CSV."""
-    output_cols = ['userid', 'age', 'gender', 'tenure', 'friend_count', 
-                   'friendships_initiated', 'likes', 'likes_received',
-                   'engagement_score', 'user_category', 'primary_platform']
-    valuable_users[output_cols].to_csv(filepath, index=False)
+    valuable_users[VALUABLE_USER_COLUMNS].to_csv(filepath, index=False)
     print(f"\nValuable users data saved to '{filepath}'")
     return
 
-def main():
-    """Main execution function."""
+def main(parallel=False, sketch_error=None, density=False, panels=False,
+         data_path=DATA_PATH, output_dir=BASE_DIR, history_dir=None, max_workers=1):
+    """
+    Main execution function.
+    With parallel set, the stages after scoring run on a process pool.
+    With sketch_error set, medians and quartiles come from quantile sketches.
+    With density set, full-population plots are drawn from binned grids.
+    With panels set, each chart is rendered as its own job and charts whose
+    inputs have not changed since the last run are skipped.
+    With history_dir set, the scores are kept as a snapshot there and
+    compared with the previous run's.
+    Otherwise the stages run as a dependency graph (see stage_graph.py),
+    with independent stages on max_workers threads.
+    """
     print("="*80)
     print("FACEBOOK USER ENGAGEMENT ANALYSIS")
     print("Identifying Valuable Users for Business Growth")
     print("="*80)
     
-    # Load data
-    df = load_data('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
-    
-    # Explore data
-    df = explore_data(df)
-    
-    # Create engagement score
-    df = create_engagement_score(df)
-    
-    # Analyze demographics
-    df = analyze_demographics(df)
-    
-    # Analyze platform usage
-    df = analyze_platform_usage(df)
-    
-    # Identify valuable users
-    valuable_users = identify_valuable_users(df, top_n=1000)
-    
-    # Generate recommendations
-    generate_recommendations(df, valuable_users)
-    
-    # Create visualizations
-    create_visualizations(df, valuable_users)
+    if parallel:
+        # Load data
+        df = load_data(data_path)
+        
+        # Explore data
+        df = explore_data(df, sketch_error)
+        
+        # Create engagement score
+        df = create_engagement_score(df, sketch_error=sketch_error)
+        
+        from parallel_pipeline import PARALLEL_STAGES, run_parallel_analysis
+        stages = [stage for stage in PARALLEL_STAGES
+                  if not (panels and stage == 'visualizations')]
+        valuable_users = run_parallel_analysis(df, top_n=1000, stages=stages,
+                                               sketch_error=sketch_error, density=density,
+                                               output_dir=output_dir)
+    else:
+        # Explore, score, report on segments and valuable users, recommend, plot
+        from stage_graph import run_stages
+        targets = ['explore', 'demographics', 'platform', 'recommendations']
+        if not panels:
+            targets.append('visualizations')
+        df, results = run_stages(targets, data_path, output_dir, top_n=1000,
+                                 sketch_error=sketch_error, density=density,
+                                 max_workers=max_workers)
+        valuable_users = results['valuable_users']
+    
+    if panels:
+        from panel_renderer import render_dashboards
+        render_dashboards(df, valuable_users, output_dir)
     
     # Save valuable users list
     save_valuable_users(valuable_users, 
-                       '/home/runner/work/Facebook-eda/Facebook-eda/valuable_users_list.csv')
+                       os.path.join(output_dir, 'valuable_users_list.csv'))
+    
+    if history_dir:
+        from score_history import record_history
+        record_history(df, history_dir, top_n=1000)
     
     print("\n" + "="*80)
     print("ANALYSIS COMPLETE!")
@@ -424,4 +1056,6 @@ def main():
     print("- Drive business growth through data-driven decisions")
     
 if __name__ == "__main__":
-    main()
+    import sys
+    main(parallel='--parallel' in sys.argv[1:], density='--density' in sys.argv[1:],
+         panels='--panels' in sys.argv[1:])
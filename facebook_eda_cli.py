@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Facebook EDA Command Line
+=========================
+Single entry point for the analysis:
+
+    python3 facebook_eda_cli.py score    --output scored_users.csv [--chunksize N] [--prefetch N]
+    python3 facebook_eda_cli.py score    --table scored_users/ [--index] [--chunksize N]
+    python3 facebook_eda_cli.py score    --store scored_users.columns [--chunksize N]
+    python3 facebook_eda_cli.py convert  [--store DIR] [--chunksize N] [--prefetch N]
+    python3 facebook_eda_cli.py lookup   --index scored_users.userid_index --ids ids.csv --output joined.csv
+    python3 facebook_eda_cli.py top-k    -k 1000 -k 10000 [--chunksize N] [--prefetch N]
+    python3 facebook_eda_cli.py segments [--sketch-error 0.01]
+    python3 facebook_eda_cli.py plot     [--density] [--panels]
+    python3 facebook_eda_cli.py demo
+    python3 facebook_eda_cli.py run      [--parallel] [--density] [--panels] [--cache-dir DIR]
+                                         [--history DIR] [--workers N]
+    python3 facebook_eda_cli.py run      --target valuable_users_list.csv [--target ...]
+    python3 facebook_eda_cli.py serve    [--port 8765 | --socket PATH]
+    python3 facebook_eda_cli.py sweep    [--weights weights.csv | --random 500] [--top-n 1000]
+    python3 facebook_eda_cli.py shards   --manifest shards.txt [--phase bounds|scores|reduce]
+                                         [--shard-index I --shard-count N] [--workers N]
+    python3 facebook_eda_cli.py history  --dir score_history [--old NAME] [--new NAME] [--list]
+
+pandas is only imported once a subcommand runs, and matplotlib/seaborn only
+for plot and run, so scheduled scoring jobs start quickly. Pass --timing to
+print startup and total time to stderr, and --trace-report / --chrome-trace
+to record per-stage and per-chunk spans of the run.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+START_TIME = time.perf_counter()
+
+def _analysis():
+    """Import the analysis module, recording how long the import took."""
+    global IMPORT_SECONDS
+    started = time.perf_counter()
+    import facebook_eda_analysis as fea
+    IMPORT_SECONDS = time.perf_counter() - started
+    return fea
+
+IMPORT_SECONDS = 0.0
+
+def _data_path(args, fea):
+    return args.data or fea.DATA_PATH
+
+def _output_dir(args, fea):
+    return args.output_dir or fea.BASE_DIR
+
+def cmd_score(args):
+    """Score every user and write the scored table."""
+    fea = _analysis()
+    if args.table or args.index or args.store:
+        from column_store import ColumnStoreWriter
+        from columnar_output import PartitionedWriter
+        from userid_index import UseridIndexWriter, default_index_dir
+        tables = []
+        if args.table:
+            tables.append(PartitionedWriter(args.table))
+        if args.index:
+            index_dir = default_index_dir(args.table or args.output or args.store)
+            tables.append(UseridIndexWriter(index_dir))
+        if args.store:
+            tables.append(ColumnStoreWriter(args.store))
+        fea.score_csv_chunked(_data_path(args, fea), args.output, args.chunksize or 1_000_000,
+                              sketch_error=args.sketch_error or 0.001, table=tables,
+                              prefetch=args.prefetch)
+        for table in tables:
+            table.close()
+        if args.table:
+            print(f"Scored table saved to '{args.table}'")
+        if args.index:
+            print(f"Userid index saved to '{index_dir}'")
+        if args.store:
+            print(f"Scored column store saved to '{args.store}'")
+        return
+    if args.chunksize or args.prefetch:
+        fea.score_csv_chunked(_data_path(args, fea), args.output, args.chunksize or 1_000_000,
+                              sketch_error=args.sketch_error or 0.001, prefetch=args.prefetch)
+        return
+    df = fea.create_engagement_score(fea.load_data(_data_path(args, fea)),
+                                     sketch_error=args.sketch_error)
+    df.to_csv(args.output, index=False)
+    print(f"\nScored users saved to '{args.output}'")
+
+def cmd_convert(args):
+    """Convert the input CSV into a memory-mapped column store."""
+    fea = _analysis()
+    from column_store import convert_csv
+    store_dir = convert_csv(_data_path(args, fea), args.store, args.chunksize or 1_000_000,
+                            args.prefetch)
+    print(f"Column store saved to '{store_dir}'")
+
+def cmd_lookup(args):
+    """Join a list of userids to their scores through a userid index."""
+    import pandas as pd
+    from userid_index import UseridIndex
+    index = UseridIndex(args.index)
+    ids = pd.read_csv(args.ids)
+    if 'userid' not in ids.columns:
+        ids = pd.read_csv(args.ids, header=None, names=['userid'])
+    joined = index.join(ids)
+    joined.to_csv(args.output, index=False)
+    print(f"Joined {joined['engagement_score'].notna().sum():,} of {len(joined):,} userids; "
+          f"saved to '{args.output}'")
+
+def cmd_top_k(args):
+    """Write the top-K valuable users for one or more values of K."""
+    fea = _analysis()
+    from topk import TopKBuffer
+    k_values = sorted(set(args.k or [1000]))
+    buffer = TopKBuffer(k_values)
+    if args.chunksize or args.prefetch:
+        fea.score_csv_chunked(_data_path(args, fea), None, args.chunksize or 1_000_000,
+                              valuable_users=buffer, prefetch=args.prefetch)
+    else:
+        columns = fea.stage_columns('score', 'valuable_users')
+        df = fea.create_engagement_score(fea.load_data(_data_path(args, fea), columns))
+        buffer.update(fea.add_platform_columns(df))
+
+    root, ext = os.path.splitext(os.path.join(_output_dir(args, fea), args.output))
+    for k in k_values:
+        path = f"{root}{ext}" if len(k_values) == 1 else f"{root}_top{k}{ext}"
+        fea.save_valuable_users(buffer.result(k), path)
+
+def cmd_segments(args):
+    """Print the demographic, platform and recommendation reports."""
+    fea = _analysis()
+    columns = fea.stage_columns('score', 'demographics', 'platform', 'valuable_users')
+    df = fea.create_engagement_score(fea.load_data(_data_path(args, fea), columns),
+                                     sketch_error=args.sketch_error)
+    fea.add_platform_columns(fea.add_age_group(df))
+    cube = fea.segment_cube(df, args.sketch_error)
+    df = fea.analyze_demographics(df, args.sketch_error, cube=cube)
+    df = fea.analyze_platform_usage(df, args.sketch_error, cube=cube)
+    valuable_users = df.iloc[fea.score_ranking(df).top(args.top_n)]
+    fea.generate_recommendations(df, valuable_users, cube=cube)
+
+def cmd_plot(args):
+    """Render the two dashboards."""
+    fea = _analysis()
+    output_dir = _output_dir(args, fea)
+    df = fea.create_engagement_score(fea.load_data(_data_path(args, fea)))
+    fea.add_age_group(df)
+    fea.add_platform_columns(df)
+    valuable_users = fea.identify_valuable_users(df, top_n=args.top_n)
+    if args.panels:
+        from panel_renderer import render_dashboards
+        render_dashboards(df, valuable_users, output_dir)
+    else:
+        import matplotlib
+        matplotlib.use('Agg')
+        fea.create_visualizations(df, valuable_users, density=args.density,
+                                  output_dir=output_dir)
+
+def cmd_demo(args):
+    """Run the quick demo."""
+    fea = _analysis()
+    import quick_demo
+    quick_demo.main(_data_path(args, fea))
+
+def cmd_run(args):
+    """Run the full analysis, like facebook_eda_analysis.py."""
+    fea = _analysis()
+    if args.target:
+        import stage_graph
+        try:
+            stage_graph.plan(args.target)
+        except ValueError as e:
+            raise SystemExit(f"run: {e}")
+        stage_graph.run_targets(args.target, _data_path(args, fea), _output_dir(args, fea),
+                                args.top_n, args.sketch_error, args.density, args.workers)
+        return
+    if args.cache_dir:
+        from stage_cache import run_cached_analysis
+        run_cached_analysis(_data_path(args, fea), _output_dir(args, fea), args.cache_dir,
+                            top_n=args.top_n, sketch_error=args.sketch_error)
+        return
+    fea.main(parallel=args.parallel, sketch_error=args.sketch_error, density=args.density,
+             panels=args.panels, data_path=_data_path(args, fea),
+             output_dir=_output_dir(args, fea), history_dir=args.history,
+             max_workers=args.workers)
+
+def cmd_serve(args):
+    """Serve scored users over local HTTP until interrupted."""
+    import query_service
+    argv = ['--host', args.host, '--port', str(args.port)]
+    if args.data:
+        argv += ['--data', args.data]
+    if args.socket:
+        argv += ['--socket', args.socket]
+    query_service.main(argv)
+
+def cmd_sweep(args):
+    """Compare many engagement weightings in one pass."""
+    import weight_sweep
+    argv = ['--random', str(args.random), '--seed', str(args.seed), '--top-n', str(args.top_n)]
+    for option in ('data', 'weights', 'output'):
+        if getattr(args, option):
+            argv += [f'--{option}', getattr(args, option)]
+    weight_sweep.main(argv)
+
+def cmd_shards(args):
+    """Map the shards listed in a manifest and reduce their partial results."""
+    fea = _analysis()
+    import sharded_pipeline
+    output_dir = _output_dir(args, fea)
+    if args.phase == 'all':
+        sharded_pipeline.run_sharded(args.manifest, args.partials, output_dir, args.top_n,
+                                     args.sketch_error, max_workers=args.workers)
+    elif args.phase == 'reduce':
+        sharded_pipeline.report_sharded(args.manifest, args.partials, output_dir, args.top_n,
+                                        args.sketch_error)
+    else:
+        remapped = sharded_pipeline.map_shards(args.manifest, args.partials, [args.phase],
+                                               args.top_n, args.sketch_error,
+                                               shard_index=args.shard_index,
+                                               shard_count=args.shard_count,
+                                               max_workers=args.workers)
+        print(f"Mapped {len(remapped[args.phase])} shard(s) for {args.phase}; the rest were current")
+
+def cmd_history(args):
+    """List score snapshots or compare two of them."""
+    from score_history import ScoreHistory, print_diff
+    history = ScoreHistory(args.dir)
+    if args.list:
+        for snapshot in history.meta['snapshots']:
+            print(f"{snapshot['name']}\t{snapshot['rows']:,} users")
+        print(f"{len(history)} snapshots, {history.nbytes() / 1e6:.1f} MB")
+        return
+    diff = history.diff(args.old, args.new, top_n=args.top_n, min_change=args.min_change)
+    print_diff(diff, limit=args.limit)
+    if args.output:
+        diff.movers.to_csv(args.output, index=False)
+        print(f"\nScore changes saved to '{args.output}'")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Facebook user engagement analysis")
+    parser.add_argument('--timing', action='store_true',
+                        help="print startup and total time to stderr")
+    parser.add_argument('--trace-report', metavar='FILE',
+                        help="write a JSON report of per-stage time, CPU, memory and rows")
+    parser.add_argument('--chrome-trace', metavar='FILE',
+                        help="write stage spans in Chrome trace-event format")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="also record tracemalloc peaks per stage (slower)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_command(name, func, help_text):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument('--data', help="input CSV (default: pseudo_facebook.csv in FACEBOOK_EDA_DIR)")
+        sub.set_defaults(func=func)
+        return sub
+
+    score = add_command('score', cmd_score, "score every user")
+    score.add_argument('--output', help="scored CSV to write")
+    score.add_argument('--table', help="directory for the partitioned columnar scored table")
+    score.add_argument('--index', action='store_true',
+                       help="also build a memory-mapped userid index next to the output")
+    score.add_argument('--store', help="directory for a memory-mapped column store of the scores")
+    score.add_argument('--chunksize', type=int, help="score out of core in chunks of this many rows")
+    score.add_argument('--sketch-error', type=float, help="report quartiles from a quantile sketch")
+    score.add_argument('--prefetch', type=int, default=0,
+                       help="parse this many chunks ahead on background threads")
+
+    convert = add_command('convert', cmd_convert,
+                          "convert the CSV to a memory-mapped column store")
+    convert.add_argument('--store', help="store directory (default: the CSV path + .columns)")
+    convert.add_argument('--chunksize', type=int, help="rows converted per chunk")
+    convert.add_argument('--prefetch', type=int, default=0,
+                         help="parse this many chunks ahead on background threads")
+
+    lookup = subparsers.add_parser('lookup', help="join userids to scores via a userid index")
+    lookup.add_argument('--index', required=True, help="userid index directory")
+    lookup.add_argument('--ids', required=True, help="CSV with a userid column, or one id per line")
+    lookup.add_argument('--output', required=True, help="joined CSV to write")
+    lookup.set_defaults(func=cmd_lookup)
+
+    top_k = add_command('top-k', cmd_top_k, "write the top-K valuable users")
+    top_k.add_argument('-k', type=int, action='append', help="K to write (repeatable, default 1000)")
+    top_k.add_argument('--output', default='valuable_users_list.csv', help="output file name")
+    top_k.add_argument('--output-dir', help="output directory (default: FACEBOOK_EDA_DIR)")
+    top_k.add_argument('--chunksize', type=int, help="select out of core in chunks of this many rows")
+    top_k.add_argument('--prefetch', type=int, default=0,
+                       help="parse this many chunks ahead on background threads")
+
+    segments = add_command('segments', cmd_segments, "print segment reports and recommendations")
+    segments.add_argument('--top-n', type=int, default=1000)
+    segments.add_argument('--sketch-error', type=float, help="use quantile sketches for medians")
+
+    plot = add_command('plot', cmd_plot, "render the dashboards")
+    plot.add_argument('--output-dir', help="output directory (default: FACEBOOK_EDA_DIR)")
+    plot.add_argument('--top-n', type=int, default=1000)
+    plot.add_argument('--density', action='store_true', help="draw scatters as density grids")
+    plot.add_argument('--panels', action='store_true', help="render panels in parallel, skip unchanged")
+
+    add_command('demo', cmd_demo, "run the quick demo")
+
+    run = add_command('run', cmd_run, "run the full analysis")
+    run.add_argument('--output-dir', help="output directory (default: FACEBOOK_EDA_DIR)")
+    run.add_argument('--parallel', action='store_true', help="run stages on a process pool")
+    run.add_argument('--density', action='store_true', help="draw scatters as density grids")
+    run.add_argument('--panels', action='store_true', help="render panels in parallel, skip unchanged")
+    run.add_argument('--sketch-error', type=float, help="use quantile sketches for medians")
+    run.add_argument('--cache-dir', help="reuse stage results cached in this directory")
+    run.add_argument('--top-n', type=int, default=1000,
+                     help="valuable users to keep (with --cache-dir or --target)")
+    run.add_argument('--history', help="keep the scores as a snapshot in this history directory")
+    run.add_argument('--target', action='append',
+                     help="only compute this output (repeatable), e.g. valuable_users_list.csv, "
+                          "facebook_eda_visualizations.png or demographics")
+    run.add_argument('--workers', type=int, default=1,
+                     help="threads running independent stages at once")
+
+    serve = add_command('serve', cmd_serve, "serve score lookups and segment queries over HTTP")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--socket', help="listen on this Unix socket instead of TCP")
+
+    sweep = add_command('sweep', cmd_sweep, "compare many engagement weightings at once")
+    sweep.add_argument('--weights', help="CSV with one weight vector per row, a column per feature")
+    sweep.add_argument('--random', type=int, default=100,
+                       help="number of random weight vectors when --weights is not given")
+    sweep.add_argument('--seed', type=int, default=0)
+    sweep.add_argument('--top-n', type=int, default=1000)
+    sweep.add_argument('--output', help="write the full comparison to this CSV")
+
+    shards = subparsers.add_parser('shards', help="map-reduce over shard files listed in a manifest")
+    shards.add_argument('--manifest', required=True, help="file listing one shard CSV per line")
+    shards.add_argument('--partials', help="partial results directory (default: manifest + .partials)")
+    shards.add_argument('--phase', choices=['all', 'bounds', 'scores', 'reduce'], default='all',
+                        help="run one step only, e.g. to spread the map over machines")
+    shards.add_argument('--shard-index', type=int, default=0)
+    shards.add_argument('--shard-count', type=int, default=1,
+                        help="map only every Nth shard, starting at --shard-index")
+    shards.add_argument('--workers', type=int, help="processes mapping shards at once")
+    shards.add_argument('--output-dir', help="output directory (default: FACEBOOK_EDA_DIR)")
+    shards.add_argument('--top-n', type=int, default=1000)
+    shards.add_argument('--sketch-error', type=float, default=0.001,
+                        help="rank error of the merged quartiles and medians")
+    shards.set_defaults(func=cmd_shards)
+
+    history = subparsers.add_parser('history', help="compare score snapshots of earlier runs")
+    history.add_argument('--dir', required=True, help="score history directory")
+    history.add_argument('--old', help="snapshot to compare from (default: the one before --new)")
+    history.add_argument('--new', help="snapshot to compare to (default: the latest)")
+    history.add_argument('--list', action='store_true', help="list the snapshots instead")
+    history.add_argument('--top-n', type=int, default=1000, help="size of the valuable user set")
+    history.add_argument('--min-change', type=float, default=0.0,
+                         help="ignore score changes smaller than this")
+    history.add_argument('--limit', type=int, default=10, help="rows shown per table")
+    history.add_argument('--output', help="write every score change to this CSV")
+    history.set_defaults(func=cmd_history)
+
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'score' and not (args.output or args.table or args.store):
+        parser.error("score needs --output, --table or --store")
+    if args.command == 'shards' and args.shard_count > 1 and args.phase not in ('bounds', 'scores'):
+        parser.error("--shard-count needs --phase bounds or --phase scores")
+    if args.command == 'run' and args.history and args.cache_dir:
+        parser.error("--history cannot be combined with --cache-dir")
+    if args.command == 'run' and args.target and (args.parallel or args.panels or args.cache_dir
+                                                  or args.history):
+        parser.error("--target cannot be combined with --parallel, --panels, --cache-dir "
+                     "or --history")
+    if args.trace_report or args.chrome_trace:
+        from tracing import Tracer
+        with Tracer(memory=args.trace_memory) as tracer:
+            args.func(args)
+        if args.trace_report:
+            tracer.write_report(args.trace_report)
+        if args.chrome_trace:
+            tracer.write_chrome_trace(args.chrome_trace)
+    else:
+        args.func(args)
+    if args.timing:
+        total = time.perf_counter() - START_TIME
+        print(f"timing: import {IMPORT_SECONDS * 1000:.0f} ms, total {total * 1000:.0f} ms",
+              file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Per-Panel Dashboard Rendering
+=============================
+Renders each of the 15 dashboard charts as its own job on a process pool
+and composes the two dashboard images from the per-panel files. Every
+panel is drawn from small precomputed aggregates, and a panel whose
+aggregates have the same fingerprint as in the last run is not redrawn.
+"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import facebook_eda_analysis as fea
+from density_plots import build_density_grids
+from stage_cache import fingerprint
+from summary_stats import SummaryStats
+from tracing import traced
+
+# Bump when the drawing code changes so every panel is redrawn once
+RENDER_VERSION = 1
+
+PANEL_SIZE = (6.5, 5)
+PANEL_DPI = 100
+
+# Dashboard file -> (number of columns, panels in reading order)
+DASHBOARDS = {
+    'facebook_eda_visualizations.png': (3, [
+        'score_distribution', 'user_categories', 'engagement_by_gender',
+        'engagement_by_age_group', 'friend_count_vs_score', 'platform_distribution',
+        'tenure_vs_score', 'likes_vs_likes_received', 'top_20_users',
+    ]),
+    'facebook_eda_detailed_analysis.png': (3, [
+        'mobile_vs_www_likes', 'age_distribution', 'top_users_age_distribution',
+        'friend_count_vs_friendships_initiated', 'engagement_by_tenure_group',
+        'correlation_heatmap',
+    ]),
+}
+
+def _bars(series):
+    return {'labels': [str(label) for label in series.index],
+            'values': series.to_numpy(dtype=np.float64)}
+
+def compute_panel_inputs(df, valuable_users, bins=200):
+    """Reduce the scored frame to the small aggregates each panel draws from."""
+    if 'age_group' not in df.columns:
+        fea.add_age_group(df)
+    if 'primary_platform' not in df.columns:
+        fea.add_platform_columns(df)
+    cube = fea.segment_cube(df)
+    grids = build_density_grids(df, bins=bins)
+    top_age_counts, top_age_edges = np.histogram(valuable_users['age'], bins=30)
+
+    return {
+        'score_distribution': {'histogram': grids['engagement_score'],
+                               'median': float(fea.score_ranking(df).median())},
+        'user_categories': _bars(cube.size('user_category').sort_values(ascending=False)),
+        'engagement_by_gender': _bars(cube.agg('gender', 'engagement_score', ['mean'])['mean']),
+        'engagement_by_age_group': _bars(
+            cube.agg('age_group', 'engagement_score', ['mean'])['mean']),
+        'friend_count_vs_score': {'grid': grids['friend_count_vs_score']},
+        'platform_distribution': _bars(
+            cube.size('primary_platform').sort_values(ascending=False)),
+        'tenure_vs_score': {'grid': grids['tenure_vs_score']},
+        'likes_vs_likes_received': {'grid': grids['likes_vs_likes_received']},
+        'top_20_users': {'scores': valuable_users['engagement_score'].head(20).to_numpy()},
+        'mobile_vs_www_likes': {'grid': grids['mobile_vs_www_likes']},
+        'age_distribution': {'histogram': grids['age']},
+        'top_users_age_distribution': {'counts': top_age_counts, 'edges': top_age_edges,
+                                       'n_users': len(valuable_users)},
+        'friend_count_vs_friendships_initiated': {
+            'grid': grids['friend_count_vs_friendships_initiated']},
+        'engagement_by_tenure_group': _bars(
+            cube.agg('tenure_group', 'engagement_score', ['mean'])['mean']),
+        'correlation_heatmap': {'labels': fea.CORRELATION_COLUMNS,
+                                'matrix': SummaryStats.from_frame(
+                                    df[fea.CORRELATION_COLUMNS]).correlation().to_numpy()},
+    }
+
+def _draw_bars(ax, data, xlabel, ylabel, title, rotation):
+    ax.bar(data['labels'], data['values'])
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    ax.tick_params(axis='x', labelrotation=rotation)
+
+def _draw_grid(ax, data, xlabel, ylabel, title):
+    data['grid'].draw(ax)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+
+def _draw_score_distribution(ax, data):
+    data['histogram'].draw(ax)
+    ax.axvline(data['median'], color='red', linestyle='--', label='Median')
+    ax.set_xlabel('Engagement Score')
+    ax.set_ylabel('Number of Users')
+    ax.set_title('Distribution of User Engagement Scores')
+    ax.legend()
+
+def _draw_user_categories(ax, data):
+    ax.pie(data['values'], labels=data['labels'], autopct='%1.1f%%', startangle=90)
+    ax.set_title('User Categories by Engagement Level')
+
+def _draw_top_20_users(ax, data):
+    ax.barh(range(len(data['scores'])), data['scores'])
+    ax.set_xlabel('Engagement Score')
+    ax.set_ylabel('User Rank')
+    ax.set_title('Top 20 Users by Engagement Score')
+    ax.invert_yaxis()
+
+def _draw_age_distribution(ax, data):
+    data['histogram'].draw(ax)
+    ax.set_xlabel('Age')
+    ax.set_ylabel('Number of Users')
+    ax.set_title('Age Distribution of All Users')
+
+def _draw_top_users_age_distribution(ax, data):
+    ax.stairs(data['counts'], data['edges'], fill=True, edgecolor='black', alpha=0.7,
+              color='orange')
+    ax.set_xlabel('Age')
+    ax.set_ylabel('Number of Users')
+    ax.set_title(f"Age Distribution of Top {data['n_users']} Users")
+
+def _draw_correlation_heatmap(ax, data):
+    import seaborn as sns
+    correlation = pd.DataFrame(data['matrix'], index=data['labels'], columns=data['labels'])
+    sns.heatmap(correlation, annot=True, fmt='.2f', cmap='coolwarm', center=0, ax=ax)
+    ax.set_title('Feature Correlation Heatmap')
+
+PANEL_DRAWERS = {
+    'score_distribution': _draw_score_distribution,
+    'user_categories': _draw_user_categories,
+    'engagement_by_gender': lambda ax, data: _draw_bars(
+        ax, data, 'Gender', 'Average Engagement Score', 'Average Engagement Score by Gender', 0),
+    'engagement_by_age_group': lambda ax, data: _draw_bars(
+        ax, data, 'Age Group', 'Average Engagement Score',
+        'Average Engagement Score by Age Group', 45),
+    'friend_count_vs_score': lambda ax, data: _draw_grid(
+        ax, data, 'Friend Count', 'Engagement Score', 'Friend Count vs Engagement Score'),
+    'platform_distribution': lambda ax, data: _draw_bars(
+        ax, data, 'Primary Platform', 'Number of Users', 'Primary Platform Distribution', 45),
+    'tenure_vs_score': lambda ax, data: _draw_grid(
+        ax, data, 'Tenure (days)', 'Engagement Score', 'Tenure vs Engagement Score'),
+    'likes_vs_likes_received': lambda ax, data: _draw_grid(
+        ax, data, 'Likes Given', 'Likes Received', 'Likes Given vs Likes Received'),
+    'top_20_users': _draw_top_20_users,
+    'mobile_vs_www_likes': lambda ax, data: _draw_grid(
+        ax, data, 'Mobile Likes', 'Web Likes', 'Mobile vs Web Platform Likes'),
+    'age_distribution': _draw_age_distribution,
+    'top_users_age_distribution': _draw_top_users_age_distribution,
+    'friend_count_vs_friendships_initiated': lambda ax, data: _draw_grid(
+        ax, data, 'Friend Count', 'Friendships Initiated', 'Friend Count vs Friendships Initiated'),
+    'engagement_by_tenure_group': lambda ax, data: _draw_bars(
+        ax, data, 'Tenure Group', 'Average Engagement Score',
+        'Engagement Score by Tenure Group', 45),
+    'correlation_heatmap': _draw_correlation_heatmap,
+}
+
+def _render_panel(name, data, path):
+    """Worker entry point: draw one panel to its own PNG with the Agg backend."""
+    import matplotlib
+    matplotlib.use('Agg')
+    plt, sns = fea.load_plotting()
+
+    fig, ax = plt.subplots(figsize=PANEL_SIZE)
+    PANEL_DRAWERS[name](ax, data)
+    fig.tight_layout()
+    fig.savefig(path, dpi=PANEL_DPI)
+    plt.close(fig)
+    return name
+
+def compose_dashboard(panel_paths, n_cols, output_path):
+    """Tile per-panel images into one dashboard image."""
+    import matplotlib.image as mpimg
+    images = [mpimg.imread(path) for path in panel_paths]
+    blank = np.ones_like(images[0])
+    images += [blank] * (-len(images) % n_cols)
+    rows = [np.concatenate(images[i:i + n_cols], axis=1) for i in range(0, len(images), n_cols)]
+    mpimg.imsave(output_path, np.concatenate(rows, axis=0))
+
+@traced
+def render_dashboards(df, valuable_users, output_dir=fea.BASE_DIR, max_workers=None,
+                      force=False):
+    """
+    Render every dashboard panel in parallel and compose both dashboards.
+    Panel images go to output_dir/panels. Panels whose input fingerprint
+    matches the last run are skipped unless force is set. Returns the
+    names of the rendered and skipped panels.
+    """
+    print("\n" + "="*80)
+    print("GENERATING VISUALIZATIONS (PER PANEL)")
+    print("="*80)
+
+    panel_dir = os.path.join(output_dir, 'panels')
+    os.makedirs(panel_dir, exist_ok=True)
+    manifest_path = os.path.join(panel_dir, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    inputs = compute_panel_inputs(df, valuable_users)
+    settings = {'version': RENDER_VERSION, 'size': PANEL_SIZE, 'dpi': PANEL_DPI}
+    fingerprints = {name: fingerprint({'settings': settings, 'data': data})
+                    for name, data in inputs.items()}
+    paths = {name: os.path.join(panel_dir, f'{name}.png') for name in inputs}
+    stale = [name for name in inputs
+             if force or manifest.get(name) != fingerprints[name] or not os.path.exists(paths[name])]
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=max_workers or min(len(stale), os.cpu_count() or 1)) as executor:
+            list(executor.map(_render_panel, stale, [inputs[name] for name in stale],
+                              [paths[name] for name in stale]))
+
+    for filename, (n_cols, names) in DASHBOARDS.items():
+        output_path = os.path.join(output_dir, filename)
+        if set(names) & set(stale) or not os.path.exists(output_path):
+            compose_dashboard([paths[name] for name in names], n_cols, output_path)
+            print(f"Dashboard saved to '{filename}'")
+
+    manifest.update(fingerprints)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    skipped = [name for name in inputs if name not in stale]
+    print(f"\nPanels rendered: {len(stale)}, unchanged and skipped: {len(skipped)}")
+    return {'rendered': stale, 'skipped': skipped}
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Parallel Pipeline Execution
+===========================
+Runs the stages that follow scoring on a process pool. The scored frame is
+copied into shared memory once, and every worker maps those columns
+directly instead of receiving a pickled DataFrame. The segment cube the
+reports read is built over row partitions in parallel, merged once, and
+shared by every stage instead of each worker building its own: its
+per-value arrays (what exact medians read) also live in shared memory, so
+a stage task only carries the cube's small aggregates.
+"""
+
+import contextlib
+import copy
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import facebook_eda_analysis as fea
+from tracing import traced
+
+# Stages that only read the scored frame, in the order main() prints them
+PARALLEL_STAGES = ['demographics', 'platform', 'valuable_users', 'recommendations',
+                   'visualizations']
+
+# Stages that read their segment figures from the cube
+CUBE_STAGES = ['demographics', 'platform', 'recommendations', 'visualizations']
+
+class SharedFrame:
+    """
+    A DataFrame whose columns live in shared memory blocks.
+    Categorical and string columns are stored as integer codes. spec is a
+    small picklable description that attach_frame uses to map the columns.
+    """
+
+    def __init__(self, df):
+        self.blocks = []
+        self.spec = {'n_rows': len(df), 'columns': []}
+        for col in df.columns:
+            values, categories = df[col], None
+            if values.dtype == object:
+                values = values.astype('category')
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                categories = values.cat.categories.tolist()
+                values = values.cat.codes
+            values = values.to_numpy()
+
+            shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, values.dtype, buffer=shm.buf)[:] = values
+            self.blocks.append(shm)
+            self.spec['columns'].append((col, shm.name, values.dtype.str, categories))
+
+    def close(self):
+        """Release and remove the shared memory blocks."""
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _attach_columns(spec):
+    """Map a SharedFrame's columns as a dict of writable arrays (or Categoricals)."""
+    blocks, data = [], {}
+    for col, name, dtype, categories in spec['columns']:
+        shm = shared_memory.SharedMemory(name=name)
+        blocks.append(shm)
+        values = np.ndarray((spec['n_rows'],), dtype, buffer=shm.buf)
+        if categories is not None:
+            values = pd.Categorical.from_codes(values, categories)
+        data[col] = values
+    return data, blocks
+
+def attach_frame(spec):
+    """
+    Map a SharedFrame's columns into a DataFrame without copying.
+    The returned blocks must stay referenced for as long as the frame is used.
+    """
+    data, blocks = _attach_columns(spec)
+    return pd.DataFrame(data, copy=False), blocks
+
+class SharedCube:
+    """
+    A segment cube whose value arrays live in shared memory blocks, one
+    SharedFrame of value and cell columns per measure. spec holds the cube
+    without its values (only counts, sums and sketches) plus the specs that
+    attach_cube uses to map them back.
+    """
+
+    def __init__(self, cube, values):
+        self.values = values
+        self.spec = (cube, {m: shared.spec for m, shared in values.items()})
+
+    def close(self):
+        """Release and remove the shared memory blocks."""
+        for shared in self.values.values():
+            shared.close()
+        self.values = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def attach_cube(spec):
+    """
+    Rebuild a SharedCube's cube with its value arrays mapped, not copied.
+    The returned blocks must stay referenced for as long as the cube is used.
+    """
+    cube, value_specs = spec
+    cube = copy.copy(cube)
+    cube.values, cube.value_cells = dict(cube.values), dict(cube.value_cells)
+    blocks = []
+    for m, value_spec in value_specs.items():
+        data, measure_blocks = _attach_columns(value_spec)
+        cube.values[m], cube.value_cells[m] = data['value'], data['cell']
+        blocks.extend(measure_blocks)
+    return cube, blocks
+
+def _stage_demographics(df, valuable_users, options):
+    fea.analyze_demographics(df, options['sketch_error'], cube=options['cube'])
+
+def _stage_platform(df, valuable_users, options):
+    fea.analyze_platform_usage(df, options['sketch_error'], cube=options['cube'])
+
+def _stage_valuable_users(df, valuable_users, options):
+    fea.identify_valuable_users(df, top_n=options['top_n'], sketch_error=options['sketch_error'])
+
+def _stage_recommendations(df, valuable_users, options):
+    fea.generate_recommendations(df, valuable_users, cube=options['cube'])
+
+def _stage_visualizations(df, valuable_users, options):
+    import matplotlib
+    matplotlib.use('Agg')
+    fea.create_visualizations(df, valuable_users, options['sketch_error'], options['density'],
+                              output_dir=options['output_dir'], cube=options['cube'])
+
+STAGE_FUNCTIONS = {
+    'demographics': _stage_demographics,
+    'platform': _stage_platform,
+    'valuable_users': _stage_valuable_users,
+    'recommendations': _stage_recommendations,
+    'visualizations': _stage_visualizations,
+}
+
+def _run_stage(spec, stage, top_positions, options):
+    """Worker entry point: run one stage on the shared frame and return its output."""
+    df, blocks = attach_frame(spec)
+    if options['cube'] is not None:
+        cube, cube_blocks = attach_cube(options['cube'])
+        options = dict(options, cube=cube)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        STAGE_FUNCTIONS[stage](df, df.iloc[top_positions], options)
+    return output.getvalue()
+
+def _partial_cube(spec, start, stop, sketch_error, value_specs):
+    """
+    Worker entry point: the segment cube of a row range. Its values are
+    written to rows start: of the shared value arrays instead of being
+    returned; the cube comes back with the number written per measure.
+    """
+    df, blocks = attach_frame(spec)
+    cube = fea.segment_cube(df.iloc[start:stop], sketch_error)
+    counts = {}
+    for m, value_spec in value_specs.items():
+        data, value_blocks = _attach_columns(value_spec)
+        counts[m] = len(cube.values[m])
+        data['value'][start:start + counts[m]] = cube.values[m]
+        data['cell'][start:start + counts[m]] = cube.value_cells[m]
+        cube.values[m], cube.value_cells[m] = cube.values[m][:0], cube.value_cells[m][:0]
+    return cube, counts
+
+def partitioned_segment_cube(executor, shared, n_partitions, sketch_error=None):
+    """
+    Build the segment cube of a shared scored frame over row partitions in
+    parallel and return it as a SharedCube. Only counts, sums and sketches
+    travel between processes: partitions write their values straight into
+    shared memory, where the parent merges them in row order, so cell
+    values (and exact medians) match a cube built in one pass.
+    """
+    n_rows = shared.spec['n_rows']
+    values = {}
+    if sketch_error is None:
+        for m in fea.CUBE_QUANTILE_MEASURES:
+            values[m] = SharedFrame(pd.DataFrame({'value': np.zeros(n_rows),
+                                                  'cell': np.zeros(n_rows, dtype=np.int64)}))
+    try:
+        value_specs = {m: frame.spec for m, frame in values.items()}
+        bounds = np.linspace(0, n_rows, n_partitions + 1).astype(int)
+        futures = [executor.submit(_partial_cube, shared.spec, start, stop, sketch_error,
+                                   value_specs)
+                   for start, stop in zip(bounds[:-1], bounds[1:])]
+        parts = [future.result() for future in futures]
+        cube = parts[0][0]
+        for part, _ in parts[1:]:
+            # Cell ids of the shared values only line up under the same labels
+            if values and part.labels != cube.labels:
+                raise ValueError("partitions of one shared frame have different labels")
+            cube.merge(part)
+
+        for m, frame in values.items():
+            data, blocks = _attach_columns(frame.spec)
+            rows = np.concatenate([np.arange(start, start + counts[m])
+                                   for start, (_, counts) in zip(bounds, parts)])
+            cells = data['cell'][rows]
+            order = np.argsort(cells, kind='stable')
+            data['value'][:len(rows)] = data['value'][rows][order]
+            data['cell'][:len(rows)] = cells[order]
+            frame.spec['n_rows'] = len(rows)
+            del data
+            for block in blocks:
+                block.close()
+    except BaseException:
+        for frame in values.values():
+            frame.close()
+        raise
+    return SharedCube(cube, values)
+
+@traced
+def run_parallel_analysis(df, top_n=1000, max_workers=None, stages=None, sketch_error=None,
+                          density=False, output_dir=fea.BASE_DIR):
+    """
+    Run the post-scoring stages of main() on a process pool.
+    df must already be scored. Stage output is printed in the usual order
+    once every stage has finished. Returns the valuable users frame.
+    """
+    stages = PARALLEL_STAGES if stages is None else stages
+    options = {'top_n': top_n, 'sketch_error': sketch_error, 'density': density,
+               'output_dir': output_dir, 'cube': None}
+    max_workers = max_workers or min(len(stages), os.cpu_count() or 1)
+
+    # Columns that later stages read from earlier ones are added up front
+    fea.add_age_group(df)
+    fea.add_platform_columns(df)
+    top_positions = fea.score_ranking(df).top(top_n)
+
+    with SharedFrame(df.reset_index(drop=True)) as shared, contextlib.ExitStack() as stack:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            if set(stages) & set(CUBE_STAGES):
+                shared_cube = stack.enter_context(
+                    partitioned_segment_cube(executor, shared, max_workers, sketch_error))
+                options['cube'] = shared_cube.spec
+            futures = [executor.submit(_run_stage, shared.spec, stage, top_positions, options)
+                       for stage in stages]
+            for future in futures:
+                print(future.result(), end='')
+
+    return df.iloc[top_positions]
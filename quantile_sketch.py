@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Approximate Quantile Sketches
+=============================
+KLL-style quantile sketches for medians, quartiles and describe() tables on
+data that is streamed in chunks or split across processes. Sketches use a
+fixed amount of memory, merge cheaply, and answer any rank query within a
+configurable normalised rank error. Count, mean, std, min and max are
+tracked exactly.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Compactor size per unit of rank error; k = 4 / error keeps the observed
+# worst-case rank error comfortably under error
+K_PER_ERROR = 4.0
+
+# Each level below the top may hold 2/3 of the items of the level above it
+CAPACITY_DECAY = 2 / 3
+
+class QuantileSketch:
+    """Mergeable KLL quantile sketch over a stream of numbers."""
+
+    def __init__(self, error=0.01, seed=0):
+        self.error = error
+        self.k = max(8, int(np.ceil(K_PER_ERROR / error)))
+        self.rng = np.random.default_rng(seed)
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.nan
+        self.max = np.nan
+
+    @classmethod
+    def from_values(cls, values, error=0.01, seed=0):
+        """Build a sketch from an array or Series in one call."""
+        return cls(error, seed).update(values)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - 1 - level
+        return max(2, int(self.k * CAPACITY_DECAY ** depth))
+
+    def _add_moments(self, count, mean, m2):
+        # Chan et al. parallel update of count, mean and sum of squared deviations
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def _compress(self):
+        compacted = True
+        while compacted:
+            compacted = False
+            for level in range(len(self.levels)):
+                items = self.levels[level]
+                if len(items) <= self._capacity(level):
+                    continue
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                # Sort, keep one item back if the count is odd, and promote every
+                # other item (random offset) to the next level at double weight
+                items = np.sort(items)
+                odd = len(items) % 2
+                promoted = items[odd + self.rng.integers(2)::2]
+                self.levels[level] = items[:odd]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                compacted = True
+
+    def update(self, values):
+        """Add a batch of values; missing values are ignored."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self._add_moments(len(values), values.mean(), ((values - values.mean()) ** 2).sum())
+        self.min = np.fmin(self.min, values.min())
+        self.max = np.fmax(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Merge another sketch into this one."""
+        if other.count == 0:
+            return self
+        self._add_moments(other.count, other.mean, other.m2)
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """Return the approximate q-quantile (q may be a scalar or a list)."""
+        q = np.asarray(q, dtype=np.float64)
+        if self.count == 0:
+            return np.full(q.shape, np.nan)[()]
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items_at), 2 ** level, dtype=np.float64)
+                                  for level, items_at in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items, cumulative = items[order], np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+        result = items[np.clip(positions, 0, len(items) - 1)]
+        result = np.where(q <= 0, self.min, np.where(q >= 1, self.max, result))
+        return result[()]
+
+    def median(self):
+        """Return the approximate median."""
+        return self.quantile(0.5)
+
+    def std(self):
+        """Return the sample standard deviation (exact)."""
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+    def describe(self, name=None):
+        """Return a pandas-style describe() Series with sketched quartiles."""
+        quartiles = self.quantile([0.25, 0.5, 0.75])
+        return pd.Series([self.count, self.mean if self.count else np.nan, self.std(),
+                          self.min, *quartiles, self.max],
+                         index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'],
+                         name=name)
+
+class GroupedQuantileSketch:
+    """One QuantileSketch per group key, mergeable across chunks and processes."""
+
+    def __init__(self, error=0.01, seed=0):
+        self.error = error
+        self.seed = seed
+        self.sketches = {}
+
+    def _sketch(self, key):
+        if key not in self.sketches:
+            self.sketches[key] = QuantileSketch(self.error, self.seed)
+        return self.sketches[key]
+
+    def update(self, keys, values):
+        """Add values, routed to groups by the matching keys."""
+        grouped = pd.Series(np.asarray(values, dtype=np.float64)).groupby(
+            np.asarray(keys), sort=False)
+        for key, group in grouped:
+            self._sketch(key).update(group.values)
+        return self
+
+    def merge(self, other):
+        """Merge another grouped sketch into this one."""
+        for key, sketch in other.sketches.items():
+            self._sketch(key).merge(sketch)
+        return self
+
+    def agg(self, aggs, index=None):
+        """
+        Return a groupby().agg()-style table for 'count', 'mean', 'median',
+        'std', 'min', 'max' and percentile names such as '90%'.
+        """
+        keys = sorted(self.sketches) if index is None else list(index)
+        rows = {}
+        for key in keys:
+            sketch = self.sketches.get(key, QuantileSketch(self.error))
+            row = []
+            for agg in aggs:
+                if agg == 'count':
+                    row.append(sketch.count)
+                elif agg == 'mean':
+                    row.append(sketch.mean if sketch.count else np.nan)
+                elif agg == 'median':
+                    row.append(sketch.median())
+                elif agg == 'std':
+                    row.append(sketch.std())
+                elif agg in ('min', 'max'):
+                    row.append(getattr(sketch, agg))
+                else:
+                    row.append(sketch.quantile(float(agg.rstrip('%')) / 100))
+            rows[key] = row
+        return pd.DataFrame.from_dict(rows, orient='index', columns=aggs)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Scored User Query Service
+=========================
+A long-running local HTTP service that loads and scores the dataset once
+and answers queries from memory, so campaign tools do not reload and
+rescore the CSV for every question:
+
+    python3 query_service.py --port 8765            # or --socket /tmp/fb.sock
+
+    GET  /health                     rows, snapshot version and source
+    GET  /users/<userid>             one scored user
+    GET  /users?ids=1,2,3            several scored users
+    GET  /top?k=100&user_category=High%20Engagement&primary_platform=Mobile
+                                     top-K users, optionally within a segment
+                                     (also gender= and age_group=)
+    GET  /segments?by=age_group      engagement count/mean/median/std by segment
+    GET  /summary                    the numbers behind the recommendations
+    POST /reload?path=new.csv        load a new snapshot and swap it in
+
+Responses are JSON. Queries read whichever snapshot was current when they
+started, so a reload never disturbs queries that are already running.
+Only the standard library and the analysis modules are used.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import facebook_eda_analysis as fea
+
+SEGMENT_COLUMNS = ['gender', 'age_group', 'primary_platform', 'user_category']
+
+# Users scanned per step when looking for the top K of a segment
+SCAN_BLOCK = 65536
+
+MAX_REQUEST_BYTES = 1 << 16
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return str(value)
+
+def _records(frame):
+    """Return frame rows as JSON-ready dicts (NaN becomes null)."""
+    return json.loads(frame.to_json(orient='records'))
+
+class Snapshot:
+    """An immutable, fully scored copy of the dataset with query indexes."""
+
+    def __init__(self, df, source, version, valuable_top_n=1000):
+        self.source = source
+        self.version = version
+        self.loaded_at = time.time()
+        self.rows = len(df)
+
+        # Users in rank order (score descending, ties by userid); unscored last
+        ranking = fea.score_ranking(df)
+        self.ranked = df.iloc[ranking.order].reset_index(drop=True)
+        self.n_scored = ranking.n_scored
+        # Segment columns as small integer codes so scans compare ints, not strings
+        self.segment_codes, self.segment_lookup = {}, {}
+        for col in SEGMENT_COLUMNS:
+            codes, values = pd.factorize(self.ranked[col])
+            self.segment_codes[col] = codes.astype(np.int16)
+            self.segment_lookup[col] = {str(value): code for code, value in enumerate(values)}
+
+        # Sorted userids for O(log n) lookups
+        self.id_order = np.argsort(self.ranked['userid'].values, kind='stable')
+        self.sorted_ids = self.ranked['userid'].values[self.id_order]
+
+        cube = fea.segment_cube(self.ranked)
+        self.segments = {col: cube.agg(col, 'engagement_score', ['count', 'mean', 'median', 'std'])
+                         for col in SEGMENT_COLUMNS}
+        self.summary = fea.recommendation_metrics(self.ranked,
+                                                  self.ranked.iloc[:valuable_top_n], cube)
+
+    def info(self):
+        return {'status': 'ok', 'rows': self.rows, 'version': self.version,
+                'source': self.source, 'loaded_at': self.loaded_at}
+
+    def positions(self, userids):
+        """Return ranked-frame positions of userids, or -1 where unknown."""
+        userids = np.asarray(userids, dtype=self.sorted_ids.dtype)
+        found = np.searchsorted(self.sorted_ids, userids)
+        found = np.minimum(found, len(self.sorted_ids) - 1)
+        hit = self.sorted_ids[found] == userids
+        return np.where(hit, self.id_order[found], -1)
+
+    def users(self, userids):
+        positions = self.positions(userids)
+        records = _records(self.ranked.iloc[positions[positions >= 0]])
+        for record, rank in zip(records, positions[positions >= 0]):
+            record['rank'] = int(rank) + 1 if rank < self.n_scored else None
+        return records
+
+    def top(self, k, filters):
+        """Top k scored users matching every {column: value} in filters."""
+        if not filters:
+            return _records(self.ranked.iloc[:min(k, self.n_scored)])
+        codes = {col: self.segment_lookup[col].get(value) for col, value in filters.items()}
+        if None in codes.values():
+            return []
+        found = []
+        # Scan in rank order and stop as soon as k matches are found
+        for start in range(0, self.n_scored, SCAN_BLOCK):
+            stop = min(start + SCAN_BLOCK, self.n_scored)
+            mask = np.ones(stop - start, dtype=bool)
+            for col, code in codes.items():
+                mask &= self.segment_codes[col][start:stop] == code
+            found.extend(start + np.flatnonzero(mask)[:k - len(found)])
+            if len(found) >= k:
+                break
+        return _records(self.ranked.iloc[found])
+
+    def segment_stats(self, by):
+        table = self.segments[by].reset_index()
+        table[by] = table[by].astype(str)
+        return _records(table)
+
+def build_snapshot(data_path, version=1):
+    """Load and score data_path with the analysis functions, quietly."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        df = fea.create_engagement_score(fea.load_data(data_path))
+        fea.add_age_group(df)
+        fea.add_platform_columns(df)
+    return Snapshot(df, data_path, version)
+
+class QueryService:
+    """Routes requests to the current snapshot and swaps snapshots on reload."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._reload_lock = asyncio.Lock()
+
+    async def reload(self, data_path=None):
+        async with self._reload_lock:
+            loop = asyncio.get_running_loop()
+            current = self.snapshot
+            # Load off the event loop so queries keep being served meanwhile
+            snapshot = await loop.run_in_executor(None, build_snapshot,
+                                                  data_path or current.source,
+                                                  current.version + 1)
+            self.snapshot = snapshot
+            return snapshot.info()
+
+    async def handle(self, method, path, query, body):
+        """Return (status, payload) for one request."""
+        snapshot = self.snapshot  # pinned for the whole request
+        parts = [unquote(part) for part in path.strip('/').split('/') if part]
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        loop = asyncio.get_running_loop()
+
+        if method == 'GET' and parts == ['health']:
+            return 200, snapshot.info()
+        if method == 'GET' and len(parts) == 2 and parts[0] == 'users':
+            users = snapshot.users([int(parts[1])])
+            return (200, users[0]) if users else (404, {'error': f'unknown user {parts[1]}'})
+        if method == 'GET' and parts == ['users']:
+            ids = [int(part) for part in params.get('ids', '').split(',') if part]
+            return 200, snapshot.users(ids)
+        if method == 'GET' and parts == ['top']:
+            k = int(params.pop('k', 100))
+            unknown = set(params) - set(SEGMENT_COLUMNS)
+            if unknown:
+                return 400, {'error': f"unknown segment column(s): {', '.join(sorted(unknown))}"}
+            # Large segment scans run on a worker thread (numpy releases the GIL)
+            return 200, await loop.run_in_executor(None, snapshot.top, k, params)
+        if method == 'GET' and parts == ['segments']:
+            by = params.get('by', 'user_category')
+            if by not in SEGMENT_COLUMNS:
+                return 400, {'error': f"by must be one of {', '.join(SEGMENT_COLUMNS)}"}
+            return 200, snapshot.segment_stats(by)
+        if method == 'GET' and parts == ['summary']:
+            return 200, snapshot.summary
+        if method == 'POST' and parts == ['reload']:
+            options = json.loads(body) if body.strip() else {}
+            return 200, await self.reload(params.get('path') or options.get('path'))
+        return 404, {'error': f'no route for {method} {path}'}
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        data = json.dumps(payload, default=_json_default).encode()
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}.get(
+            status, 'Internal Server Error')
+        writer.write(f"HTTP/1.1 {status} {reason}\r\n"
+                     f"Content-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                     f"\r\n".encode() + data)
+        await writer.drain()
+
+    async def serve_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until it closes."""
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except ValueError as e:
+                    # Nothing after a malformed request can be framed, so answer and close
+                    await self._respond(writer, 400, {'error': str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+
+                url = urlsplit(target)
+                try:
+                    status, payload = await self.handle(method.upper(), url.path, url.query, body)
+                except (ValueError, KeyError) as e:
+                    status, payload = 400, {'error': str(e)}
+                except Exception as e:
+                    status, payload = 500, {'error': f'{type(e).__name__}: {e}'}
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+async def _read_request(reader):
+    """
+    Read one request as (method, target, headers, body), or None once the
+    client has closed. Raises ValueError for a malformed request line,
+    header or Content-Length.
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+        raise ValueError(f"malformed request line {request_line[:100]!r}")
+    method, target, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, colon, value = line.decode('latin-1').partition(':')
+        if not colon:
+            raise ValueError(f"malformed header line {line[:100]!r}")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ValueError(f"invalid Content-Length {headers['content-length']!r}") from None
+    if length < 0:
+        raise ValueError(f"invalid Content-Length {length}")
+    length = min(length, MAX_REQUEST_BYTES)
+    body = (await reader.readexactly(length)).decode() if length else ''
+    return method, target, headers, body
+
+async def start_service(data_path=None, host='127.0.0.1', port=8765, unix_socket=None):
+    """Load the first snapshot and start listening; returns (service, server)."""
+    loop = asyncio.get_running_loop()
+    snapshot = await loop.run_in_executor(None, build_snapshot, data_path or fea.DATA_PATH)
+    service = QueryService(snapshot)
+    if unix_socket:
+        server = await asyncio.start_unix_server(service.serve_connection, path=unix_socket)
+    else:
+        server = await asyncio.start_server(service.serve_connection, host, port)
+    return service, server
+
+async def _serve_forever(args):
+    service, server = await start_service(args.data, args.host, args.port, args.socket)
+    where = args.socket or f"http://{args.host}:{server.sockets[0].getsockname()[1]}"
+    print(f"Serving {service.snapshot.rows:,} scored users on {where}")
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve scored users over local HTTP")
+    parser.add_argument('--data', help="input CSV (default: pseudo_facebook.csv in FACEBOOK_EDA_DIR)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', help="listen on this Unix socket instead of TCP")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    main()
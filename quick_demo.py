@@ -5,26 +5,49 @@ Quick Demo - Facebook EDA Analysis
 This script provides a quick 30-second demo of the key findings.
 """
 
-import pandas as pd
+import numpy as np
 import warnings
+from facebook_eda_analysis import DATA_PATH, load_data
+from segment_cube import SegmentCube, category_codes, cut_codes
 warnings.filterwarnings('ignore')
 
-def main():
+AGE_BINS = [0, 18, 25, 35, 50, 150]
+AGE_LABELS = ['<18', '18-25', '26-35', '36-50', '50+']
+
+def demo_cube(df):
+    """Aggregate everything the demo reports in one pass over the users."""
+    lean = np.sign(df['mobile_likes'].to_numpy(np.int64) - df['www_likes'].to_numpy(np.int64))
+    friends = df['friend_count'].to_numpy()
+    dimensions = {
+        'gender': category_codes(df['gender']),
+        'age_group': (cut_codes(df['age'], AGE_BINS), AGE_LABELS),
+        'platform_lean': (lean + 1, ['Web-first', 'Even', 'Mobile-first']),
+        'friends': (np.where(friends == 0, 0, np.where(friends > 1000, 2, 1)),
+                    ['None', '1-1000', '>1000']),
+    }
+    measures = {col: df[col].to_numpy(np.float64)
+                for col in ['age', 'friend_count', 'likes', 'tenure']}
+    return SegmentCube(dimensions, measures)
+
+def main(filepath=DATA_PATH):
     print("="*70)
     print("FACEBOOK USER ENGAGEMENT ANALYSIS - QUICK DEMO")
     print("="*70)
     
     # Load data
     print("\n📊 Loading dataset...")
-    df = pd.read_csv('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
+    df = load_data(filepath)
     print(f"   ✓ Loaded {len(df):,} user records")
     
+    cube = demo_cube(df)
+    gender_counts = cube.size('gender')
+    
     # Basic stats
     print("\n📈 Dataset Overview:")
-    print(f"   • Average Age: {df['age'].mean():.1f} years")
-    print(f"   • Gender Split: {len(df[df['gender']=='male']):,} male, {len(df[df['gender']=='female']):,} female")
-    print(f"   • Average Friends: {df['friend_count'].mean():.0f}")
-    print(f"   • Average Tenure: {df['tenure'].mean():.0f} days")
+    print(f"   • Average Age: {cube.mean('age'):.1f} years")
+    print(f"   • Gender Split: {gender_counts.get('male', 0):,} male, {gender_counts.get('female', 0):,} female")
+    print(f"   • Average Friends: {cube.mean('friend_count'):.0f}")
+    print(f"   • Average Tenure: {cube.mean('tenure'):.0f} days")
     
     # Top users
     print("\n🌟 Top 10 Users by Friend Count:")
@@ -32,39 +55,37 @@ def main():
     print(top_friends.to_string(index=False))
     
     # Platform usage
-    mobile_users = len(df[df['mobile_likes'] > df['www_likes']])
-    web_users = len(df[df['www_likes'] > df['mobile_likes']])
+    mobile_users = cube.size('platform_lean')['Mobile-first']
+    web_users = cube.size('platform_lean')['Web-first']
     
     print("\n📱 Platform Preferences:")
     print(f"   • Mobile-first: {mobile_users:,} users ({mobile_users/len(df)*100:.1f}%)")
     print(f"   • Web-first: {web_users:,} users ({web_users/len(df)*100:.1f}%)")
     
     # Engagement insights
-    high_engagement = df[df['friend_count'] > 1000]
+    high_engagement = cube.where(friends='>1000')
     print("\n💡 High Engagement Users (>1000 friends):")
-    print(f"   • Count: {len(high_engagement):,} users")
-    print(f"   • Average Likes: {high_engagement['likes'].mean():.0f}")
-    print(f"   • Average Tenure: {high_engagement['tenure'].mean():.0f} days")
+    print(f"   • Count: {high_engagement.size():,} users")
+    print(f"   • Average Likes: {high_engagement.mean('likes'):.0f}")
+    print(f"   • Average Tenure: {high_engagement.mean('tenure'):.0f} days")
     
     # Gender insights
     print("\n👥 Engagement by Gender:")
+    friends_by_gender = cube.agg('gender', 'friend_count', ['size', 'mean'])
+    likes_by_gender = cube.agg('gender', 'likes', ['mean'])
     for gender in ['male', 'female']:
-        gender_df = df[df['gender'] == gender]
-        print(f"   • {gender.capitalize()}: {len(gender_df):,} users, "
-              f"Avg Friends: {gender_df['friend_count'].mean():.0f}, "
-              f"Avg Likes: {gender_df['likes'].mean():.0f}")
+        print(f"   • {gender.capitalize()}: {friends_by_gender.loc[gender, 'size']:,} users, "
+              f"Avg Friends: {friends_by_gender.loc[gender, 'mean']:.0f}, "
+              f"Avg Likes: {likes_by_gender.loc[gender, 'mean']:.0f}")
     
     # Age groups
     print("\n🎂 Engagement by Age Group:")
-    age_bins = [0, 18, 25, 35, 50, 150]
-    age_labels = ['<18', '18-25', '26-35', '36-50', '50+']
-    df['age_group'] = pd.cut(df['age'], bins=age_bins, labels=age_labels)
+    friends_by_age = cube.agg('age_group', 'friend_count', ['size', 'mean'])
     
-    for age_group in age_labels:
-        age_df = df[df['age_group'] == age_group]
-        if len(age_df) > 0:
-            print(f"   • {age_group}: {len(age_df):,} users, "
-                  f"Avg Friends: {age_df['friend_count'].mean():.0f}")
+    for age_group, row in friends_by_age.iterrows():
+        if row['size'] > 0:
+            print(f"   • {age_group}: {int(row['size']):,} users, "
+                  f"Avg Friends: {row['mean']:.0f}")
     
     # Key recommendations
     print("\n" + "="*70)
@@ -74,13 +95,13 @@ def main():
     print(f"   → {mobile_users/len(df)*100:.1f}% prefer mobile - prioritize mobile UX")
     
     print("\n2. FRIEND CONNECTIONS")
-    print(f"   → Users with >1000 friends are {len(high_engagement)/len(df)*100:.2f}% of base")
-    print(f"   → They are {high_engagement['likes'].mean()/df['likes'].mean():.1f}x more engaged")
+    print(f"   → Users with >1000 friends are {high_engagement.size()/len(df)*100:.2f}% of base")
+    print(f"   → They are {high_engagement.mean('likes')/cube.mean('likes'):.1f}x more engaged")
     print("   → Implement better friend suggestions")
     
     print("\n3. GENDER-SPECIFIC STRATEGIES")
-    male_avg = df[df['gender']=='male']['friend_count'].mean()
-    female_avg = df[df['gender']=='female']['friend_count'].mean()
+    male_avg = friends_by_gender.loc['male', 'mean']
+    female_avg = friends_by_gender.loc['female', 'mean']
     if female_avg > male_avg:
         print(f"   → Female users have {female_avg/male_avg:.1f}x more friends")
         print("   → Create female-focused engagement features")
@@ -89,7 +110,7 @@ def main():
         print("   → Create male-focused engagement features")
     
     print("\n4. RE-ENGAGEMENT OPPORTUNITY")
-    inactive = len(df[df['friend_count'] == 0])
+    inactive = cube.size('friends')['None']
     print(f"   → {inactive:,} users have 0 friends ({inactive/len(df)*100:.1f}%)")
     print("   → Launch friend connection campaigns")
     
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Score History
+=============
+An append-only store of every run's scores, so runs can be compared
+instead of each one overwriting valuable_users_list.csv:
+
+    score_history/
+        meta.json                 snapshot names, row counts and category labels
+        snapshot-00000.npz        one compressed segment per snapshot:
+        snapshot-00001.npz        userid (sorted, delta-encoded), engagement_score
+        ...                       (float32), user_category codes (int8) and
+                                  the userids of the top_n, best first
+
+Segments are never rewritten. Userids are stored sorted, so the gaps
+between them fit in one byte or two and compress to almost nothing, and
+scores are stored as float32 byte planes, which compress much better than
+interleaved bytes: about 3.3 bytes per user, or 1.2 GB for a year of daily
+snapshots of a million users.
+
+Two snapshots are compared with a sorted merge-join on userid in linear
+time, giving movers (whose score rose or fell), newcomers, departed users,
+users who entered or left the valuable top-N, and category transitions.
+The top-N is taken from the full-precision scores when the snapshot is
+stored, so it matches valuable_users_list.csv even where float32 rounding
+ties users at the cutoff; a diff over a larger N than was stored falls
+back to ranking the float32 scores.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from topk import top_k_positions
+
+HISTORY_VERSION = 1
+
+def _encode_ids(userids):
+    """First userid plus the gaps to each next one, in the smallest unsigned dtype."""
+    gaps = np.diff(userids)
+    dtype = next(t for t in (np.uint8, np.uint16, np.uint32, np.uint64)
+                 if not len(gaps) or gaps.max() <= np.iinfo(t).max)
+    return userids[:1], gaps.astype(dtype)
+
+def _decode_ids(first, gaps):
+    return np.concatenate([first, first + np.cumsum(gaps, dtype=np.int64)]) if len(first) else first
+
+def _encode_scores(scores):
+    # Byte plane k holds byte k of every float32, so the exponent bytes sit together
+    return scores.astype(np.float32).view(np.uint8).reshape(-1, 4).T.copy()
+
+def _decode_scores(planes):
+    return np.ascontiguousarray(planes.T).view(np.float32).ravel()
+
+class SnapshotDiff:
+    """What changed between two snapshots; every table is keyed by userid."""
+
+    def __init__(self, old, new, movers, newcomers, departed, valuable_entered, valuable_left,
+                 transitions, top_n):
+        self.old, self.new = old, new
+        self.movers = movers
+        self.newcomers = newcomers
+        self.departed = departed
+        self.valuable_entered = valuable_entered
+        self.valuable_left = valuable_left
+        self.transitions = transitions
+        self.top_n = top_n
+
+    def falling(self, n=10):
+        """The n users whose score fell the most."""
+        return self.movers[self.movers['change'] < 0].head(n)
+
+    def rising(self, n=10):
+        """The n users whose score rose the most."""
+        return self.movers[self.movers['change'] > 0].iloc[::-1].head(n)
+
+def _top_mask(ids, scores, top_n, top_ids):
+    """Mask of the top_n users: top_ids if given, else ranked by scores."""
+    mask = np.zeros(len(ids), dtype=bool)
+    if top_ids is None:
+        mask[top_k_positions(scores, ids, top_n)] = True
+    else:
+        mask[np.searchsorted(ids, top_ids[:top_n])] = True
+    return mask
+
+def diff_snapshots(old, new, top_n=1000, min_change=0.0, names=(None, None), tops=(None, None)):
+    """
+    Compare two snapshots (frames of userid, engagement_score, user_category
+    sorted by userid, as ScoreHistory.load returns them). movers holds users
+    in both whose score changed by at least min_change, biggest fall first.
+    tops optionally gives each snapshot's top userids, best first, to use
+    instead of ranking its scores.
+    """
+    old_ids, new_ids = old['userid'].to_numpy(np.int64), new['userid'].to_numpy(np.int64)
+    n_old = len(old_ids)
+
+    # Merge-join: a stable sort of two sorted runs is one linear merge pass
+    # (timsort), and a user in both shows up as an adjacent old/new pair
+    ids = np.concatenate([old_ids, new_ids])
+    order = np.argsort(ids, kind='stable')
+    pairs = np.flatnonzero(ids[order][1:] == ids[order][:-1])
+    old_pos, new_pos = order[pairs], order[pairs + 1] - n_old
+    in_new = np.zeros(n_old, dtype=bool)
+    in_new[old_pos] = True
+    in_old = np.zeros(len(new_ids), dtype=bool)
+    in_old[new_pos] = True
+
+    old_scores = old['engagement_score'].to_numpy(np.float64)
+    new_scores = new['engagement_score'].to_numpy(np.float64)
+    change = new_scores[new_pos] - old_scores[old_pos]
+    moved = np.abs(change) >= min_change if min_change > 0 else change != 0
+    # Becoming scored or unscored is a change; staying unscored is not
+    moved = (moved | np.isnan(change)) & ~(np.isnan(old_scores[old_pos]) & np.isnan(new_scores[new_pos]))
+    movers = pd.DataFrame({'userid': old_ids[old_pos], 'old_score': old_scores[old_pos],
+                           'new_score': new_scores[new_pos], 'change': change,
+                           'old_category': old['user_category'].to_numpy()[old_pos],
+                           'new_category': new['user_category'].to_numpy()[new_pos]})[moved]
+    movers = movers.sort_values('change', kind='stable').reset_index(drop=True)
+
+    # Users entering or leaving the top_n, with their score in the other snapshot
+    old_top = _top_mask(old_ids, old_scores, top_n, tops[0])
+    new_top = _top_mask(new_ids, new_scores, top_n, tops[1])
+    new_score_of_old = np.full(n_old, np.nan)
+    new_score_of_old[old_pos] = new_scores[new_pos]
+    old_score_of_new = np.full(len(new_ids), np.nan)
+    old_score_of_new[new_pos] = old_scores[old_pos]
+    top_in_new = np.zeros(n_old, dtype=bool)
+    top_in_new[old_pos] = new_top[new_pos]
+    top_in_old = np.zeros(len(new_ids), dtype=bool)
+    top_in_old[new_pos] = old_top[old_pos]
+    left = old_top & ~top_in_new
+    entered = new_top & ~top_in_old
+    valuable_left = pd.DataFrame({'userid': old_ids[left], 'old_score': old_scores[left],
+                                  'new_score': new_score_of_old[left]})
+    valuable_entered = pd.DataFrame({'userid': new_ids[entered], 'old_score': old_score_of_new[entered],
+                                     'new_score': new_scores[entered]})
+
+    # Category transitions of users in both, as an old x new count table
+    old_cat = pd.Categorical(old['user_category'])
+    new_cat = pd.Categorical(new['user_category'])
+    labels = list(old_cat.categories) + [c for c in new_cat.categories if c not in old_cat.categories]
+    old_codes = pd.Categorical(old_cat, categories=labels).codes[old_pos].astype(np.int64)
+    new_codes = pd.Categorical(new_cat, categories=labels).codes[new_pos].astype(np.int64)
+    both = (old_codes >= 0) & (new_codes >= 0)
+    counts = np.bincount(old_codes[both] * len(labels) + new_codes[both],
+                         minlength=len(labels) ** 2).reshape(len(labels), len(labels))
+    transitions = pd.DataFrame(counts, index=pd.Index(labels, name='old_category'),
+                               columns=pd.Index(labels, name='new_category'))
+
+    return SnapshotDiff(names[0], names[1], movers, new[~in_old].reset_index(drop=True),
+                        old[~in_new].reset_index(drop=True), valuable_entered, valuable_left,
+                        transitions, top_n)
+
+class ScoreHistory:
+    """Append-only score snapshots in one directory."""
+
+    def __init__(self, history_dir):
+        self.history_dir = history_dir
+        meta_path = os.path.join(history_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+            if self.meta['version'] != HISTORY_VERSION:
+                raise ValueError(f"'{history_dir}' has history version {self.meta['version']}, "
+                                 f"expected {HISTORY_VERSION}")
+        else:
+            self.meta = {'version': HISTORY_VERSION, 'snapshots': []}
+
+    def __len__(self):
+        return len(self.meta['snapshots'])
+
+    def names(self):
+        """Snapshot names, oldest first."""
+        return [snapshot['name'] for snapshot in self.meta['snapshots']]
+
+    def _snapshot(self, name):
+        for snapshot in self.meta['snapshots']:
+            if snapshot['name'] == name:
+                return snapshot
+        raise KeyError(f"no snapshot named '{name}' in '{self.history_dir}'")
+
+    def append(self, df, name=None, top_n=1000):
+        """
+        Store the userid, engagement_score and user_category of a scored
+        frame, and its top_n users, as a new snapshot and return its name
+        (today's date by default, with -2, -3, ... for further runs on the
+        same day).
+        """
+        if name is None:
+            name = base = time.strftime('%Y-%m-%d')
+            suffix = 2
+            while name in self.names():
+                name, suffix = f'{base}-{suffix}', suffix + 1
+        elif name in self.names():
+            raise ValueError(f"snapshot '{name}' already exists; snapshots are never replaced")
+
+        userids = df['userid'].to_numpy(np.int64)
+        order = np.argsort(userids, kind='stable')
+        userids = userids[order]
+        if len(userids) > 1 and (userids[1:] == userids[:-1]).any():
+            raise ValueError("userid is not unique; cannot store a snapshot")
+        categories = pd.Categorical(df['user_category'])
+        first, gaps = _encode_ids(userids)
+        # Ranked on the float64 scores, as identify_valuable_users does
+        top = df['userid'].to_numpy(np.int64)[
+            top_k_positions(df['engagement_score'].to_numpy(np.float64),
+                            df['userid'].to_numpy(np.int64), top_n)]
+
+        os.makedirs(self.history_dir, exist_ok=True)
+        filename = f'snapshot-{len(self):05d}.npz'
+        tmp_path = os.path.join(self.history_dir, filename + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, first=first, gaps=gaps,
+                                scores=_encode_scores(df['engagement_score'].to_numpy()[order]),
+                                categories=categories.codes[order].astype(np.int8), top=top)
+        os.replace(tmp_path, os.path.join(self.history_dir, filename))
+
+        # The snapshot only becomes visible once meta.json lists it
+        self.meta['snapshots'].append({'name': name, 'file': filename, 'rows': len(userids),
+                                       'created': time.time(), 'top_n': top_n,
+                                       'categories': [str(c) for c in categories.categories]})
+        meta_path = os.path.join(self.history_dir, 'meta.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(self.meta, f, indent=1)
+        os.replace(meta_path + '.tmp', meta_path)
+        return name
+
+    def load(self, name):
+        """Return a snapshot as a frame of userid, engagement_score and user_category."""
+        snapshot = self._snapshot(name)
+        with np.load(os.path.join(self.history_dir, snapshot['file'])) as segment:
+            return pd.DataFrame({
+                'userid': _decode_ids(segment['first'], segment['gaps']),
+                'engagement_score': _decode_scores(segment['scores']),
+                'user_category': pd.Categorical.from_codes(segment['categories'], snapshot['categories']),
+            })
+
+    def top(self, name, top_n=1000):
+        """
+        Userids of a snapshot's top_n, best first, as stored with it; None
+        if fewer than top_n were stored.
+        """
+        snapshot = self._snapshot(name)
+        if snapshot.get('top_n', 0) < top_n:
+            return None
+        with np.load(os.path.join(self.history_dir, snapshot['file'])) as segment:
+            return segment['top'][:top_n]
+
+    def diff(self, old=None, new=None, top_n=1000, min_change=0.0):
+        """Compare two snapshots (by default the last two); see diff_snapshots."""
+        names = self.names()
+        if new is None:
+            new = names[-1]
+        if old is None:
+            before = names[:names.index(new)]
+            if not before:
+                raise ValueError(f"snapshot '{new}' has no earlier snapshot to compare with")
+            old = before[-1]
+        return diff_snapshots(self.load(old), self.load(new), top_n, min_change, (old, new),
+                              (self.top(old, top_n), self.top(new, top_n)))
+
+    def nbytes(self):
+        """Bytes on disk used by all snapshots."""
+        return sum(os.path.getsize(os.path.join(self.history_dir, snapshot['file']))
+                   for snapshot in self.meta['snapshots'])
+
+def record_history(df, history_dir, top_n=1000):
+    """Append a run's scores to the history and print how they changed since the last run."""
+    history = ScoreHistory(history_dir)
+    name = history.append(df, top_n=top_n)
+    print(f"\nScores saved to history '{history_dir}' as snapshot '{name}' "
+          f"({len(history)} snapshots, {history.nbytes() / 1e6:.1f} MB)")
+    if len(history) > 1:
+        print_diff(history.diff(top_n=top_n))
+    return name
+
+def print_diff(diff, limit=10):
+    """Print a summary of a SnapshotDiff."""
+    print("\n" + "="*80)
+    print(f"SCORE HISTORY: {diff.old} -> {diff.new}")
+    print("="*80)
+    print(f"\nNew users: {len(diff.newcomers):,}")
+    print(f"Departed users: {len(diff.departed):,}")
+    print(f"Users whose score changed: {len(diff.movers):,}")
+    print(f"Entered the top {diff.top_n}: {len(diff.valuable_entered):,}")
+    print(f"Left the top {diff.top_n}: {len(diff.valuable_left):,}")
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        if len(diff.valuable_left):
+            print(f"\nValuable users who left the top {diff.top_n}:")
+            print(diff.valuable_left.head(limit).to_string(index=False))
+        falling = diff.falling(limit)
+        print("\nLargest score drops:")
+        print(falling.to_string(index=False) if len(falling) else "(none)")
+        print("\nCategory transitions (rows: before, columns: after):")
+        print(diff.transitions)
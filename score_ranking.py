@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Engagement Score Ranking
+========================
+One sort of the engagement scores per run, shared by everything that
+needs an ordering: per-user ordinal, dense and percentile ranks,
+quantile-based categories (deciles by default), the median and quartiles,
+and any top-N slice. Users are ordered by score, highest first, with ties
+broken by the smaller userid (as in topk); unscored users come last.
+
+The ordinal rank is stored in the frame (engagement_rank), so later stages
+and worker processes rebuild the ordering by inverting that permutation in
+linear time instead of sorting again. The rebuilt order is checked against
+the scores in one pass, so ranks left stale by a score change are never
+trusted: the scores are sorted again instead.
+"""
+
+import numpy as np
+import pandas as pd
+
+def quantile_labels(cut_points):
+    """Labels like '0-10%' ... '90-100%' for the buckets between cut points."""
+    return [f'{lo * 100:g}-{hi * 100:g}%' for lo, hi in zip(cut_points[:-1], cut_points[1:])]
+
+def _lerp(low, high, t):
+    # Same interpolation as np.quantile, so results match it bit for bit
+    diff = high - low
+    return np.where(t >= 0.5, high - diff * (1 - t), low + diff * t)
+
+def _in_rank_order(ranked, ranked_ids):
+    """Whether scores are best first, ties by ascending userid, NaN last."""
+    unscored = np.isnan(ranked)
+    n_scored = len(ranked) - int(unscored.sum())
+    if unscored[:n_scored].any():
+        return False
+    scored = ranked[:n_scored]
+    if (scored[1:] > scored[:-1]).any():
+        return False
+    same = (ranked[1:] == ranked[:-1]) | (unscored[1:] & unscored[:-1])
+    return not (ranked_ids[1:][same] <= ranked_ids[:-1][same]).any()
+
+class ScoreRanking:
+    """Users in rank order, with the statistics that follow from it."""
+
+    def __init__(self, order, scores):
+        self.order = order
+        self.scores = scores
+        self._groups = None
+        self.n_scored = int((~np.isnan(scores)).sum())
+        # Scored users best first; ascending order is the reversed view
+        self.sorted_scores = scores[order[:self.n_scored]]
+
+    @classmethod
+    def from_scores(cls, scores, userids):
+        """Sort users by score descending, then userid ascending; NaN scores last."""
+        scores = np.asarray(scores, dtype=np.float64)
+        userids = np.asarray(userids)
+        order = np.argsort(-scores, kind='stable')
+        ranked = scores[order]
+        same = (ranked[1:] == ranked[:-1]) | (np.isnan(ranked[1:]) & np.isnan(ranked[:-1]))
+        if same.any():
+            # Break ties by userid, re-sorting only the users in tied runs
+            tied = np.flatnonzero(np.append(same, False) | np.insert(same, 0, False))
+            run = np.cumsum(np.insert(~same, 0, True))[tied]
+            tied_order = order[tied]
+            order[tied] = tied_order[np.lexsort((userids[tied_order], run))]
+        return cls(order, scores)
+
+    @classmethod
+    def from_ranks(cls, ranks, scores, userids):
+        """
+        Rebuild a ranking from engagement_rank values without sorting them,
+        falling back to from_scores if the ranks do not match the scores.
+        """
+        ranks = np.asarray(ranks, dtype=np.int64)
+        scores = np.asarray(scores, dtype=np.float64)
+        userids = np.asarray(userids)
+        order = np.full(len(ranks), -1, dtype=np.int64)
+        valid = (ranks >= 1) & (ranks <= len(ranks))
+        order[ranks[valid] - 1] = np.flatnonzero(valid)
+        if (order < 0).any():
+            # Not a permutation of 1..n (e.g. a subset of a ranked frame)
+            order = np.argsort(ranks, kind='stable')
+        if not _in_rank_order(scores[order], userids[order]):
+            return cls.from_scores(scores, userids)
+        return cls(order, scores)
+
+    def top(self, k):
+        """Positions of the top k scored users, best first."""
+        return self.order[:min(k, self.n_scored)]
+
+    def ranks(self):
+        """Ordinal rank of every user (1 = best); unscored users rank last."""
+        ranks = np.empty(len(self.order), dtype=np.int64)
+        ranks[self.order] = np.arange(1, len(self.order) + 1)
+        return ranks
+
+    def _tie_groups(self):
+        """Start and end (exclusive) of each run of equal scores, best first."""
+        if self._groups is None:
+            starts = np.flatnonzero(np.diff(self.sorted_scores, prepend=np.nan) != 0)
+            ends = np.append(starts[1:], self.n_scored)[:len(starts)]
+            self._groups = starts, ends
+        return self._groups
+
+    def _per_user(self, group_values):
+        starts, ends = self._tie_groups()
+        values = np.full(len(self.order), np.nan)
+        values[self.order[:self.n_scored]] = np.repeat(group_values, ends - starts)
+        return values
+
+    def dense_ranks(self):
+        """Dense rank of every scored user (1 = best, ties share a rank), NaN if unscored."""
+        starts, _ = self._tie_groups()
+        return self._per_user(np.arange(1, len(starts) + 1, dtype=np.float64))
+
+    def percentile_ranks(self):
+        """Share of scored users at or below each user, ties averaged, like rank(pct=True)."""
+        starts, ends = self._tie_groups()
+        n = self.n_scored
+        return self._per_user((2 * n - starts - ends + 1) / 2 / n)
+
+    def quantile_categories(self, cut_points, labels=None):
+        """
+        Categorical of the percentile bucket (right-inclusive, between
+        consecutive cut_points in 0-1) each user falls in. Tied users always
+        share a bucket; unscored users get NaN.
+        """
+        cut_points = np.asarray(cut_points, dtype=np.float64)
+        percentiles = self.percentile_ranks()
+        codes = np.searchsorted(cut_points, percentiles, side='left') - 1
+        codes[percentiles == cut_points[0]] = 0
+        codes[(codes < 0) | (codes >= len(cut_points) - 1) | np.isnan(percentiles)] = -1
+        labels = quantile_labels(cut_points) if labels is None else labels
+        return pd.Categorical.from_codes(codes, labels, ordered=True)
+
+    def quantile(self, q):
+        """q-quantile of the scores (linear interpolation, like np.quantile)."""
+        ascending = self.sorted_scores[::-1]
+        if not len(ascending):
+            return np.full(np.shape(q), np.nan)[()]
+        position = np.asarray(q, dtype=np.float64) * (len(ascending) - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, len(ascending) - 1)
+        return _lerp(ascending[low], ascending[high], position - low)[()]
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def describe(self, name=None):
+        """series.describe() of the scores, with quartiles read off the sort."""
+        scores = pd.Series(self.scores)
+        quartiles = self.quantile([0.25, 0.5, 0.75])
+        extremes = (self.sorted_scores[-1], self.sorted_scores[0]) if self.n_scored else (np.nan,) * 2
+        return pd.Series([float(self.n_scored), scores.mean(), scores.std(), extremes[0],
+                          *quartiles, extremes[1]],
+                         index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'],
+                         name=name)
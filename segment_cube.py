@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Segment Cube
+============
+Pre-aggregated counts, sums and sums of squares over every combination of
+a few small segment dimensions (age group, gender, tenure group, user
+category, platform, ...), so segment reports read a small array instead
+of rescanning the users for every groupby, mask and bar chart.
+
+Each dimension is given as integer codes with their labels. Rows are
+mapped to one cell index and every measure is aggregated with a single
+np.bincount, so building the cube is one vectorised pass. Reports then
+drill down (where) and roll up (size, agg, quantile) over the cube.
+Missing dimension values get their own slot and are left out of roll-ups,
+as groupby does. Medians come from the measure's values kept in cell
+order, or from per-cell quantile sketches when sketch_error is set.
+Cubes built from different chunks or shards merge, even when some labels
+only occur in one of them.
+"""
+
+import numpy as np
+import pandas as pd
+
+from quantile_sketch import GroupedQuantileSketch, QuantileSketch
+
+def cut_codes(values, bins):
+    """Codes of pd.cut(values, bins) (right-inclusive bins), -1 where out of range."""
+    values = np.asarray(values, dtype=np.float64)
+    codes = np.searchsorted(bins, values, side='left') - 1
+    codes[(codes < 0) | (codes >= len(bins) - 1) | np.isnan(values)] = -1
+    return codes
+
+def category_codes(values, labels=None):
+    """Return (codes, labels) for a categorical, text or coded column."""
+    if isinstance(values, pd.Series):
+        values = values.array
+    if labels is None and isinstance(values, pd.Categorical):
+        return values.codes, list(values.categories)
+    categorical = pd.Categorical(values, categories=labels)
+    return categorical.codes, list(categorical.categories)
+
+class SegmentCube:
+    """Count/sum/sum-of-squares of measures over every combination of dimensions."""
+
+    def __init__(self, dimensions, measures=None, quantile_measures=(), observed=(),
+                 sketch_error=None):
+        """
+        dimensions maps name -> (codes, labels) with code -1 for missing;
+        measures maps name -> values (NaN is missing). Roll-ups over the
+        dimensions named in observed drop empty groups, like a groupby on a
+        non-categorical column. quantile_measures keep what medians need.
+        """
+        self.dims = list(dimensions)
+        self.labels = {name: list(labels) for name, (_, labels) in dimensions.items()}
+        self.observed = set(observed)
+        self.sketch_error = sketch_error
+        self.shape = tuple(len(self.labels[name]) + 1 for name in self.dims)
+        n_cells = self.n_cells = int(np.prod(self.shape))
+        cell_dtype = np.int16 if n_cells < 2**15 else np.int32 if n_cells < 2**31 else np.int64
+
+        # Mixed-radix cell index; missing codes go to each dimension's last slot
+        cell = None
+        for name, size in zip(self.dims, self.shape):
+            codes = np.asarray(dimensions[name][0]).astype(cell_dtype)
+            codes[codes < 0] = size - 1
+            cell = codes if cell is None else cell * cell_dtype(size) + codes
+        if cell is None:
+            cell = np.zeros(0, dtype=cell_dtype)
+        self.cells = np.arange(n_cells).reshape(self.shape)
+
+        self.rows = np.bincount(cell, minlength=n_cells).reshape(self.shape)
+        self.n, self.sum, self.sumsq = {}, {}, {}
+        for name, values in (measures or {}).items():
+            values = np.asarray(values, dtype=np.float64)
+            present = ~np.isnan(values)
+            filled = np.where(present, values, 0.0)
+            self.n[name] = np.bincount(cell, present, n_cells).reshape(self.shape)
+            self.sum[name] = np.bincount(cell, filled, n_cells).reshape(self.shape)
+            self.sumsq[name] = np.bincount(cell, filled * filled, n_cells).reshape(self.shape)
+
+        self.values, self.value_cells, self.sketches = {}, {}, {}
+        for name in quantile_measures:
+            values = np.asarray(measures[name], dtype=np.float64)
+            present = ~np.isnan(values)
+            if sketch_error is not None:
+                self.sketches[name] = GroupedQuantileSketch(sketch_error).update(
+                    cell[present], values[present])
+            else:
+                order = np.argsort(cell[present], kind='stable')
+                self.values[name] = values[present][order]
+                self.value_cells[name] = cell[present][order]
+
+    def _view(self, cells, rows, n, sums, sumsq, labels):
+        cube = object.__new__(SegmentCube)
+        cube.__dict__.update(self.__dict__)
+        cube.cells, cube.rows, cube.n, cube.sum, cube.sumsq = cells, rows, n, sums, sumsq
+        cube.labels = labels
+        cube.shape = rows.shape
+        return cube
+
+    def _expand(self, labels):
+        """Return this (full) cube laid out over a superset of its labels."""
+        positions = [[labels[name].index(label) for label in self.labels[name]] + [len(labels[name])]
+                     for name in self.dims]
+        shape = tuple(len(labels[name]) + 1 for name in self.dims)
+        take = np.ix_(*positions)
+
+        def expand(array):
+            expanded = np.zeros(shape, dtype=array.dtype)
+            expanded[take] = array
+            return expanded
+
+        cells = np.arange(int(np.prod(shape))).reshape(shape)
+        cube = self._view(cells, expand(self.rows), {m: expand(a) for m, a in self.n.items()},
+                          {m: expand(a) for m, a in self.sum.items()},
+                          {m: expand(a) for m, a in self.sumsq.items()}, labels)
+        cube.n_cells = cells.size
+        # Old cell ids are row-major positions in the old shape
+        new_cell = cells[take].ravel()
+        cube.value_cells = {m: new_cell[c] for m, c in self.value_cells.items()}
+        cube.sketches = {}
+        for m, grouped in self.sketches.items():
+            cube.sketches[m] = GroupedQuantileSketch(grouped.error, grouped.seed)
+            cube.sketches[m].sketches = {int(new_cell[c]): s for c, s in grouped.sketches.items()}
+        return cube
+
+    def merge(self, other):
+        """Merge a cube of other rows over the same dimensions and measures into this one."""
+        if other.dims != self.dims or set(other.n) != set(self.n) or \
+                set(other.values) != set(self.values) or set(other.sketches) != set(self.sketches):
+            raise ValueError("cubes have different dimensions, measures or quantile storage")
+        labels = {}
+        for name in self.dims:
+            union = self.labels[name] + [label for label in other.labels[name]
+                                         if label not in self.labels[name]]
+            # Labels that came sorted (category codes) stay sorted, as groupby orders them
+            both_sorted = all(list(side) == sorted(side) for side in (self.labels[name],
+                                                                     other.labels[name]))
+            labels[name] = sorted(union) if both_sorted else union
+        merged = self._expand(labels) if labels != self.labels else self
+        other = other._expand(labels) if labels != other.labels else other
+        merged.rows = merged.rows + other.rows
+        for m in merged.n:
+            merged.n[m] = merged.n[m] + other.n[m]
+            merged.sum[m] = merged.sum[m] + other.sum[m]
+            merged.sumsq[m] = merged.sumsq[m] + other.sumsq[m]
+        for m in merged.values:
+            cells = np.concatenate([merged.value_cells[m], other.value_cells[m]])
+            order = np.argsort(cells, kind='stable')
+            merged.values[m] = np.concatenate([merged.values[m], other.values[m]])[order]
+            merged.value_cells[m] = cells[order]
+        for m in merged.sketches:
+            merged.sketches[m].merge(other.sketches[m])
+        self.__dict__.update(merged.__dict__)
+        return self
+
+    def where(self, **selections):
+        """Drill down: keep only the given label (or list of labels) of each dimension."""
+        index = [slice(None)] * len(self.dims)
+        labels = dict(self.labels)
+        for name, wanted in selections.items():
+            wanted = [wanted] if np.ndim(wanted) == 0 else list(wanted)
+            positions = [self.labels[name].index(label) for label in wanted]
+            axis = self.dims.index(name)
+            # The missing slot stays last (and empty) so shapes line up
+            index[axis] = positions + [len(self.labels[name])]
+            labels[name] = wanted
+        take = np.ix_(*[np.arange(size)[i] for size, i in zip(self.shape, index)])
+        missing = {name: len(labels[name]) for name in selections}
+        keep = np.ones(self.shape, dtype=bool)[take]
+        for name, slot in missing.items():
+            keep[(slice(None),) * self.dims.index(name) + (slot,)] = False
+        select = lambda array: np.where(keep, array[take], 0)
+        cells = np.where(keep, self.cells[take], -1)
+        return self._view(cells, select(self.rows),
+                          {m: select(a) for m, a in self.n.items()},
+                          {m: select(a) for m, a in self.sum.items()},
+                          {m: select(a) for m, a in self.sumsq.items()}, labels)
+
+    def _rollup(self, array, by):
+        """Sum array over the dimensions not in by and drop their missing slots."""
+        axes = tuple(i for i, name in enumerate(self.dims) if name not in by)
+        rolled = array.sum(axis=axes) if axes else array
+        kept = [name for name in self.dims if name in by]
+        rolled = rolled[tuple(slice(0, -1) for _ in kept)]
+        # Put the result in the order of by
+        return np.transpose(rolled, [kept.index(name) for name in by])
+
+    def _index(self, by):
+        if len(by) == 1:
+            return pd.Index(self.labels[by[0]], name=by[0])
+        return pd.MultiIndex.from_product([self.labels[name] for name in by], names=by)
+
+    def _frame(self, by, columns):
+        index = self._index(by)
+        frame = pd.DataFrame({name: values.ravel() for name, values in columns.items()},
+                             index=index)
+        if any(name in self.observed for name in by):
+            frame = frame[self._rollup(self.rows, by).ravel() > 0]
+        return frame
+
+    def size(self, by=None):
+        """Rows in total, or per group of by (a dimension name or a list of them)."""
+        if by is None:
+            return int(self.rows.sum())
+        by = [by] if isinstance(by, str) else list(by)
+        counts = self._frame(by, {'count': self._rollup(self.rows, by)})['count']
+        return counts.astype(np.int64)
+
+    def total(self, measure):
+        """Sum of a measure over every row of the cube."""
+        return float(self.sum[measure].sum())
+
+    def mean(self, measure):
+        """Mean of a measure over every row of the cube."""
+        n = self.n[measure].sum()
+        return self.sum[measure].sum() / n if n else np.nan
+
+    def _groups(self, by):
+        """Return each cell's group number under by (-1 for cells outside any group)."""
+        # Cell ids always refer to the full cube, also in drilled-down views
+        group_of_cell = np.full(self.n_cells, -1, dtype=np.int64)
+        sizes = [len(self.labels[name]) for name in by]
+        coords = np.indices(self.shape)
+        group = np.zeros(self.shape, dtype=np.int64)
+        valid = self.cells >= 0
+        for name, size in zip(by, sizes):
+            coord = coords[self.dims.index(name)]
+            valid &= coord < size
+            group = group * size + coord
+        group_of_cell[self.cells[valid]] = group[valid]
+        return group_of_cell, int(np.prod(sizes)) if by else 1
+
+    def quantile(self, measure, q, by=None):
+        """q-quantile of a measure in total, or per group of by."""
+        by = [] if by is None else [by] if isinstance(by, str) else list(by)
+        group_of_cell, n_groups = self._groups(by)
+        result = np.full(n_groups, np.nan)
+        if measure in self.sketches:
+            merged = {}
+            for cell, sketch in self.sketches[measure].sketches.items():
+                group = group_of_cell[cell]
+                if group >= 0:
+                    merged.setdefault(group, QuantileSketch(self.sketch_error)).merge(sketch)
+            for group, sketch in merged.items():
+                result[group] = sketch.quantile(q)
+        else:
+            groups = group_of_cell[self.value_cells[measure]]
+            keep = groups >= 0
+            order = np.argsort(groups[keep], kind='stable')
+            values = self.values[measure][keep][order]
+            bounds = np.concatenate([[0], np.cumsum(np.bincount(groups[keep], minlength=n_groups))])
+            for group in range(n_groups):
+                if bounds[group + 1] > bounds[group]:
+                    result[group] = np.quantile(values[bounds[group]:bounds[group + 1]], q)
+        if not by:
+            return result[0]
+        return self._frame(by, {measure: result.reshape([len(self.labels[n]) for n in by])})[measure]
+
+    def agg(self, by, measure, aggs):
+        """
+        Return a groupby(by)[measure].agg(aggs)-style table. aggs may include
+        'size', 'count', 'sum', 'mean', 'std', 'var' and 'median'.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        n = self._rollup(self.n[measure], by)
+        sums = self._rollup(self.sum[measure], by)
+        sumsq = self._rollup(self.sumsq[measure], by)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, sums / n, np.nan)
+            var = np.where(n > 1, np.maximum(sumsq - sums * mean, 0) / (n - 1), np.nan)
+        columns = {}
+        for name in aggs:
+            if name == 'size':
+                columns[name] = self._rollup(self.rows, by)
+            elif name == 'count':
+                columns[name] = n.astype(np.int64)
+            elif name == 'sum':
+                columns[name] = sums
+            elif name == 'mean':
+                columns[name] = mean
+            elif name == 'std':
+                columns[name] = np.sqrt(var)
+            elif name == 'var':
+                columns[name] = var
+            elif name == 'median':
+                columns[name] = self.quantile(measure, 0.5, by).reindex(
+                    self._index(by)).to_numpy().reshape(n.shape)
+            else:
+                raise ValueError(f"unsupported aggregation '{name}'")
+        return self._frame(by, columns)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Sharded Map-Reduce
+==================
+Runs scoring and the valuable-user reports over many shard files listed
+in a manifest instead of one pseudo_facebook.csv:
+
+    shards.txt                      one shard CSV per line (relative to the
+                                    manifest; blank lines and # comments skipped)
+    shards.txt.partials/
+        part-0001-<id>.bounds.pkl   feature min/max and row count
+        part-0001-<id>.scores.pkl   segment cube, top-K buffer, summary stats
+
+The map step has two phases. First every shard reports its feature
+bounds; once they are merged into the global bounds, every shard is scored
+with them (so scores match a single-file run exactly) and reduced to a
+small partial result. Each partial records the shard it came from (size,
+mtime and hash) and the parameters it was built with, so reruns redo only
+shards that changed. Scoring partials are also redone when the global
+bounds move, since every score depends on them.
+
+Partials are plain files: shards can be mapped on different machines or at
+different times (--shard-index/--shard-count) into a shared partials
+directory, then reduced anywhere into the same valuable users report,
+recommendations and valuable_users_list.csv as main().
+"""
+
+import hashlib
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import facebook_eda_analysis as fea
+from source_files import is_fresh, source_record
+from stage_cache import fingerprint
+from summary_stats import SummaryStats
+from topk import TopKBuffer
+from tracing import traced
+
+# Bump when partial results change shape or meaning
+PARTIAL_VERSION = 1
+
+PHASES = ['bounds', 'scores']
+
+def read_manifest(manifest_path):
+    """Return the shard paths listed in a manifest, resolved against its directory."""
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path) as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+
+def write_manifest(shard_paths, manifest_path):
+    """Write a manifest listing shard_paths (kept relative where possible)."""
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'w') as f:
+        for path in shard_paths:
+            f.write(os.path.relpath(os.path.abspath(path), base) + '\n')
+    return manifest_path
+
+def default_partial_dir(manifest_path):
+    return manifest_path + '.partials'
+
+def partial_path(partial_dir, shard, phase):
+    """Return where a shard's partial result for a phase is stored."""
+    name = os.path.splitext(os.path.basename(shard))[0]
+    # Shards with the same file name in different directories get different partials
+    shard_id = hashlib.blake2b(os.path.abspath(shard).encode(), digest_size=4).hexdigest()
+    return os.path.join(partial_dir, f'{name}-{shard_id}.{phase}.pkl')
+
+def load_partial(path):
+    """Return a stored partial result, or None if it is missing or unreadable."""
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+def _save_partial(path, partial):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(partial, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def _usable(partial, shard, key):
+    return (partial is not None and partial['version'] == PARTIAL_VERSION
+            and partial['key'] == key and is_fresh(partial['source'], shard))
+
+def scores_key(bounds, top_n, sketch_error, weights):
+    """Key of everything a scoring partial depends on besides its shard."""
+    return fingerprint({'bounds': {col: tuple(map(float, b)) for col, b in bounds.items()},
+                        'top_n': top_n, 'sketch_error': sketch_error, 'weights': weights})
+
+def map_bounds(shard):
+    """Phase 1: feature bounds and row count of one shard."""
+    df = fea.read_typed_csv(shard, list(fea.ENGAGEMENT_WEIGHTS))
+    return {'rows': len(df), 'bounds': fea.compute_feature_bounds(df)}
+
+def map_scores(shard, bounds, top_n=1000, sketch_error=0.001, weights=None):
+    """Phase 2: score one shard with the global bounds and reduce it to mergeable parts."""
+    df = fea.read_typed_csv(shard)
+    fea.apply_engagement_score(df, bounds, weights=weights)
+    fea.add_platform_columns(fea.add_age_group(df))
+    return {'rows': len(df),
+            'cube': fea.segment_cube(df, sketch_error),
+            'top': TopKBuffer(top_n, fea.VALUABLE_USER_COLUMNS).update(df),
+            'summary': SummaryStats.from_frame(df, sketch_error)}
+
+def _map_shard(phase, shard, path, key, args):
+    """Worker entry point: map one shard and store its partial result."""
+    source = source_record(shard)
+    partial = map_bounds(shard) if phase == 'bounds' else map_scores(shard, *args)
+    partial.update({'version': PARTIAL_VERSION, 'key': key, 'source': source, 'shard': shard})
+    _save_partial(path, partial)
+
+def _run_phase(phase, shards, partial_dir, key, args, max_workers):
+    """Map the shards whose partial for a phase is missing or stale; returns those shards."""
+    stale = [(shard, partial_path(partial_dir, shard, phase)) for shard in shards]
+    stale = [(shard, path) for shard, path in stale
+             if not _usable(load_partial(path), shard, key)]
+    if len(stale) > 1 and (max_workers or os.cpu_count() or 1) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_map_shard, phase, shard, path, key, args)
+                       for shard, path in stale]
+            for future in futures:
+                future.result()
+    else:
+        for shard, path in stale:
+            _map_shard(phase, shard, path, key, args)
+    return [shard for shard, _ in stale]
+
+def global_bounds(shards, partial_dir):
+    """Merge the stored bounds of every shard; raises if any shard is not mapped yet."""
+    missing, bounds = [], None
+    for shard in shards:
+        partial = load_partial(partial_path(partial_dir, shard, 'bounds'))
+        if not _usable(partial, shard, None):
+            missing.append(shard)
+            continue
+        bounds = fea.merge_feature_bounds(bounds, partial['bounds'])
+    if missing:
+        raise FileNotFoundError(f"{len(missing)} shard(s) have no current bounds partial, "
+                                f"e.g. '{missing[0]}'; run the bounds phase for them first")
+    return bounds
+
+@traced
+def map_shards(manifest_path, partial_dir=None, phases=PHASES, top_n=1000, sketch_error=0.001,
+               weights=None, shard_index=0, shard_count=1, max_workers=None):
+    """
+    Map this machine's share of the shards (every shard_count-th one,
+    starting at shard_index) for the given phases. The scores phase needs
+    the bounds of every shard, mapped here or elsewhere into partial_dir.
+    Returns {phase: shards that were (re)mapped}.
+    """
+    shards = read_manifest(manifest_path)
+    partial_dir = partial_dir or default_partial_dir(manifest_path)
+    os.makedirs(partial_dir, exist_ok=True)
+    mine = shards[shard_index::shard_count]
+    remapped = {}
+    if 'bounds' in phases:
+        remapped['bounds'] = _run_phase('bounds', mine, partial_dir, None, (), max_workers)
+    if 'scores' in phases:
+        bounds = global_bounds(shards, partial_dir)
+        key = scores_key(bounds, top_n, sketch_error, weights)
+        remapped['scores'] = _run_phase('scores', mine, partial_dir, key,
+                                        (bounds, top_n, sketch_error, weights), max_workers)
+    return remapped
+
+@traced
+def reduce_partials(manifest_path, partial_dir=None, top_n=1000, sketch_error=0.001,
+                    weights=None):
+    """
+    Merge the scoring partials of every shard. Returns (cube, top-K buffer,
+    summary stats, rows); raises if a shard's partial is missing or stale.
+    """
+    shards = read_manifest(manifest_path)
+    partial_dir = partial_dir or default_partial_dir(manifest_path)
+    key = scores_key(global_bounds(shards, partial_dir), top_n, sketch_error, weights)
+    cube = top = summary = None
+    rows, missing = 0, []
+    for shard in shards:
+        partial = load_partial(partial_path(partial_dir, shard, 'scores'))
+        if not _usable(partial, shard, key):
+            missing.append(shard)
+            continue
+        rows += partial['rows']
+        cube = partial['cube'] if cube is None else cube.merge(partial['cube'])
+        top = partial['top'] if top is None else top.merge(partial['top'])
+        summary = partial['summary'] if summary is None else summary.merge(partial['summary'])
+    if missing:
+        raise FileNotFoundError(f"{len(missing)} shard(s) have no current scores partial, "
+                                f"e.g. '{missing[0]}'; run the scores phase for them first")
+    return cube, top, summary, rows
+
+def run_sharded(manifest_path, partial_dir=None, output_dir=fea.BASE_DIR, top_n=1000,
+                sketch_error=0.001, weights=None, max_workers=None):
+    """
+    Map every stale shard, then reduce (see report_sharded). sketch_error
+    sets the accuracy of the merged score quartiles and segment medians.
+    """
+    print("\n" + "="*80)
+    print("SHARDED ANALYSIS")
+    print("="*80)
+
+    remapped = map_shards(manifest_path, partial_dir, PHASES, top_n, sketch_error, weights,
+                          max_workers=max_workers)
+    print(f"\nShards: {len(read_manifest(manifest_path)):,} ({len(remapped['bounds'])} bounds and "
+          f"{len(remapped['scores'])} scores recomputed, the rest reused)")
+    return report_sharded(manifest_path, partial_dir, output_dir, top_n, sketch_error, weights)
+
+def report_sharded(manifest_path, partial_dir=None, output_dir=fea.BASE_DIR, top_n=1000,
+                   sketch_error=0.001, weights=None):
+    """
+    Reduce the partials of every shard and write the valuable users report,
+    recommendations and valuable_users_list.csv. Returns the valuable users.
+    """
+    cube, top, summary, rows = reduce_partials(manifest_path, partial_dir, top_n, sketch_error,
+                                               weights)
+    print(f"\nUsers: {rows:,}")
+
+    print("\nEngagement Score Statistics:")
+    print(summary.describe()['engagement_score'])
+    print("\nUser Category Distribution:")
+    print(cube.size('user_category'))
+
+    valuable_users = top.result(top_n)
+    fea.report_valuable_users(valuable_users, top_n)
+    fea.generate_recommendations(None, valuable_users, cube)
+    fea.save_valuable_users(valuable_users, os.path.join(output_dir, 'valuable_users_list.csv'))
+    return valuable_users
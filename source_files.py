@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Source File Records
+===================
+Whatever is derived from a source file (the parsed-CSV cache, a column
+store, a shard's partial results) records the file's size, mtime and
+content hash, and is reused only while the file still matches:
+
+    size differs        changed
+    same mtime          unchanged, without reading the file
+    otherwise           unchanged only if the content hash matches
+
+Size and mtime are checked first so an unchanged file never has to be
+hashed; the hash catches copies, which have new mtimes but the same bytes.
+"""
+
+import hashlib
+import os
+
+def file_hash(filepath, block_size=1 << 20):
+    """Return a content hash of filepath."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_record(filepath):
+    """Return the size, mtime_ns and hash of filepath as it is now."""
+    stat = os.stat(filepath)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': file_hash(filepath)}
+
+def is_fresh(record, filepath):
+    """Return True if filepath still has the content record was taken from."""
+    stat = os.stat(filepath)
+    if record['size'] != stat.st_size:
+        return False
+    return record['mtime_ns'] == stat.st_mtime_ns or record['hash'] == file_hash(filepath)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Stage Result Cache
+==================
+Content-addressed memoization for the analysis stages. Each stage result
+is keyed on a hash of its inputs (the data, or the keys of the stages it
+reads from) plus its own parameters, so changing top_n or the age bins only
+recomputes the stages downstream of that parameter. Keys also cover the
+source of the modules the stages run, so editing the analysis code never
+replays results it would no longer produce. Results, including the
+report a stage printed, are stored as pickles on local disk and the least
+recently used entries are evicted once the cache exceeds its size limit.
+"""
+
+import contextlib
+import hashlib
+import io
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import facebook_eda_analysis as fea
+from source_files import file_hash
+
+DEFAULT_MAX_BYTES = 1 << 30
+
+# Bump when the cache entry format changes; code changes are caught by code_fingerprint
+CACHE_VERSION = 2
+
+# Modules whose code decides what the stages compute
+STAGE_MODULES = ['facebook_eda_analysis', 'stage_cache', 'score_ranking', 'segment_cube',
+                 'quantile_sketch', 'summary_stats', 'density_plots']
+
+_code_key = None
+
+def fingerprint(value, digest=None):
+    """Return a stable content hash of nested dicts, lists, arrays, frames and grids."""
+    top = digest is None
+    digest = digest or hashlib.blake2b(digest_size=16)
+    if isinstance(value, dict):
+        for key in sorted(value):
+            digest.update(repr(key).encode())
+            fingerprint(value[key], digest)
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'[')
+        for item in value:
+            fingerprint(item, digest)
+        digest.update(b']')
+    elif isinstance(value, pd.DataFrame):
+        digest.update(b'frame')
+        for col in value.columns:
+            digest.update(repr(col).encode())
+            fingerprint(value[col], digest)
+    elif isinstance(value, pd.Series):
+        if isinstance(value.dtype, pd.CategoricalDtype):
+            fingerprint([value.cat.codes.to_numpy(), list(value.cat.categories)], digest)
+        else:
+            fingerprint(value.to_numpy(), digest)
+    elif isinstance(value, np.ndarray):
+        digest.update(f'{value.dtype.str}{value.shape}'.encode())
+        if value.dtype == object:
+            value = pd.util.hash_array(value.ravel())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif hasattr(value, '__dict__'):
+        digest.update(type(value).__name__.encode())
+        fingerprint(vars(value), digest)
+    else:
+        digest.update(repr(value).encode())
+    return digest.hexdigest() if top else None
+
+def code_fingerprint():
+    """Hash of the source files of STAGE_MODULES, computed once per process."""
+    global _code_key
+    if _code_key is None:
+        digest = hashlib.blake2b(digest_size=16)
+        for name in STAGE_MODULES:
+            __import__(name)
+            with open(sys.modules[name].__file__, 'rb') as f:
+                digest.update(name.encode())
+                digest.update(f.read())
+        _code_key = digest.hexdigest()
+    return _code_key
+
+class _Tee(io.StringIO):
+    """Capture everything written while still passing it through."""
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def write(self, text):
+        self.stream.write(text)
+        return super().write(text)
+
+def _touch(path):
+    # Explicit nanosecond times keep LRU order finer than the filesystem clock
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+
+def _output_hashes(paths):
+    return {path: file_hash(path) if os.path.exists(path) else None for path in paths}
+
+class StageCache:
+    """Size-bounded, LRU-evicted store of stage results on local disk."""
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = []
+        self.misses = []
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, stage, inputs, params):
+        """Return the key of a stage run on the given input keys and parameters."""
+        return fingerprint({'version': CACHE_VERSION, 'code': code_fingerprint(), 'stage': stage,
+                            'inputs': list(inputs), 'params': params})
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    def get(self, key):
+        """Return the cached entry for key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        _touch(path)  # mark as recently used
+        return entry
+
+    def put(self, key, entry):
+        """Store an entry and evict old ones if the cache is over its limit."""
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        _touch(path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+    def run(self, stage, inputs, params, func, outputs=()):
+        """
+        Return (result, key) for a stage, computing it only on a cache miss.
+        The stage's printed report is replayed on a hit. A stage that writes
+        files counts as a miss unless its outputs are still the files it wrote.
+        """
+        key = self.key(stage, inputs, params)
+        entry = self.get(key)
+        if entry is not None and entry['outputs'] == _output_hashes(outputs):
+            self.hits.append(stage)
+            sys.stdout.write(entry['output'])
+            return entry['value'], key
+
+        self.misses.append(stage)
+        tee = _Tee(sys.stdout)
+        with contextlib.redirect_stdout(tee):
+            value = func()
+        self.put(key, {'value': value, 'output': tee.getvalue(),
+                       'outputs': _output_hashes(outputs)})
+        return value, key
+
+def _added_columns(func, df):
+    """Run a stage that adds columns to df and return just those columns."""
+    before = set(df.columns)
+    func(df)
+    return df[[col for col in df.columns if col not in before]]
+
+def _assign(df, columns):
+    for col in columns.columns:
+        df[col] = columns[col].values
+    return df
+
+def run_cached_analysis(data_path=None, output_dir=None, cache_dir=None, top_n=1000,
+                        weights=None, age_bins=None, age_labels=None, sketch_error=None,
+                        max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Run the full analysis like main(), reusing cached stage results.
+    Returns the StageCache so callers can inspect which stages hit.
+    """
+    data_path = data_path or fea.DATA_PATH
+    output_dir = output_dir or fea.BASE_DIR
+    cache = StageCache(cache_dir or os.path.join(output_dir, '.stage_cache'), max_bytes)
+
+    df = fea.load_data(data_path)
+    data_key = fingerprint(df)
+
+    cache.run('explore', [data_key], {'sketch_error': sketch_error},
+              lambda: fea.explore_data(df, sketch_error).shape)
+
+    scored, score_key = cache.run(
+        'score', [data_key], {'weights': weights, 'sketch_error': sketch_error},
+        lambda: _added_columns(lambda d: fea.create_engagement_score(
+            d, sketch_error=sketch_error, weights=weights), df))
+    _assign(df, scored)
+
+    age_group, demographics_key = cache.run(
+        'demographics', [score_key],
+        {'age_bins': age_bins, 'age_labels': age_labels, 'sketch_error': sketch_error},
+        lambda: _added_columns(lambda d: fea.analyze_demographics(
+            d, sketch_error, age_bins=age_bins, age_labels=age_labels), df))
+    _assign(df, age_group)
+
+    platform, platform_key = cache.run(
+        'platform', [score_key], {'sketch_error': sketch_error},
+        lambda: _added_columns(lambda d: fea.analyze_platform_usage(d, sketch_error), df))
+    _assign(df, platform)
+
+    positions, valuable_key = cache.run(
+        'valuable_users', [score_key], {'top_n': top_n, 'sketch_error': sketch_error},
+        lambda: df.index.get_indexer(
+            fea.identify_valuable_users(df, top_n, sketch_error).index))
+    valuable_users = df.iloc[positions]
+
+    cache.run('recommendations', [score_key, platform_key, valuable_key], {},
+              lambda: fea.generate_recommendations(df, valuable_users))
+
+    figures = [os.path.join(output_dir, name) for name in
+               ('facebook_eda_visualizations.png', 'facebook_eda_detailed_analysis.png')]
+    cache.run('visualizations', [score_key, demographics_key, platform_key, valuable_key],
+              {'sketch_error': sketch_error},
+              lambda: fea.create_visualizations(df, valuable_users, sketch_error,
+                                                output_dir=output_dir),
+              outputs=figures)
+
+    fea.save_valuable_users(valuable_users, os.path.join(output_dir, 'valuable_users_list.csv'))
+
+    print(f"\nStage cache: {len(cache.hits)} reused, {len(cache.misses)} recomputed"
+          f" ({', '.join(cache.misses) or 'none'})")
+    return cache
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Lazy Stage Graph
+================
+The analysis as a dependency graph instead of a fixed sequence. Every
+stage declares the frame columns it reads, the columns it adds and the
+results (segment cube, valuable users) it uses or returns:
+
+    load ── explore
+        └── score ─┬─ age_group ─────────┐
+                   ├─ platform_columns ──┴─ cube ─┬─ demographics
+                   │                              ├─ platform
+                   └─ valuable_users ─────────────┴─ recommendations
+                         ├─ visualizations (both dashboards)
+                         └─ valuable_users_list.csv
+
+Asking for targets (stage names, result files such as
+'valuable_users_list.csv' or one dashboard, or columns such as
+'engagement_score') runs only the stages they depend on, and the CSV is
+loaded with only the columns those stages read.
+
+With max_workers > 1, stages whose inputs are ready run concurrently on a
+thread pool. Each gets its own copy of the columns it declared, new columns
+are added to the shared frame by the scheduler thread, and every stage's
+report is printed in the order of a serial run.
+"""
+
+import io
+import os
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import facebook_eda_analysis as fea
+from density_plots import density_columns
+
+class Stage:
+    """One step of the analysis and the data it reads and produces."""
+
+    def __init__(self, name, func, columns=(), needs=(), adds=(), returns=None, files=()):
+        self.name = name
+        self.func = func
+        self.columns = list(dict.fromkeys(columns))
+        self.needs = list(needs)
+        self.adds = list(adds)
+        self.returns = returns
+        self.files = list(files)
+
+    def __repr__(self):
+        return f'Stage({self.name!r})'
+
+RAW_COLUMNS = list(fea.COLUMN_DTYPES)
+
+SCORE_COLUMNS = ['engagement_score', 'user_category', 'engagement_rank', 'dense_rank',
+                 'percentile_rank', 'engagement_quantile']
+
+CUBE_COLUMNS = ['age_group', 'gender', 'tenure', 'user_category', 'primary_platform',
+                *fea.CUBE_MEASURES]
+
+# Stage functions take (frame, results, options) and return their result, if any
+def _explore(frame, results, options):
+    fea.explore_data(frame, options['sketch_error'])
+
+def _score(frame, results, options):
+    fea.create_engagement_score(frame, sketch_error=options['sketch_error'])
+
+def _age_group(frame, results, options):
+    fea.add_age_group(frame)
+
+def _platform_columns(frame, results, options):
+    fea.add_platform_columns(frame)
+
+def _cube(frame, results, options):
+    return fea.segment_cube(frame, options['sketch_error'])
+
+def _demographics(frame, results, options):
+    fea.analyze_demographics(frame, options['sketch_error'], cube=results['cube'])
+
+def _platform(frame, results, options):
+    fea.analyze_platform_usage(frame, options['sketch_error'], cube=results['cube'])
+
+def _valuable_users(frame, results, options):
+    return fea.identify_valuable_users(frame, options['top_n'], options['sketch_error'])
+
+def _recommendations(frame, results, options):
+    fea.generate_recommendations(None, results['valuable_users'], cube=results['cube'])
+
+def _visualizations(frame, results, options):
+    fea.create_visualizations(frame, results['valuable_users'], options['sketch_error'],
+                              options['density'], output_dir=options['output_dir'],
+                              cube=results['cube'], figures=options['figures'])
+
+def _save_valuable_users(frame, results, options):
+    fea.save_valuable_users(results['valuable_users'],
+                            os.path.join(options['output_dir'], 'valuable_users_list.csv'))
+
+# In the order a serial run executes and prints them
+STAGES = [
+    Stage('explore', _explore, columns=RAW_COLUMNS),
+    Stage('score', _score, columns=fea.STAGE_COLUMNS['score'], adds=SCORE_COLUMNS),
+    Stage('age_group', _age_group, columns=['age'], adds=['age_group']),
+    Stage('platform_columns', _platform_columns, columns=fea.STAGE_COLUMNS['platform'],
+          adds=['mobile_preference', 'www_preference', 'primary_platform']),
+    Stage('cube', _cube, columns=CUBE_COLUMNS, returns='cube'),
+    Stage('demographics', _demographics, columns=['age', 'age_group'], needs=['cube']),
+    Stage('platform', _platform, columns=['primary_platform'], needs=['cube']),
+    Stage('valuable_users', _valuable_users,
+          columns=fea.VALUABLE_USER_COLUMNS + ['engagement_rank'], returns='valuable_users'),
+    Stage('recommendations', _recommendations, needs=['cube', 'valuable_users']),
+    Stage('visualizations', _visualizations,
+          columns=['userid'] + density_columns() + fea.CORRELATION_COLUMNS + ['engagement_rank'],
+          needs=['cube', 'valuable_users'], files=fea.DASHBOARD_FILES),
+    Stage('save_valuable_users', _save_valuable_users, needs=['valuable_users'],
+          files=['valuable_users_list.csv']),
+]
+
+def _providers(stages):
+    """Map every target name (stage, column, result or file) to the stage producing it."""
+    providers = {}
+    for stage in stages:
+        for name in [stage.name, *stage.adds, stage.returns, *stage.files]:
+            if name is not None:
+                providers[name] = stage
+    return providers
+
+def targets(stages=STAGES):
+    """Names that can be asked for."""
+    return list(_providers(stages))
+
+def plan(wanted, stages=STAGES):
+    """
+    Return the stages needed for the wanted targets, in serial order, and
+    the raw CSV columns they read. Raises ValueError for an unknown target.
+    """
+    providers = _providers(stages)
+    unknown = [name for name in wanted if name not in providers and name not in RAW_COLUMNS]
+    if unknown:
+        raise ValueError(f"unknown target(s) {unknown}; choose from {targets(stages)}")
+    needed, todo = set(), [providers[name] for name in wanted if name in providers]
+    while todo:
+        stage = todo.pop()
+        if stage.name in needed:
+            continue
+        needed.add(stage.name)
+        todo.extend(providers[name] for name in stage.columns + stage.needs if name in providers)
+    selected = [stage for stage in stages if stage.name in needed]
+    raw = {col for stage in selected for col in stage.columns if col in RAW_COLUMNS}
+    raw.update(name for name in wanted if name in RAW_COLUMNS)
+    return selected, [col for col in RAW_COLUMNS if col in raw]
+
+class _ThreadOutput(io.TextIOBase):
+    """sys.stdout stand-in that captures what each stage thread prints."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def capture(self, func, *args):
+        self.local.buffer = io.StringIO()
+        try:
+            return func(*args), self.local.buffer.getvalue()
+        finally:
+            self.local.buffer = None
+
+def _finish(stage, frame, value, df, results):
+    """Apply a finished stage's output to the shared frame and results."""
+    for col in stage.adds:
+        df[col] = frame[col].values
+    if stage.returns is not None:
+        results[stage.returns] = value
+
+def run_stages(wanted, data_path=fea.DATA_PATH, output_dir=fea.BASE_DIR, top_n=1000,
+               sketch_error=None, density=False, max_workers=1, stages=STAGES):
+    """
+    Run the stages the wanted targets need and return (frame, results),
+    where results holds the cube and valuable users if they were computed.
+    """
+    selected, columns = plan(wanted, stages)
+    df = fea.load_data(data_path, None if columns == RAW_COLUMNS else columns)
+    files = [name for name in wanted if name in fea.DASHBOARD_FILES]
+    options = {'top_n': top_n, 'sketch_error': sketch_error, 'density': density,
+               'output_dir': output_dir,
+               'figures': files if files and 'visualizations' not in wanted else None}
+    results = {}
+
+    if max_workers <= 1:
+        # Stages work on the shared frame directly, as main() always did
+        for stage in selected:
+            value = stage.func(df, results, options)
+            if stage.returns is not None:
+                results[stage.returns] = value
+        return df, results
+
+    output = _ThreadOutput(sys.stdout)
+    available = set(df.columns)
+    pending, running, reports, printed = list(selected), {}, {}, 0
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stage') as executor:
+        previous, sys.stdout = sys.stdout, output
+        try:
+            while pending or running:
+                for stage in [s for s in pending
+                              if set(s.columns) <= available and set(s.needs) <= set(results)]:
+                    pending.remove(stage)
+                    # A private copy, so no stage sees another one's columns change
+                    frame = df[stage.columns].copy() if stage.columns else None
+                    future = executor.submit(output.capture, stage.func, frame, results, options)
+                    running[future] = (stage, frame)
+                if not running:
+                    raise ValueError(f"stages {pending} need columns or results no stage provides")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, frame = running.pop(future)
+                    value, reports[stage.name] = future.result()
+                    _finish(stage, frame, value, df, results)
+                    available.update(stage.adds)
+                # Print reports in serial order as soon as all earlier ones are out
+                while printed < len(selected) and selected[printed].name in reports:
+                    output.stream.write(reports.pop(selected[printed].name))
+                    printed += 1
+        finally:
+            sys.stdout = previous
+    return df, results
+
+def run_targets(wanted, data_path=fea.DATA_PATH, output_dir=fea.BASE_DIR, top_n=1000,
+                sketch_error=None, density=False, max_workers=1):
+    """Run only what the wanted targets need and report which stages ran."""
+    selected, columns = plan(wanted)
+    print("="*80)
+    print(f"FACEBOOK USER ENGAGEMENT ANALYSIS: {', '.join(wanted)}")
+    print("="*80)
+    df, results = run_stages(wanted, data_path, output_dir, top_n, sketch_error, density,
+                             max_workers)
+    skipped = [stage.name for stage in STAGES if stage not in selected]
+    print(f"\nRan {len(selected)} of {len(STAGES)} stages on {len(columns)} of "
+          f"{len(RAW_COLUMNS)} columns (skipped: {', '.join(skipped) or 'none'})")
+    return df, results
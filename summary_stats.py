@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Mergeable Summary Statistics
+============================
+One-pass summaries for exploration and the correlation heatmap on data that
+is streamed in chunks or split across processes. A single vectorised pass
+over each chunk collects:
+
+- row count, and per column the non-null and null counts
+- min/max, mean and variance (shifted sums per chunk, merged with Chan et
+  al.'s parallel update so long streams do not lose precision)
+- pairwise co-moments of the numeric columns for the correlation matrix
+- value counts of categorical and text columns
+
+Partial summaries merge exactly like QuantileSketch, so per-chunk or
+per-process results can be combined in any order. Pairwise statistics use
+the rows where both columns are present, as DataFrame.corr() does.
+"""
+
+import numpy as np
+import pandas as pd
+
+from quantile_sketch import QuantileSketch
+
+def _divide(numerator, denominator):
+    """Elementwise division that gives NaN where the denominator is 0."""
+    return np.divide(numerator, denominator, out=np.full(np.shape(numerator), np.nan),
+                     where=denominator > 0)
+
+class SummaryStats:
+    """Mergeable count/null/min/max/mean/variance/co-moment/value-count summary."""
+
+    def __init__(self, sketch_error=None):
+        self.sketch_error = sketch_error
+        self.rows = 0
+        self.dtypes = {}
+        self.numeric = []
+        self.categorical = []
+        self.nulls = None
+        self.min = self.max = None
+        # Pairwise state: entry [i, j] is taken over rows where columns i and
+        # j are both present; mean[i, j] and m2[i, j] describe column i there
+        self.n = self.mean = self.m2 = self.comoment = None
+        self.counts = {}
+        self.sketches = {}
+
+    @classmethod
+    def from_frame(cls, df, sketch_error=None):
+        """Summarise a DataFrame in one call."""
+        return cls(sketch_error).update(df)
+
+    def _init_columns(self, df):
+        self.dtypes = {col: df[col].dtype for col in df.columns}
+        self.numeric = list(df.select_dtypes('number').columns)
+        self.categorical = [col for col in df.columns
+                            if isinstance(df[col].dtype, pd.CategoricalDtype)
+                            or df[col].dtype == object]
+        p = len(self.numeric)
+        self.nulls = pd.Series(0, index=df.columns, dtype=np.int64)
+        self.min = np.full(p, np.nan)
+        self.max = np.full(p, np.nan)
+        self.n = np.zeros((p, p))
+        self.mean = np.zeros((p, p))
+        self.m2 = np.zeros((p, p))
+        self.comoment = np.zeros((p, p))
+        if self.sketch_error is not None:
+            self.sketches = {col: QuantileSketch(self.sketch_error) for col in self.numeric}
+
+    def update(self, chunk):
+        """Add a chunk of rows; every chunk must have the same columns."""
+        if self.nulls is None:
+            self._init_columns(chunk)
+        self.rows += len(chunk)
+
+        values = np.empty((len(chunk), len(self.numeric)))
+        for j, col in enumerate(self.numeric):
+            values[:, j] = chunk[col].to_numpy(np.float64, na_value=np.nan)
+        present = ~np.isnan(values)
+        self.nulls[self.numeric] += len(chunk) - present.sum(axis=0)
+        other = [col for col in self.nulls.index if col not in self.numeric]
+        self.nulls[other] += chunk[other].isna().sum().to_numpy(np.int64)
+        if len(values):
+            seen = present.any(axis=0)
+            self.min = np.fmin(self.min, np.where(seen, np.where(present, values, np.inf).min(axis=0),
+                                                  np.nan))
+            self.max = np.fmax(self.max, np.where(seen, np.where(present, values, -np.inf).max(axis=0),
+                                                  np.nan))
+
+        # Shift by the chunk's column means so the sums below stay small, then
+        # get every pairwise count, sum, square and cross product from matmuls
+        weight = present.astype(np.float64)
+        shift = np.nan_to_num(_divide(np.where(present, values, 0).sum(axis=0), weight.sum(axis=0)))
+        shifted = np.where(present, values - shift, 0.0)
+        n = weight.T @ weight
+        sums = shifted.T @ weight
+        mean = _divide(sums, n)
+        m2 = (shifted ** 2).T @ weight - np.nan_to_num(sums * mean)
+        comoment = shifted.T @ shifted - np.nan_to_num(sums * mean.T)
+        self._merge_moments(n, np.nan_to_num(mean) + shift[:, None], m2, comoment)
+
+        for col in self.categorical:
+            self._add_counts(col, chunk[col].value_counts(sort=False))
+        for col, sketch in self.sketches.items():
+            sketch.update(chunk[col].to_numpy(np.float64, na_value=np.nan))
+        return self
+
+    def _merge_moments(self, n, mean, m2, comoment):
+        # Chan et al. parallel update, entrywise for every column pair
+        total = self.n + n
+        delta = mean - self.mean
+        factor = _divide(self.n * n, total)
+        factor[total == 0] = 0
+        self.mean = self.mean + np.nan_to_num(_divide(delta * n, total))
+        self.m2 = self.m2 + m2 + delta ** 2 * factor
+        self.comoment = self.comoment + comoment + delta * delta.T * factor
+        self.n = total
+
+    def _add_counts(self, col, counts):
+        counts = counts.astype(np.int64)
+        if col in self.counts:
+            counts = self.counts[col].add(counts, fill_value=0).astype(np.int64)
+        self.counts[col] = counts
+
+    def merge(self, other):
+        """Merge another summary of the same columns into this one."""
+        if other.nulls is None:
+            return self
+        if self.nulls is None:
+            self.sketch_error = other.sketch_error
+            self.dtypes, self.numeric, self.categorical = (dict(other.dtypes), list(other.numeric),
+                                                           list(other.categorical))
+            self.nulls = other.nulls.copy()
+            self.min, self.max = other.min.copy(), other.max.copy()
+            self.n, self.mean = other.n.copy(), other.mean.copy()
+            self.m2, self.comoment = other.m2.copy(), other.comoment.copy()
+            self.rows = other.rows
+            self.counts = {col: counts.copy() for col, counts in other.counts.items()}
+            self.sketches = {col: QuantileSketch(sketch.error).merge(sketch)
+                             for col, sketch in other.sketches.items()}
+            return self
+        self.rows += other.rows
+        self.nulls = self.nulls + other.nulls
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        self._merge_moments(other.n, other.mean, other.m2, other.comoment)
+        for col, counts in other.counts.items():
+            self._add_counts(col, counts)
+        for col, sketch in other.sketches.items():
+            self.sketches[col].merge(sketch)
+        return self
+
+    def count(self):
+        """Non-null values per column."""
+        return pd.Series(self.rows, index=self.nulls.index) - self.nulls
+
+    def means(self):
+        """Per-column mean."""
+        return pd.Series(np.where(np.diag(self.n) > 0, np.diag(self.mean), np.nan),
+                         index=self.numeric)
+
+    def var(self, ddof=1):
+        """Per-column variance (sample variance by default, like pandas)."""
+        return pd.Series(_divide(np.diag(self.m2), np.diag(self.n) - ddof), index=self.numeric)
+
+    def std(self, ddof=1):
+        return np.sqrt(self.var(ddof))
+
+    def correlation(self, columns=None):
+        """Pearson correlation matrix, matching DataFrame.corr()."""
+        corr = _divide(self.comoment, np.sqrt(self.m2 * self.m2.T))
+        corr = np.clip(corr, -1, 1)
+        np.fill_diagonal(corr, np.where(np.diag(self.m2) > 0, 1.0, np.nan))
+        corr[self.n < 2] = np.nan
+        result = pd.DataFrame(corr, index=self.numeric, columns=self.numeric)
+        return result if columns is None else result.loc[columns, columns]
+
+    def value_counts(self, col):
+        """Counts of each value of a categorical or text column, most common first."""
+        counts = self.counts[col].sort_values(ascending=False, kind='stable')
+        counts.index.name = col
+        return counts.rename('count')
+
+    def info(self):
+        """A df.info()-style table of non-null counts, null counts and dtypes."""
+        return pd.DataFrame({'Non-Null Count': self.count(), 'Null Count': self.nulls,
+                             'Dtype': pd.Series(self.dtypes).astype(str)})
+
+    def describe(self, quartiles=None):
+        """
+        Return a df.describe()-style table for the numeric columns. Quartiles
+        come from quantile sketches if sketch_error was set, or from the
+        quartiles frame passed in (rows 0.25/0.5/0.75, e.g. df.quantile()).
+        """
+        rows = {'count': self.count()[self.numeric].astype(np.float64),
+                'mean': self.means(), 'std': self.std(),
+                'min': pd.Series(self.min, index=self.numeric)}
+        if self.sketches:
+            sketched = {col: self.sketches[col].quantile([0.25, 0.5, 0.75]) for col in self.numeric}
+            quartiles = pd.DataFrame(sketched, index=[0.25, 0.5, 0.75])
+        if quartiles is not None:
+            for q, label in zip([0.25, 0.5, 0.75], ['25%', '50%', '75%']):
+                rows[label] = quartiles.loc[q, self.numeric]
+        rows['max'] = pd.Series(self.max, index=self.numeric)
+        return pd.DataFrame(rows).T
+
+def summarize_chunks(chunks, sketch_error=None):
+    """Summarise an iterable of DataFrame chunks."""
+    stats = SummaryStats(sketch_error)
+    for chunk in chunks:
+        stats.update(chunk)
+    return stats
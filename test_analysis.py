@@ -8,11 +8,53 @@ Simple tests to validate the analysis functions correctly.
 import pandas as pd
 import numpy as np
 import sys
+import os
+import tempfile
+import facebook_eda_analysis as fea
+import topk
+from quantile_sketch import QuantileSketch
+import density_plots
+
+def _make_sample_df(n_users=2000, seed=0):
+    """Build a small synthetic frame with the pseudo_facebook.csv schema."""
+    rng = np.random.default_rng(seed)
+    age = rng.integers(13, 100, n_users)
+    mobile_likes = rng.negative_binomial(0.3, 0.01, n_users)
+    www_likes = rng.negative_binomial(0.2, 0.02, n_users)
+    mobile_received = rng.negative_binomial(0.3, 0.01, n_users)
+    www_received = rng.negative_binomial(0.2, 0.02, n_users)
+    friend_count = rng.negative_binomial(0.8, 0.005, n_users)
+    df = pd.DataFrame({
+        'userid': rng.permutation(np.arange(1000000, 1000000 + n_users)),
+        'age': age,
+        'dob_day': rng.integers(1, 32, n_users),
+        'dob_year': 2013 - age,
+        'dob_month': rng.integers(1, 13, n_users),
+        'gender': rng.choice(['male', 'female'], n_users).astype(object),
+        'tenure': rng.integers(0, 3000, n_users).astype(float),
+        'friend_count': friend_count,
+        'friendships_initiated': (friend_count * rng.random(n_users)).astype(int),
+        'likes': mobile_likes + www_likes,
+        'likes_received': mobile_received + www_received,
+        'mobile_likes': mobile_likes,
+        'mobile_likes_received': mobile_received,
+        'www_likes': www_likes,
+        'www_likes_received': www_received,
+    })
+    df.loc[:4, 'gender'] = np.nan
+    df.loc[5, 'tenure'] = np.nan
+    return df
+
+def _write_sample_csv(directory, n_users=2000, seed=0):
+    """Write a synthetic dataset to directory and return its path."""
+    filepath = os.path.join(directory, 'pseudo_facebook.csv')
+    _make_sample_df(n_users, seed).to_csv(filepath, index=False)
+    return filepath
 
 def test_data_loading():
     """Test that the dataset loads correctly."""
     try:
-        df = pd.read_csv('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
+        df = fea.load_data('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
         assert len(df) > 0, "Dataset is empty"
         assert 'userid' in df.columns, "Missing userid column"
         assert 'friend_count' in df.columns, "Missing friend_count column"
@@ -26,7 +68,7 @@ def test_data_loading():
 def test_engagement_score_calculation():
     """Test that engagement scores are calculated correctly."""
     try:
-        df = pd.read_csv('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
+        df = fea.load_data('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
         
         # Normalize features
         df['friend_count_norm'] = (df['friend_count'] - df['friend_count'].min()) / \
@@ -49,7 +91,7 @@ def test_engagement_score_calculation():
 def test_user_segmentation():
     """Test that users can be segmented correctly."""
     try:
-        df = pd.read_csv('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
+        df = fea.load_data('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
         
         # Simple segmentation by friend count
         df['segment'] = pd.cut(df['friend_count'], 
@@ -69,7 +111,7 @@ def test_user_segmentation():
 def test_platform_analysis():
     """Test that platform usage can be analyzed."""
     try:
-        df = pd.read_csv('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
+        df = fea.load_data('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
         
         # Calculate platform preferences
         mobile_users = len(df[df['mobile_likes'] > df['www_likes']])
@@ -89,7 +131,7 @@ def test_platform_analysis():
 def test_demographics_analysis():
     """Test that demographics can be analyzed."""
     try:
-        df = pd.read_csv('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
+        df = fea.load_data('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
         
         # Analyze demographics
         age_stats = df['age'].describe()
@@ -109,7 +151,7 @@ def test_demographics_analysis():
 def test_top_users_identification():
     """Test that top users can be identified."""
     try:
-        df = pd.read_csv('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
+        df = fea.load_data('/home/runner/work/Facebook-eda/Facebook-eda/pseudo_facebook.csv')
         
         # Identify top users by friend count
         top_users = df.nlargest(100, 'friend_count')
@@ -170,6 +212,990 @@ def test_valuable_users_csv():
         print(f"✗ Test 8 FAILED: Valuable users CSV structure - {str(e)}")
         return False
 
+def test_chunked_engagement_score():
+    """Test that chunked scoring matches in-memory scoring exactly."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = _write_sample_csv(tmpdir)
+        output_path = os.path.join(tmpdir, 'scored.csv')
+        
+        expected = fea.create_engagement_score(pd.read_csv(csv_path))
+        fea.score_csv_chunked(csv_path, output_path, chunksize=300)
+        scored = pd.read_csv(output_path, float_precision='round_trip')
+    
+    assert len(scored) == len(expected), "Row count mismatch"
+    assert np.array_equal(scored['engagement_score'].values,
+                          expected['engagement_score'].values,
+                          equal_nan=True), "Chunked scores differ"
+    assert (scored['user_category'].fillna('') ==
+            expected['user_category'].astype(object).fillna('')).all(), \
+           "Chunked categories differ"
+    
+    print("✓ Test 9 PASSED: Chunked engagement score")
+
+def test_typed_cached_loader():
+    """Test that the typed loader is compact and served from its cache."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = _write_sample_csv(tmpdir)
+        raw = pd.read_csv(csv_path)
+        
+        first = fea.load_data(csv_path)
+        assert os.path.exists(csv_path + '.cache.npz'), "Cache not written"
+        cached = fea.load_data(csv_path)
+        subset = fea.load_data(csv_path, columns=fea.stage_columns('platform'))
+        
+        # A column-subset miss parses only those columns, and the cache grows
+        os.makedirs(os.path.join(tmpdir, 'subset'))
+        subset_path = _write_sample_csv(os.path.join(tmpdir, 'subset'))
+        fea.load_data(subset_path, columns=['age', 'likes'])
+        partial = fea._cache_meta(subset_path + '.cache.npz', subset_path)
+        fea.load_data(subset_path, columns=['tenure'])
+        grown = fea._cache_meta(subset_path + '.cache.npz', subset_path)
+        full = fea.load_data(subset_path)
+        
+        # Touching the CSV costs one hash, then the new mtime is recorded
+        os.utime(csv_path, ns=(0, 10**18))
+        touched = fea.load_data(csv_path)
+        refreshed = fea._cache_meta(csv_path + '.cache.npz', csv_path)
+    
+    assert first.equals(cached), "Cached frame differs from parsed frame"
+    assert partial['columns'] == ['age', 'likes'] and not partial['complete'], \
+           f"Subset miss cached {partial['columns']}"
+    assert grown['columns'] == ['age', 'tenure', 'likes'], f"Cache lost columns: {grown['columns']}"
+    assert list(full.columns) == list(first.columns), "Partial cache served a full load"
+    assert touched.equals(first), "Touched CSV not served from cache"
+    assert refreshed['mtime_ns'] == 10**18, "New mtime not recorded in the cache"
+    assert list(subset.columns) == ['mobile_likes', 'www_likes'], "Wrong column subset"
+    assert cached['friend_count'].dtype == np.int32, "Counts not int32"
+    assert isinstance(cached['gender'].dtype, pd.CategoricalDtype), "Gender not categorical"
+    assert cached['gender'].isnull().sum() == raw['gender'].isnull().sum(), "Lost missing genders"
+    assert cached.memory_usage(deep=True).sum() * 2 <= raw.memory_usage(deep=True).sum(), \
+           "Typed frame is not at least 50% smaller"
+    
+    print("✓ Test 10 PASSED: Typed cached loader")
+
+def test_fused_scoring_kernel():
+    """Test that the fused kernel matches the column-by-column formula."""
+    df = _make_sample_df()
+    
+    expected = 0
+    for col, weight in fea.ENGAGEMENT_WEIGHTS.items():
+        norm = (df[col] - df[col].min()) / (df[col].max() - df[col].min() + 1e-10)
+        expected = expected + weight * norm
+    
+    features = fea.engagement_feature_matrix(df)
+    out = np.empty(len(df))
+    scores = fea.score_feature_matrix(features, fea.compute_feature_bounds(df),
+                                      out=out, block_size=256)
+    
+    assert scores is out, "Output buffer not used"
+    assert np.array_equal(scores, expected.values, equal_nan=True), "Kernel scores differ"
+    
+    scored = fea.create_engagement_score(df.copy())
+    assert 'friend_count_norm' not in scored.columns, "Intermediate columns added by default"
+    
+    print("✓ Test 11 PASSED: Fused scoring kernel")
+
+def test_incremental_rescoring():
+    """Test that incremental rescoring matches a full rescore."""
+    df = _make_sample_df(3000)
+    updates = df.iloc[:100].copy()
+    updates['likes'] += 50
+    updates.loc[updates.index[0], 'friend_count'] = 99999
+    delta = pd.concat([updates, df.iloc[2700:]])
+    
+    base = df.iloc[:2700].copy()
+    scored = fea.create_engagement_score(base.copy())
+    rescored, bounds = fea.rescore_incremental(scored, delta, fea.compute_feature_bounds(base))
+    
+    full = df.copy()
+    full.iloc[:100] = updates.values
+    full = fea.create_engagement_score(full)
+    merged = rescored.merge(full, on='userid', suffixes=('', '_full'))
+    
+    assert len(rescored) == len(df), "Wrong number of users after rescoring"
+    assert bounds['friend_count'][1] == 99999, "Bounds not widened"
+    assert np.allclose(merged['engagement_score'], merged['engagement_score_full'],
+                       rtol=0, atol=1e-12, equal_nan=True), "Scores differ from full rescore"
+    assert (merged['user_category'].astype(str) ==
+            merged['user_category_full'].astype(str)).all(), "Categories differ"
+    assert set(fea.identify_valuable_users(rescored, top_n=50)['userid']) == \
+           set(fea.identify_valuable_users(full, top_n=50)['userid']), "Top users differ"
+    
+    print("✓ Test 12 PASSED: Incremental rescoring")
+
+def test_streaming_top_k():
+    """Test that chunked and merged top-K match a full sort."""
+    df = fea.create_engagement_score(_make_sample_df(3000))
+    # Force ties so the userid tie-break matters
+    df.loc[df.index[:40], 'engagement_score'] = df['engagement_score'].max()
+    expected = df.sort_values(['engagement_score', 'userid'],
+                              ascending=[False, True]).head(200)['userid'].tolist()
+    
+    chunks = [df.iloc[i:i + 250] for i in range(0, len(df), 250)]
+    streamed = topk.top_k_from_chunks(chunks, [50, 200])
+    left = topk.top_k_from_chunks(chunks[::2], [50, 200])
+    right = topk.top_k_from_chunks(chunks[1::2], [50, 200])
+    merged = left.merge(right)
+    
+    assert streamed.result()['userid'].tolist() == expected, "Streamed top-K differs"
+    assert merged.result()['userid'].tolist() == expected, "Merged top-K differs"
+    assert streamed.result(50)['userid'].tolist() == expected[:50], "Smaller K differs"
+    assert fea.identify_valuable_users(df, top_n=200)['userid'].tolist() == expected, \
+           "identify_valuable_users differs"
+    
+    print("✓ Test 13 PASSED: Streaming top-K")
+
+def test_parallel_pipeline():
+    """Test that shared-memory parallel stages match the serial results."""
+    from concurrent.futures import ProcessPoolExecutor
+    import parallel_pipeline
+    
+    df = fea.create_engagement_score(_make_sample_df())
+    valuable_users = parallel_pipeline.run_parallel_analysis(
+        df, top_n=100, max_workers=2, stages=['demographics', 'platform'])
+    expected = fea.identify_valuable_users(df, top_n=100)
+    assert valuable_users['userid'].tolist() == expected['userid'].tolist(), \
+           "Parallel valuable users differ"
+    
+    with parallel_pipeline.SharedFrame(df) as shared:
+        attached, blocks = parallel_pipeline.attach_frame(shared.spec)
+        assert attached['engagement_score'].equals(df['engagement_score']), \
+               "Shared column differs"
+        del attached
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            shared_cube = parallel_pipeline.partitioned_segment_cube(executor, shared, 3)
+        with shared_cube:
+            # Stage tasks receive the aggregates only; values are mapped from shared memory
+            assert not any(len(values) for values in shared_cube.spec[0].values.values()), \
+                   "Cube values travel with the spec"
+            cube, cube_blocks = parallel_pipeline.attach_cube(shared_cube.spec)
+            serial = fea.segment_cube(df)
+            for by in ['gender', 'age_group', 'primary_platform']:
+                expected = serial.agg(by, 'engagement_score', ['count', 'mean', 'median', 'std'])
+                actual = cube.agg(by, 'engagement_score', ['count', 'mean', 'median', 'std'])
+                pd.testing.assert_frame_equal(actual, expected, check_exact=False, rtol=1e-12)
+            assert np.array_equal(cube.values['engagement_score'],
+                                  serial.values['engagement_score']), "Cube values differ"
+            assert cube.size('primary_platform').equals(serial.size('primary_platform')), \
+                   "Partitioned cube sizes differ"
+            del cube
+    
+    print("✓ Test 14 PASSED: Parallel pipeline")
+
+def test_quantile_sketch():
+    """Test that merged quantile sketches stay within their error bound."""
+    error = 0.01
+    values = np.random.default_rng(1).lognormal(0, 2, 200000)
+    
+    sketches = [QuantileSketch(error, seed=i).update(chunk)
+                for i, chunk in enumerate(np.array_split(values, 8))]
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    
+    quantiles = np.linspace(0.01, 0.99, 99)
+    ranks = np.searchsorted(np.sort(values), merged.quantile(quantiles)) / len(values)
+    assert np.abs(ranks - quantiles).max() <= error, "Rank error above bound"
+    assert merged.count == len(values), "Wrong count"
+    assert np.isclose(merged.std(), values.std(ddof=1)), "Wrong std"
+    assert merged.quantile(1.0) == values.max(), "Wrong max"
+    
+    df = fea.create_engagement_score(_make_sample_df())
+    exact = fea.grouped_summary(df, 'gender', 'engagement_score', ['mean', 'median', 'count'])
+    sketched = fea.grouped_summary(df, 'gender', 'engagement_score',
+                                   ['mean', 'median', 'count'], sketch_error=error)
+    assert (sketched['count'] == exact['count']).all(), "Grouped counts differ"
+    assert np.allclose(sketched['mean'], exact['mean']), "Grouped means differ"
+    assert np.allclose(sketched['median'], exact['median'], atol=0.01), "Grouped medians off"
+    
+    print("✓ Test 15 PASSED: Quantile sketch")
+
+def test_density_grids():
+    """Test that density grids built from chunks match the whole-frame grids."""
+    df = fea.create_engagement_score(_make_sample_df())
+    whole = density_plots.build_density_grids(df, bins=40)
+    chunks = [df.iloc[i:i + 300] for i in range(0, len(df), 300)]
+    streamed = density_plots.build_density_grids(chunks, density_plots.column_ranges(df),
+                                                 bins=40)
+    
+    for name in whole:
+        assert np.array_equal(whole[name].counts, streamed[name].counts), \
+               f"Chunked grid differs: {name}"
+    valid = df[['tenure', 'engagement_score']].notna().all(axis=1).sum()
+    assert whole['tenure_vs_score'].counts.sum() == valid, "Points lost while binning"
+    counts, _ = np.histogram(df['age'], bins=30)
+    assert np.array_equal(whole['age'].counts, counts), "Histogram differs from numpy"
+    
+    print("✓ Test 16 PASSED: Density grids")
+
+def test_panel_rendering():
+    """Test that unchanged panels are skipped on the next render."""
+    import panel_renderer
+    
+    df = fea.create_engagement_score(_make_sample_df())
+    valuable_users = fea.identify_valuable_users(df, top_n=100)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        first = panel_renderer.render_dashboards(df, valuable_users, tmpdir, max_workers=2)
+        second = panel_renderer.render_dashboards(df, valuable_users, tmpdir, max_workers=2)
+        third = panel_renderer.render_dashboards(df, valuable_users.head(50), tmpdir,
+                                                 max_workers=2)
+        
+        for filename in panel_renderer.DASHBOARDS:
+            assert os.path.getsize(os.path.join(tmpdir, filename)) > 0, \
+                   f"Missing dashboard: {filename}"
+    
+    assert len(first['rendered']) == 15, "Not every panel rendered"
+    assert second['rendered'] == [], "Unchanged panels were redrawn"
+    assert third['rendered'] == ['top_users_age_distribution'], \
+           "Wrong panels redrawn after the top users changed"
+    
+    print("✓ Test 17 PASSED: Panel rendering")
+
+def test_cli_lazy_imports():
+    """Test that scoring does not import plotting libraries and the CLI starts fast."""
+    import subprocess
+    import time
+    
+    check = ("import sys, facebook_eda_analysis; "
+             "print('matplotlib' in sys.modules or 'seaborn' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', check], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.stdout.strip() == 'False', "Plotting libraries imported at startup"
+    
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, 'facebook_eda_cli.py', '--help'],
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    elapsed = time.perf_counter() - started
+    assert result.returncode == 0 and 'top-k' in result.stdout, "CLI help failed"
+    assert elapsed < 1.0, f"CLI startup took {elapsed:.2f}s"
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = _write_sample_csv(tmpdir)
+        import facebook_eda_cli
+        facebook_eda_cli.main(['top-k', '--data', csv_path, '--output-dir', tmpdir,
+                               '-k', '10', '-k', '20', '--chunksize', '500'])
+        top_10 = pd.read_csv(os.path.join(tmpdir, 'valuable_users_list_top10.csv'))
+        top_20 = pd.read_csv(os.path.join(tmpdir, 'valuable_users_list_top20.csv'))
+    assert top_10['userid'].tolist() == top_20['userid'].tolist()[:10], "Top-K files disagree"
+    
+    print("✓ Test 18 PASSED: CLI lazy imports")
+
+def test_stage_cache():
+    """Test that changing top_n only recomputes the stages downstream of it."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import stage_cache
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = _write_sample_csv(tmpdir)
+        first = stage_cache.run_cached_analysis(path, tmpdir, top_n=100)
+        first_users = pd.read_csv(os.path.join(tmpdir, 'valuable_users_list.csv'))
+        second = stage_cache.run_cached_analysis(path, tmpdir, top_n=100)
+        second_users = pd.read_csv(os.path.join(tmpdir, 'valuable_users_list.csv'))
+        third = stage_cache.run_cached_analysis(path, tmpdir, top_n=50)
+        # Edited analysis code invalidates every stage
+        code_key = stage_cache.code_fingerprint()
+        stage_cache._code_key = 'edited'
+        try:
+            edited = stage_cache.run_cached_analysis(path, tmpdir, top_n=50)
+        finally:
+            stage_cache._code_key = code_key
+        
+        # Entries beyond the size limit are evicted least recently used first
+        cache = stage_cache.StageCache(os.path.join(tmpdir, 'small'), max_bytes=3000)
+        for stage in ['a', 'b', 'c']:
+            cache.run(stage, [], {}, lambda: np.zeros(100))
+        cache.run('a', [], {}, lambda: np.zeros(100))
+        cache.run('d', [], {}, lambda: np.zeros(100))
+        cache.run('a', [], {}, lambda: np.zeros(100))
+    
+    assert second.misses == [], f"Unchanged stages recomputed: {second.misses}"
+    pd.testing.assert_frame_equal(first_users, second_users)
+    assert third.misses == ['valuable_users', 'recommendations', 'visualizations'], \
+           f"Wrong stages recomputed: {third.misses}"
+    assert edited.hits == [], f"Stale stages replayed after a code change: {edited.hits}"
+    assert cache.hits == ['a', 'a'], f"Wrong entries evicted: {cache.hits}"
+    
+    print("✓ Test 19 PASSED: Stage result cache")
+
+def test_benchmark_suite():
+    """Test the synthetic generator and the baseline regression check."""
+    import benchmark
+    
+    whole = benchmark.generate_users(3000, seed=1)
+    pd.testing.assert_frame_equal(whole, benchmark.generate_users(3000, seed=1))
+    assert whole['userid'].is_unique, "Generated user ids are not unique"
+    assert list(whole.columns) == list(fea.COLUMN_DTYPES), "Schema differs from the dataset"
+    assert (whole['mobile_likes'] + whole['www_likes'] == whole['likes']).all(), \
+           "Platform likes do not add up"
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = benchmark.write_synthetic_csv(os.path.join(tmpdir, 'bench.csv'), 3000,
+                                             seed=1, chunksize=1000)
+        chunked = pd.read_csv(path)
+        results = benchmark.run_benchmark(path, tmpdir, visualizations=False)
+    
+    assert len(chunked) == 3000 and chunked['userid'].is_unique, "Chunked ids collide"
+    expected = [stage for stage in benchmark.STAGES if stage != 'create_visualizations']
+    assert list(results) == expected, f"Wrong stages timed: {list(results)}"
+    assert results['load_data']['rows'] == 3000, "Wrong row count"
+    
+    slower = {stage: dict(result, seconds=result['seconds'] + 1.0)
+              for stage, result in results.items()}
+    assert benchmark.compare_to_baseline(results, results) == [], "Baseline regressed on itself"
+    regressions = benchmark.compare_to_baseline(slower, results)
+    assert len(regressions) == len(results), "Slower stages not flagged"
+    
+    print("✓ Test 20 PASSED: Benchmark suite")
+
+def test_stage_tracing():
+    """Test that traced stages and chunks export a run report and Chrome trace."""
+    import json
+    import tracing
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = _write_sample_csv(tmpdir)
+        with tracing.Tracer(memory=True) as tracer:
+            df = fea.create_engagement_score(fea.load_data(csv_path, use_cache=False))
+            fea.identify_valuable_users(df, top_n=10)
+            fea.score_csv_chunked(csv_path, None, chunksize=500)
+        tracer.write_report(os.path.join(tmpdir, 'report.json'))
+        tracer.write_chrome_trace(os.path.join(tmpdir, 'trace.json'))
+        with open(os.path.join(tmpdir, 'report.json')) as f:
+            report = json.load(f)
+        with open(os.path.join(tmpdir, 'trace.json')) as f:
+            trace = json.load(f)
+    
+    summary = report['summary']
+    for stage in ['load_data', 'create_engagement_score', 'identify_valuable_users',
+                  'score_csv_chunked', 'score_chunk', 'read_chunk']:
+        assert stage in summary, f"Missing span: {stage}"
+    assert summary['identify_valuable_users']['rows'] == 2000, "Wrong rows for a stage"
+    assert summary['score_chunk']['calls'] == 4, "Wrong number of chunk spans"
+    assert summary['score_chunk']['rows'] == 2000, "Chunk rows do not add up"
+    chunk_peak = max(span['traced_peak_mb'] for span in report['spans']
+                     if span['name'] == 'score_chunk')
+    outer = [span for span in report['spans'] if span['name'] == 'score_csv_chunked'][0]
+    assert outer['traced_peak_mb'] >= chunk_peak, "Stage peak lost its chunk peaks"
+    assert len(trace['traceEvents']) == len(report['spans']), "Trace events missing"
+    assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in trace['traceEvents'])
+    assert tracing.active_tracer() is None, "Tracer left active"
+    
+    print("✓ Test 21 PASSED: Stage tracing")
+
+def test_columnar_output():
+    """Test that the partitioned columnar table round-trips and skips partitions."""
+    import columnar_output
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = _write_sample_csv(tmpdir)
+        root = os.path.join(tmpdir, 'scored_users')
+        with columnar_output.PartitionedWriter(root, row_group_size=300) as table:
+            fea.score_csv_chunked(csv_path, None, chunksize=700, table=table)
+        manifest = columnar_output.load_manifest(root)
+        result = columnar_output.read_scored_table(root)
+        high = columnar_output.read_scored_table(
+            root, ['userid', 'engagement_score'],
+            [('user_category', 'in', ['Medium Engagement', 'High Engagement']),
+             ('engagement_score', '>=', 0.3)])
+    
+    expected = fea.create_engagement_score(_make_sample_df())
+    fea.add_platform_columns(fea.add_age_group(expected))
+    result = result.sort_values('userid').reset_index(drop=True)
+    expected = expected.sort_values('userid').reset_index(drop=True)
+    
+    assert manifest['rows'] == 2000, "Rows lost in the table"
+    assert max(group['rows'] for group in manifest['row_groups']) <= 300, "Row group too big"
+    np.testing.assert_array_equal(result['engagement_score'].values,
+                                  expected['engagement_score'].values)
+    for col in ['user_category', 'primary_platform', 'age_group', 'gender']:
+        assert result[col].astype(str).tolist() == expected[col].astype(str).tolist(), \
+               f"Column {col} does not round-trip"
+    wanted = expected[expected['engagement_score'] >= 0.3]
+    assert len(wanted) > 0 and sorted(high['userid']) == sorted(wanted['userid']), \
+           "Filtered read is wrong"
+    
+    print("✓ Test 22 PASSED: Columnar output")
+
+def test_query_service():
+    """Test query service lookups, segment top-K and hot reload under load."""
+    import asyncio
+    import json
+    import query_service
+    
+    async def send(port, data):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(data)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        head, _, body = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), json.loads(body)
+    
+    async def request(port, path, method='GET'):
+        return await send(port, f"{method} {path} HTTP/1.1\r\nConnection: close\r\n\r\n".encode())
+    
+    async def scenario(first_path, second_path):
+        service, server = await query_service.start_service(first_path, port=0)
+        port = server.sockets[0].getsockname()[1]
+        results = {'health': await request(port, '/health'),
+                   'top': await request(port, '/top?k=5&primary_platform=Mobile'),
+                   'segments': await request(port, '/segments?by=gender'),
+                   'missing': await request(port, '/users/1'),
+                   'garbage': await send(port, b'\x16\x03\x01 garbage\r\n\r\n'),
+                   'bad_length': await send(port, b'POST /reload HTTP/1.1\r\n'
+                                                  b'Content-Length: lots\r\n\r\n'),
+                   'still_up': await request(port, '/health')}
+        user = results['top'][1][0]['userid']
+        results['user'] = await request(port, f'/users/{user}')
+        reload = asyncio.create_task(request(port, f'/reload?path={second_path}', 'POST'))
+        results['during'] = await asyncio.gather(*[request(port, '/health')
+                                                   for _ in range(20)])
+        results['reload'] = await reload
+        results['after'] = await request(port, '/health')
+        server.close()
+        await server.wait_closed()
+        return results
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        first_path = _write_sample_csv(tmpdir)
+        second_path = os.path.join(tmpdir, 'second.csv')
+        _make_sample_df(500, seed=1).to_csv(second_path, index=False)
+        results = asyncio.run(scenario(first_path, second_path))
+    
+    df = fea.add_platform_columns(fea.create_engagement_score(_make_sample_df()))
+    mobile = df[df['primary_platform'] == 'Mobile']
+    expected = mobile.iloc[topk.top_k_positions(mobile['engagement_score'].values,
+                                                mobile['userid'].values, 5)]
+    
+    assert results['health'][1]['rows'] == 2000, "Wrong snapshot size"
+    assert [user['userid'] for user in results['top'][1]] == expected['userid'].tolist(), \
+           "Segment top-K is wrong"
+    assert results['user'][1]['rank'] >= 1, "User lookup has no rank"
+    assert results['missing'][0] == 404, "Unknown user not reported"
+    assert results['garbage'][0] == results['bad_length'][0] == 400, \
+           "Malformed requests not answered with 400"
+    assert results['still_up'][0] == 200, "Service stopped after a malformed request"
+    assert {row['gender'] for row in results['segments'][1]} == {'female', 'male'}
+    assert all(status == 200 for status, _ in results['during']), "Queries dropped on reload"
+    assert results['reload'][1]['version'] == 2 and results['after'][1]['rows'] == 500, \
+           "Reload did not swap the snapshot"
+    
+    print("✓ Test 23 PASSED: Query service")
+
+def test_userid_index():
+    """Test memory-mapped userid lookups against a pandas merge."""
+    import userid_index
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = _write_sample_csv(tmpdir)
+        scored_path = os.path.join(tmpdir, 'scored_users.csv')
+        index_dir = userid_index.default_index_dir(scored_path)
+        with userid_index.UseridIndexWriter(index_dir) as writer:
+            fea.score_csv_chunked(csv_path, scored_path, chunksize=700, table=writer)
+        index = userid_index.UseridIndex(index_dir)
+        scored = pd.read_csv(scored_path, float_precision='round_trip')
+        
+        rng = np.random.default_rng(3)
+        wanted = np.concatenate([rng.choice(scored['userid'].values, 5000), [1, 99999999]])
+        result = index.get(wanted)
+        rows = index.lookup(wanted)
+        joined = index.join(pd.DataFrame({'userid': wanted, 'campaign': 'spring'}))
+        assert isinstance(index.userids, np.memmap), "Index keys are not memory-mapped"
+        del index
+        
+        # More labels than int16 codes hold: codes widen instead of wrapping
+        labels = pd.DataFrame({'userid': np.arange(40000), 'engagement_score': 0.5,
+                               'segment': [f'segment-{i}' for i in range(40000)]})
+        wide_dir = os.path.join(tmpdir, 'wide.userid_index')
+        userid_index.build_userid_index([labels.iloc[:20000], labels.iloc[20000:]], wide_dir,
+                                        columns=['segment'])
+        wide = userid_index.UseridIndex(wide_dir).get([39999, 5, 123456])
+    
+    assert wide['segment'].astype(object).tolist()[:2] == ['segment-39999', 'segment-5'] and \
+           pd.isna(wide['segment'].iloc[2]), "Text payload codes wrapped around"
+    expected = pd.DataFrame({'userid': wanted}).merge(scored, on='userid', how='left')
+    fea.add_platform_columns(expected)
+    expected.loc[~expected['userid'].isin(scored['userid']), 'primary_platform'] = np.nan
+    assert len(result) == len(wanted) and not result['found'].values[-2:].any(), \
+           "Unknown userids reported as found"
+    assert result['found'].values[:-2].all(), "Known userids not found"
+    np.testing.assert_array_equal(result['engagement_score'].values,
+                                  expected['engagement_score'].values)
+    assert result['user_category'].astype(str).tolist() == \
+           expected['user_category'].astype(str).tolist(), "Categories differ"
+    assert (scored['userid'].values[rows[:-2]] == wanted[:-2]).all(), \
+           "Row offsets do not point at the scored output"
+    assert joined['campaign'].eq('spring').all() and \
+           joined['primary_platform'].astype(str).tolist() == \
+           expected['primary_platform'].astype(str).tolist(), "Join is wrong"
+    
+    print("✓ Test 24 PASSED: Userid index")
+
+def test_column_store():
+    """Test the memory-mapped column store round trip and freshness check."""
+    import column_store
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = _write_sample_csv(tmpdir)
+        store_dir = column_store.convert_csv(csv_path, chunksize=700)
+        expected = fea.read_typed_csv(csv_path)
+        loaded = column_store.load_columns(store_dir)
+        pd.testing.assert_frame_equal(loaded, expected)
+        
+        columns = fea.stage_columns('score')
+        df = fea.load_data(csv_path, columns)
+        assert list(df.columns) == columns, "Wrong columns loaded"
+        assert isinstance(df['likes'].values, np.memmap), "Columns are not memory-mapped"
+        assert not os.path.exists(csv_path + '.cache.npz'), "Fresh store was not used"
+        
+        # A changed CSV must not be served from the stale store
+        with open(csv_path, 'a') as f:
+            f.write(','.join(['99999999'] + ['1'] * (len(expected.columns) - 1)) + '\n')
+        assert not column_store.store_is_fresh(store_dir, csv_path), "Stale store reported fresh"
+        assert len(fea.load_data(csv_path)) == len(expected) + 1, "Stale store was used"
+        
+        scored_path = os.path.join(tmpdir, 'scored_users.csv')
+        scored_store = os.path.join(tmpdir, 'scored_users.columns')
+        with column_store.ColumnStoreWriter(scored_store) as writer:
+            fea.score_csv_chunked(csv_path, scored_path, chunksize=700, table=writer)
+        scored = pd.read_csv(scored_path, float_precision='round_trip')
+        stored = fea.load_data(scored_store, ['userid', 'engagement_score', 'user_category'])
+        np.testing.assert_array_equal(stored['userid'].values, scored['userid'].values)
+        np.testing.assert_array_equal(stored['engagement_score'].values,
+                                      scored['engagement_score'].values)
+        assert stored['user_category'].astype(str).tolist() == \
+               scored['user_category'].astype(str).tolist(), "Categories differ"
+        del df, loaded, stored
+    
+    print("✓ Test 25 PASSED: Column store")
+
+def test_weight_sweep():
+    """Test batched weight vectors against scoring each weighting separately."""
+    import contextlib
+    import io
+    import weight_sweep
+    
+    df = _make_sample_df(n_users=3000, seed=4)
+    vectors = weight_sweep.random_weight_vectors(6, seed=1)
+    vectors.loc[0] = list(fea.ENGAGEMENT_WEIGHTS.values())
+    result = weight_sweep.sweep_weights(df, vectors, top_n=200, block_size=700)
+    
+    with contextlib.redirect_stdout(io.StringIO()):
+        baseline = fea.create_engagement_score(df.copy())
+    baseline_top = set(topk.top_k_positions(baseline['engagement_score'].values,
+                                            baseline['userid'].values, 200).tolist())
+    for j, weights in vectors.iterrows():
+        with contextlib.redirect_stdout(io.StringIO()):
+            scored = fea.create_engagement_score(df.copy(), weights=weights.to_dict())
+        counts = scored['user_category'].value_counts().reindex(fea.CATEGORY_LABELS)
+        assert (result.loc[j, fea.CATEGORY_LABELS].values == counts.values).all(), \
+               f"Category counts differ for vector {j}"
+        top = topk.top_k_positions(scored['engagement_score'].values,
+                                   scored['userid'].values, 200)
+        assert result.loc[j, 'top_n_overlap'] == len(baseline_top & set(top.tolist())) / 200, \
+               f"Top-N overlap differs for vector {j}"
+    assert result.loc[0, 'rank_correlation'] > 0.999999, "Baseline does not match itself"
+    assert result['rank_correlation'].between(-1, 1).all(), "Rank correlation out of range"
+    
+    print("✓ Test 26 PASSED: Weight sweep")
+
+def test_summary_stats():
+    """Test merged chunk summaries against pandas statistics and correlation."""
+    import pickle
+    from summary_stats import SummaryStats, summarize_chunks
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        df = fea.read_typed_csv(_write_sample_csv(tmpdir, seed=5))
+    df.loc[df.index[::7], 'likes'] = np.nan
+    numeric = df.select_dtypes('number')
+    
+    # Shards summarised separately, shipped between processes and merged
+    shards = [SummaryStats.from_frame(df.iloc[start:start + 450])
+              for start in range(0, len(df), 450)]
+    merged = SummaryStats()
+    for shard in reversed(shards):
+        merged.merge(pickle.loads(pickle.dumps(shard)))
+    streamed = summarize_chunks(df.iloc[start:start + 300] for start in range(0, len(df), 300))
+    
+    for stats in (merged, streamed):
+        assert stats.rows == len(df), "Row count is wrong"
+        assert stats.nulls.equals(df.isnull().sum()), "Null counts differ"
+        assert stats.value_counts('gender').equals(df['gender'].value_counts()), \
+               "Gender counts differ"
+        np.testing.assert_allclose(stats.correlation().values, numeric.corr().values,
+                                   rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(stats.describe(numeric.quantile([0.25, 0.5, 0.75])).values,
+                                   numeric.describe().values, rtol=1e-6)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = _write_sample_csv(tmpdir, seed=6)
+        scored_path = os.path.join(tmpdir, 'scored_users.csv')
+        summary = SummaryStats()
+        fea.score_csv_chunked(csv_path, scored_path, chunksize=600, summary=summary)
+        scored = pd.read_csv(scored_path, float_precision='round_trip')
+    np.testing.assert_allclose(summary.correlation(fea.CORRELATION_COLUMNS).values,
+                               scored[fea.CORRELATION_COLUMNS].corr().values,
+                               rtol=1e-10, atol=1e-12)
+    
+    print("✓ Test 27 PASSED: Summary statistics")
+
+def test_segment_cube():
+    """Test segment cube roll-ups and drill-downs against pandas groupbys and masks."""
+    import contextlib
+    import io
+    
+    df = _make_sample_df(n_users=5000, seed=8)
+    df.loc[df.index[::50], 'gender'] = np.nan
+    df.loc[df.index[::31], 'tenure'] = np.nan
+    with contextlib.redirect_stdout(io.StringIO()):
+        df = fea.create_engagement_score(df)
+    fea.add_platform_columns(fea.add_age_group(df))
+    cube = fea.segment_cube(df)
+    
+    # Platform rules as the four .loc passes used to apply them
+    mobile = df['mobile_likes'] / (df['mobile_likes'] + df['www_likes'] + 1e-10)
+    www = df['www_likes'] / (df['mobile_likes'] + df['www_likes'] + 1e-10)
+    expected_platform = pd.Series('None', index=df.index)
+    expected_platform[mobile > 0.7] = 'Mobile'
+    expected_platform[www > 0.7] = 'Web'
+    expected_platform[(mobile >= 0.3) & (mobile <= 0.7)] = 'Both'
+    assert (df['primary_platform'] == expected_platform).all(), "Primary platform differs"
+    
+    df['tenure_group'] = pd.cut(df['tenure'], bins=fea.TENURE_BINS, labels=fea.TENURE_LABELS)
+    for by in ['gender', 'age_group', 'primary_platform', 'tenure_group', 'user_category']:
+        expected = df.groupby(by)['engagement_score'].agg(['size', 'count', 'mean',
+                                                          'median', 'std'])
+        result = cube.agg(by, 'engagement_score', ['size', 'count', 'mean', 'median', 'std'])
+        assert list(result.index.astype(str)) == list(expected.index.astype(str)), \
+               f"Groups differ for {by}"
+        np.testing.assert_allclose(result.values.astype(float),
+                                   expected.values.astype(float), rtol=1e-9)
+    expected = df.groupby(['gender', 'age_group'])['friend_count'].mean()
+    np.testing.assert_allclose(cube.agg(['gender', 'age_group'], 'friend_count',
+                                        ['mean'])['mean'].values, expected.values)
+    
+    # Drill down to mobile women, roll up by user category
+    subset = df[(df['primary_platform'] == 'Mobile') & (df['gender'] == 'female')]
+    drilled = cube.where(primary_platform='Mobile', gender='female')
+    assert drilled.size() == len(subset), "Drill-down row count differs"
+    assert drilled.size('user_category').equals(
+        subset['user_category'].value_counts(sort=False).astype(np.int64)), \
+        "Drill-down category counts differ"
+    assert np.isclose(drilled.quantile('engagement_score', 0.5),
+                      subset['engagement_score'].median()), "Drill-down median differs"
+    
+    valuable_users = df.iloc[topk.top_k_positions(df['engagement_score'].values,
+                                                  df['userid'].values, 100)]
+    metrics = fea.recommendation_metrics(df, valuable_users, cube)
+    assert metrics['total_users'] == len(df), "Total users differs"
+    assert metrics['high_engagement'] == (df['engagement_score'] > 0.5).sum(), \
+           "High engagement count differs"
+    assert metrics['low_engagement'] == (df['engagement_score'] < 0.2).sum(), \
+           "Low engagement count differs"
+    assert metrics['mobile_users'] == (df['primary_platform'] == 'Mobile').sum(), \
+           "Mobile users differ"
+    assert np.isclose(metrics['friends_ratio'], valuable_users['friend_count'].mean() /
+                      df['friend_count'].mean()), "Friends ratio differs"
+    
+    print("✓ Test 28 PASSED: Segment cube")
+
+def test_score_ranking():
+    """Test that the shared ranking matches pandas ranks, describe() and top-k selection."""
+    import contextlib
+    import io
+    from score_ranking import ScoreRanking
+    
+    df = _make_sample_df(n_users=4000, seed=9)
+    # Plenty of ties, including users at the minimum of every feature
+    for col in fea.ENGAGEMENT_WEIGHTS:
+        df[col] = df[col] // 50 * 50
+    df.loc[df.index[::40], list(fea.ENGAGEMENT_WEIGHTS)] = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        df = fea.create_engagement_score(df)
+    scores = df['engagement_score']
+    
+    expected = topk.top_k_positions(scores.values, df['userid'].values, len(df))
+    ranking = fea.score_ranking(df)
+    assert np.array_equal(ranking.top(len(df)), expected), "Rank order differs from top-k order"
+    assert np.array_equal(df['engagement_rank'].values[expected],
+                          np.arange(1, len(expected) + 1)), "Ordinal ranks differ"
+    np.testing.assert_allclose(df['percentile_rank'], scores.rank(pct=True), rtol=1e-12)
+    assert df['dense_rank'].equals(scores.rank(method='dense', ascending=False)), \
+           "Dense ranks differ"
+    assert ranking.describe('engagement_score').equals(scores.describe()), "describe() differs"
+    assert ranking.median() == scores.median(), "Median differs"
+    
+    # Deciles cover every user, zero scores included, and never split ties
+    assert df['engagement_quantile'].notna().sum() == scores.notna().sum(), \
+           "Scored users without a quantile category"
+    assert (df.groupby('engagement_score')['engagement_quantile'].nunique() == 1).all(), \
+           "Tied users in different categories"
+    expected_codes = pd.cut(scores.rank(pct=True), fea.QUANTILE_CUT_POINTS, labels=False,
+                            include_lowest=True)
+    assert np.array_equal(df['engagement_quantile'].cat.codes, expected_codes.fillna(-1)), \
+           "Quantile categories differ"
+    
+    # Top-N slices agree with the top-k selection, also on a subset's ranks
+    with contextlib.redirect_stdout(io.StringIO()):
+        valuable_users = fea.identify_valuable_users(df, top_n=100)
+    assert np.array_equal(valuable_users.index, df.index[expected[:100]]), "Top 100 differs"
+    subset = df.iloc[::3]
+    subset_ranking = ScoreRanking.from_ranks(subset['engagement_rank'],
+                                             subset['engagement_score'], subset['userid'])
+    assert np.array_equal(subset_ranking.top(10),
+                          topk.top_k_positions(subset['engagement_score'].values,
+                                               subset['userid'].values, 10)), \
+           "Subset top 10 differs"
+    
+    # Incremental rescoring re-ranks everyone
+    delta = df.iloc[:10][list(_make_sample_df(10).columns)].copy()
+    delta['likes'] = delta['likes'].max() * 10
+    with contextlib.redirect_stdout(io.StringIO()):
+        rescored, _ = fea.rescore_incremental(df.copy(), delta,
+                                              fea.compute_feature_bounds(df))
+    expected = topk.top_k_positions(rescored['engagement_score'].values,
+                                    rescored['userid'].values, 10)
+    assert np.array_equal(fea.score_ranking(rescored).top(10), expected), \
+           "Ranks not refreshed after rescoring"
+    
+    # Scores changed behind the ranks' back are sorted again, not trusted
+    stale = df.copy()
+    stale.loc[stale.index[-5:], 'engagement_score'] = scores.max() + 1
+    expected = topk.top_k_positions(stale['engagement_score'].values,
+                                    stale['userid'].values, 10)
+    assert np.array_equal(fea.score_ranking(stale).top(10), expected), \
+           "Stale ranks reused"
+    
+    print("✓ Test 29 PASSED: Score ranking")
+
+def test_sharded_pipeline():
+    """Test that sharded map-reduce matches a single-file run and only remaps changed shards."""
+    import contextlib
+    import io
+    import sharded_pipeline
+    
+    df = _make_sample_df(n_users=3000, seed=10)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        shards = []
+        for i, part in enumerate(np.array_split(df, 3)):
+            shards.append(os.path.join(tmpdir, f'part-{i}.csv'))
+            part.to_csv(shards[-1], index=False)
+        manifest = sharded_pipeline.write_manifest(shards, os.path.join(tmpdir, 'shards.txt'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            sharded = sharded_pipeline.run_sharded(manifest, output_dir=tmpdir, top_n=100,
+                                                   max_workers=1)
+            full = fea.create_engagement_score(df.copy())
+            fea.add_platform_columns(full)
+            expected = fea.identify_valuable_users(full, top_n=100)
+        saved = pd.read_csv(os.path.join(tmpdir, 'valuable_users_list.csv'))
+        assert list(saved['userid']) == list(expected['userid']), "Valuable users differ"
+        np.testing.assert_allclose(saved['engagement_score'], expected['engagement_score'],
+                                   rtol=1e-12)
+        
+        cube, top, summary, rows = sharded_pipeline.reduce_partials(manifest, top_n=100)
+        metrics = fea.recommendation_metrics(None, sharded, cube)
+        expected_metrics = fea.recommendation_metrics(full, expected)
+        for key, value in expected_metrics.items():
+            assert value == metrics[key] or np.isclose(value, metrics[key]), f"{key} differs"
+        assert rows == len(df) and summary.rows == len(df), "Row counts differ"
+        
+        # Nothing changed: every partial is reused
+        with contextlib.redirect_stdout(io.StringIO()):
+            remapped = sharded_pipeline.map_shards(manifest, top_n=100, max_workers=1)
+        assert remapped == {'bounds': [], 'scores': []}, "Unchanged shards were remapped"
+        
+        # Dropping a user that sets no bound redoes only that shard
+        part = pd.read_csv(shards[1])
+        features = part[list(fea.ENGAGEMENT_WEIGHTS)]
+        inner = ((features > features.min()) & (features < features.max())).all(axis=1)
+        part.drop(index=inner.idxmax()).to_csv(shards[1], index=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            remapped = sharded_pipeline.map_shards(manifest, top_n=100, max_workers=1)
+        assert remapped == {'bounds': [shards[1]], 'scores': [shards[1]]}, \
+               f"Wrong shards remapped: {remapped}"
+        
+        # Widening a bound moves every score, so every shard is rescored
+        part = pd.read_csv(shards[0])
+        part.loc[0, 'likes'] = df['likes'].max() * 2
+        part.to_csv(shards[0], index=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            remapped = sharded_pipeline.map_shards(manifest, top_n=100, max_workers=1)
+        assert remapped == {'bounds': [shards[0]], 'scores': shards}, \
+               f"Wrong shards remapped: {remapped}"
+    
+    print("✓ Test 30 PASSED: Sharded pipeline")
+
+def test_score_history():
+    """Test that score snapshots round-trip and diff like a pandas merge."""
+    import contextlib
+    import io
+    from score_history import ScoreHistory
+    
+    with contextlib.redirect_stdout(io.StringIO()):
+        old = fea.create_engagement_score(_make_sample_df(n_users=3000, seed=11))
+    # Two users just inside and outside the top 100 that float32 cannot tell apart,
+    # with the userid tie-break favouring the one outside
+    ranked = old.iloc[fea.score_ranking(old).top(len(old))]
+    cutoff = (ranked['engagement_score'].iloc[98] + ranked['engagement_score'].iloc[99]) / 2
+    low, high = ranked.index[-2:][np.argsort(ranked['userid'].iloc[-2:].values)]
+    old.loc[low, 'engagement_score'] = cutoff
+    old.loc[high, 'engagement_score'] = cutoff + 1e-12
+    rng = np.random.default_rng(11)
+    new = old.sample(frac=0.9, random_state=11).copy()
+    changed = rng.random(len(new)) < 0.3
+    new.loc[changed, 'engagement_score'] = new.loc[changed, 'engagement_score'] * 1.5
+    new['user_category'] = pd.cut(new['engagement_score'], bins=[0, 0.2, 0.4, 0.6, np.inf],
+                                  labels=list(old['user_category'].cat.categories),
+                                  include_lowest=True)
+    joined = old.head(50).copy()
+    joined['userid'] += 10000
+    new = pd.concat([new, joined])
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        history = ScoreHistory(os.path.join(tmpdir, 'history'))
+        history.append(old, 'before')
+        history.append(new, 'after')
+        try:
+            history.append(new, 'after')
+            raise AssertionError("Duplicate snapshot name accepted")
+        except ValueError:
+            pass
+        
+        # Reopening reads the stored snapshots back, sorted by userid
+        history = ScoreHistory(os.path.join(tmpdir, 'history'))
+        assert history.names() == ['before', 'after'], "Snapshot names differ"
+        loaded = history.load('before')
+        expected = old.sort_values('userid')
+        assert (loaded['userid'].values == expected['userid'].values).all(), "Userids differ"
+        np.testing.assert_array_equal(loaded['engagement_score'].values,
+                                      expected['engagement_score'].values.astype(np.float32))
+        assert (loaded['user_category'].astype(object).fillna('-').values ==
+                expected['user_category'].astype(object).fillna('-').values).all(), \
+               "Categories differ"
+        
+        diff = history.diff(top_n=100)
+        a, b = history.load('before'), history.load('after')
+        merged = a.merge(b, on='userid', suffixes=('_old', '_new'))
+        change = (merged['engagement_score_new'].astype(float)
+                  - merged['engagement_score_old'].astype(float))
+        # The unscored user stays unscored, which is not a change
+        movers = merged[change.fillna(0) != 0]
+        assert sorted(diff.movers['userid']) == sorted(movers['userid']), "Movers differ"
+        assert diff.movers['change'].is_monotonic_increasing, "Movers not sorted by change"
+        assert sorted(diff.newcomers['userid']) == sorted(set(b['userid']) - set(a['userid']))
+        assert sorted(diff.departed['userid']) == sorted(set(a['userid']) - set(b['userid']))
+        
+        # The top 100 is the one ranked on the float64 scores
+        top_old = set(old['userid'].iloc[fea.score_ranking(old).top(100)])
+        top_new = set(new['userid'].iloc[fea.score_ranking(new).top(100)])
+        assert top_old != set(a['userid'].iloc[fea.score_ranking(a).top(100)]), \
+               "float32 scores do not tie at the cutoff"
+        assert set(diff.valuable_left['userid']) == top_old - top_new, "Churned users differ"
+        assert set(diff.valuable_entered['userid']) == top_new - top_old, "Entrants differ"
+        
+        crosstab = pd.crosstab(merged['user_category_old'], merged['user_category_new'])
+        transitions = diff.transitions.loc[crosstab.index, crosstab.columns]
+        assert (transitions.values == crosstab.values).all(), "Category transitions differ"
+    
+    print("✓ Test 31 PASSED: Score history")
+
+def test_prefetch_chunk_reader():
+    """Test that the prefetching reader yields the serial reader's chunks, in order."""
+    import contextlib
+    import io
+    import threading
+    import chunk_reader
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = _write_sample_csv(tmpdir, n_users=3000, seed=12)
+        for chunksize, prefetch in [(1, 1), (299, 2), (1000, 4), (5000, 3)]:
+            serial = list(fea.read_typed_csv(csv_path, chunksize=chunksize))
+            prefetched = list(chunk_reader.prefetch_csv_chunks(csv_path, chunksize=chunksize,
+                                                               prefetch=prefetch))
+            assert len(serial) == len(prefetched), f"Chunk count differs at {chunksize}"
+            for expected, chunk in zip(serial, prefetched):
+                pd.testing.assert_frame_equal(chunk, expected)
+        columns = ['userid', 'likes']
+        chunks = chunk_reader.prefetch_csv_chunks(csv_path, columns, chunksize=700)
+        assert list(next(chunks).columns) == columns, "Column subset not applied"
+        chunks.close()
+        
+        # Stopping early releases the reader and parser threads
+        threads = threading.active_count()
+        chunks = chunk_reader.prefetch_csv_chunks(csv_path, chunksize=100, prefetch=2)
+        next(chunks)
+        chunks.close()
+        assert threading.active_count() == threads, "Threads left running"
+        
+        # Scoring through the prefetching reader writes the same file
+        with contextlib.redirect_stdout(io.StringIO()):
+            fea.score_csv_chunked(csv_path, os.path.join(tmpdir, 'serial.csv'), chunksize=400)
+            fea.score_csv_chunked(csv_path, os.path.join(tmpdir, 'prefetched.csv'),
+                                  chunksize=400, prefetch=3)
+        with open(os.path.join(tmpdir, 'serial.csv')) as a, \
+             open(os.path.join(tmpdir, 'prefetched.csv')) as b:
+            assert a.read() == b.read(), "Prefetched scoring output differs"
+    
+    print("✓ Test 32 PASSED: Prefetch chunk reader")
+
+def test_stage_graph():
+    """Test that targets run only the stages they need, serially or concurrently alike."""
+    import contextlib
+    import io
+    import matplotlib
+    matplotlib.use('Agg')
+    import stage_graph
+    
+    stages, columns = stage_graph.plan(['valuable_users_list.csv'])
+    names = [stage.name for stage in stages]
+    assert names == ['score', 'platform_columns', 'valuable_users', 'save_valuable_users'], \
+           f"Wrong stages planned: {names}"
+    assert 'dob_day' not in columns and 'likes' in columns, "Wrong columns planned"
+    stages, _ = stage_graph.plan(['facebook_eda_detailed_analysis.png'])
+    assert 'explore' not in [stage.name for stage in stages], "Exploration planned for a figure"
+    try:
+        stage_graph.plan(['no_such_output'])
+        raise AssertionError("Unknown target accepted")
+    except ValueError:
+        pass
+    
+    # The dashboard reads more than the frame columns it plots (userid for the ranking)
+    targets = ['valuable_users_list.csv', 'demographics', 'platform', 'recommendations',
+               'facebook_eda_visualizations.png']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = _write_sample_csv(tmpdir, n_users=3000, seed=13)
+        with contextlib.redirect_stdout(io.StringIO()):
+            fea.load_data(csv_path)  # both runs then load from the cache
+        outputs = {}
+        for workers in (1, 3):
+            output_dir = os.path.join(tmpdir, f'workers{workers}')
+            os.makedirs(output_dir)
+            printed = io.StringIO()
+            with contextlib.redirect_stdout(printed):
+                df, results = stage_graph.run_stages(targets, csv_path, output_dir,
+                                                     top_n=100, max_workers=workers)
+            with open(os.path.join(output_dir, 'valuable_users_list.csv')) as f:
+                saved = f.read()
+            outputs[workers] = (printed.getvalue().replace(output_dir, ''), saved,
+                                sorted(df.columns))
+            assert os.path.exists(os.path.join(output_dir, 'facebook_eda_visualizations.png')), \
+                   f"Dashboard not written with {workers} workers"
+        assert outputs[1][0] == outputs[3][0], "Concurrent run printed different reports"
+        assert outputs[1][1] == outputs[3][1], "Concurrent run saved different users"
+        assert outputs[1][2] == outputs[3][2], "Concurrent run added different columns"
+        assert 'DATA EXPLORATION' not in outputs[1][0], "Unneeded stage ran"
+        
+        full = fea.create_engagement_score(pd.read_csv(csv_path))
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = fea.identify_valuable_users(fea.add_platform_columns(full), top_n=100)
+        assert list(results['valuable_users']['userid']) == list(expected['userid']), \
+               "Valuable users differ from a direct run"
+    
+    print("✓ Test 33 PASSED: Stage graph")
+
 def run_all_tests():
     """Run all tests and report results."""
     print("="*70)
@@ -185,12 +1211,42 @@ def run_all_tests():
         test_demographics_analysis,
         test_top_users_identification,
         test_output_files_exist,
-        test_valuable_users_csv
+        test_valuable_users_csv,
+        test_chunked_engagement_score,
+        test_typed_cached_loader,
+        test_fused_scoring_kernel,
+        test_incremental_rescoring,
+        test_streaming_top_k,
+        test_parallel_pipeline,
+        test_quantile_sketch,
+        test_density_grids,
+        test_panel_rendering,
+        test_cli_lazy_imports,
+        test_stage_cache,
+        test_benchmark_suite,
+        test_stage_tracing,
+        test_columnar_output,
+        test_query_service,
+        test_userid_index,
+        test_column_store,
+        test_weight_sweep,
+        test_summary_stats,
+        test_segment_cube,
+        test_score_ranking,
+        test_sharded_pipeline,
+        test_score_history,
+        test_prefetch_chunk_reader,
+        test_stage_graph
     ]
     
     results = []
-    for test in tests:
-        results.append(test())
+    for number, test in enumerate(tests, 1):
+        # Tests that assert (rather than return False) fail by raising
+        try:
+            results.append(test() is not False)
+        except Exception as e:
+            print(f"✗ Test {number} FAILED: {test.__name__} - {str(e)}")
+            results.append(False)
     
     print()
     print("="*70)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Streaming Top-K Selection
+=========================
+Bounded, mergeable top-K buffers for picking the most valuable users from
+chunked or partitioned data. Users are ranked by engagement score, highest
+first, with ties broken by the smaller userid so results are deterministic
+no matter how the input was split.
+"""
+
+import numpy as np
+import pandas as pd
+
+def top_k_positions(scores, userids, k):
+    """Return the positions of the top k scores, ordered by score desc then userid asc."""
+    scores = np.asarray(scores, dtype=np.float64)
+    userids = np.asarray(userids)
+    candidates = np.flatnonzero(~np.isnan(scores))
+
+    # Narrow down with a linear-time partition before sorting, keeping all ties
+    if k < len(candidates):
+        candidate_scores = scores[candidates]
+        kth_largest = np.partition(candidate_scores, len(candidates) - k)[len(candidates) - k]
+        candidates = candidates[candidate_scores >= kth_largest]
+
+    order = np.lexsort((userids[candidates], -scores[candidates]))
+    return candidates[order[:k]]
+
+class TopKBuffer:
+    """
+    Keep the top users seen so far across chunks or partitions.
+    k may be a single value or several (e.g. [1000, 10000, 100000]); one
+    buffer of the largest k serves them all because smaller results are
+    prefixes of the larger one.
+    """
+
+    def __init__(self, k, columns=None, score_col='engagement_score', id_col='userid'):
+        self.k_values = sorted(set(np.atleast_1d(k).tolist()))
+        self.capacity = self.k_values[-1]
+        self.columns = columns
+        self.score_col = score_col
+        self.id_col = id_col
+        self.buffer = None
+
+    def update(self, chunk):
+        """Add a chunk of scored users to the buffer."""
+        if self.columns is not None:
+            chunk = chunk[self.columns]
+
+        # Once the buffer is full, only rows that can beat its last entry matter
+        if self.buffer is not None and len(self.buffer) == self.capacity:
+            threshold = self.buffer[self.score_col].iloc[-1]
+            chunk = chunk[chunk[self.score_col] >= threshold]
+        if self.buffer is not None:
+            chunk = pd.concat([self.buffer, chunk], ignore_index=True)
+
+        positions = top_k_positions(chunk[self.score_col].values, chunk[self.id_col].values,
+                                    self.capacity)
+        self.buffer = chunk.iloc[positions].reset_index(drop=True)
+        return self
+
+    def merge(self, other):
+        """Merge another buffer's partial result into this one."""
+        if other.buffer is not None:
+            self.update(other.buffer)
+        return self
+
+    def result(self, k=None):
+        """Return the top k users (the largest k by default), best first."""
+        if self.buffer is None:
+            return pd.DataFrame(columns=self.columns)
+        return self.buffer.head(self.capacity if k is None else k)
+
+def top_k_from_chunks(chunks, k, columns=None):
+    """Run a TopKBuffer over an iterable of scored chunks."""
+    buffer = TopKBuffer(k, columns)
+    for chunk in chunks:
+        buffer.update(chunk)
+    return buffer
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Stage Tracing
+=============
+Lightweight instrumentation for the analysis pipeline. While a Tracer is
+active, every traced stage and chunk records a span with its wall time, CPU
+time, peak RSS growth, rows processed and (optionally) tracemalloc peak. Spans
+export as a structured JSON run report and as Chrome trace events, which
+open in chrome://tracing or ui.perfetto.dev.
+
+With no tracer active a traced call costs one global lookup, so the
+decorators stay on in production; tracing a stage costs a few microseconds.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import pandas as pd
+
+_ACTIVE = None
+
+def _peak_rss_mb():
+    """Return the peak resident set size of this process so far, in MB."""
+    if resource is None:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+class Tracer:
+    """Collects spans for one run; use as a context manager to activate it."""
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.spans = []
+        self.started = time.perf_counter_ns()
+        self.started_at = time.time()
+        self._local = threading.local()
+
+    def __enter__(self):
+        global _ACTIVE
+        self._previous = _ACTIVE
+        _ACTIVE = self
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._stop_tracemalloc = True
+        return self
+
+    def __exit__(self, *exc_info):
+        global _ACTIVE
+        _ACTIVE = self._previous
+        if getattr(self, '_stop_tracemalloc', False):
+            tracemalloc.stop()
+            self._stop_tracemalloc = False
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def span(self, name, rows=None, **args):
+        """
+        Record the enclosed block as a span. The yielded dict may be updated
+        inside the block, e.g. to set 'rows' once it is known, or 'discard'
+        to drop the span.
+        """
+        stack = self._stack()
+        record = {'name': name, 'rows': rows, 'depth': len(stack),
+                  'parent': stack[-1]['name'] if stack else None,
+                  'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args}
+        if self.memory:
+            traced_before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        rss_before = _peak_rss_mb()
+        cpu_start = time.process_time()
+        start = time.perf_counter_ns()
+        stack.append(record)
+        try:
+            yield record
+        finally:
+            stack.pop()
+            end = time.perf_counter_ns()
+            record['start_ms'] = (start - self.started) / 1e6
+            record['wall_ms'] = (end - start) / 1e6
+            # process_time covers every thread, so nested or concurrent spans overlap
+            record['cpu_ms'] = (time.process_time() - cpu_start) * 1e3
+            record['peak_rss_mb'] = _peak_rss_mb()
+            record['rss_growth_mb'] = record['peak_rss_mb'] - rss_before
+            if self.memory:
+                # Nested spans reset the peak, so fold their peaks back in
+                peak = max(tracemalloc.get_traced_memory()[1], record.pop('child_peak', 0))
+                record['traced_peak_mb'] = (peak - traced_before) / 2**20
+                if stack:
+                    stack[-1]['child_peak'] = max(stack[-1].get('child_peak', 0), peak)
+            if not record.pop('discard', False):
+                self.spans.append(record)
+
+    def summary(self):
+        """Return per-name totals: calls, wall, CPU and rows, slowest first."""
+        totals = {}
+        for span in self.spans:
+            total = totals.setdefault(span['name'], {'calls': 0, 'wall_ms': 0.0,
+                                                     'cpu_ms': 0.0, 'rows': 0})
+            total['calls'] += 1
+            total['wall_ms'] += span['wall_ms']
+            total['cpu_ms'] += span['cpu_ms']
+            total['rows'] += span['rows'] or 0
+        return dict(sorted(totals.items(), key=lambda item: -item[1]['wall_ms']))
+
+    def report(self):
+        """Return the run report as a JSON-serialisable dict."""
+        spans = sorted(self.spans, key=lambda span: span['start_ms'])
+        return {
+            'started_at': self.started_at,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'host': platform.node(),
+            'peak_rss_mb': _peak_rss_mb(),
+            'summary': self.summary(),
+            'spans': spans,
+        }
+
+    def write_report(self, filepath):
+        """Write the JSON run report."""
+        with open(filepath, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+
+    def chrome_trace(self):
+        """Return the spans as Chrome trace-event complete ('X') events."""
+        events = []
+        for span in self.spans:
+            args = dict(span['args'], rows=span['rows'], cpu_ms=round(span['cpu_ms'], 3),
+                        rss_growth_mb=round(span['rss_growth_mb'], 3))
+            if 'traced_peak_mb' in span:
+                args['traced_peak_mb'] = round(span['traced_peak_mb'], 3)
+            events.append({'name': span['name'], 'cat': 'stage' if span['depth'] == 0 else 'chunk',
+                           'ph': 'X', 'ts': span['start_ms'] * 1e3, 'dur': span['wall_ms'] * 1e3,
+                           'pid': span['pid'], 'tid': span['tid'],
+                           'args': {key: value for key, value in args.items() if value is not None}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, filepath):
+        """Write the spans in Chrome trace-event format."""
+        with open(filepath, 'w') as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+def active_tracer():
+    """Return the active Tracer, or None."""
+    return _ACTIVE
+
+def span(name, rows=None, **args):
+    """Record a span on the active tracer; a no-op context when none is active."""
+    if _ACTIVE is None:
+        return contextlib.nullcontext({})
+    return _ACTIVE.span(name, rows, **args)
+
+def _row_count(args, result):
+    # Rows read from the first input frame, or produced by a loader
+    for value in tuple(args) + (result,):
+        if isinstance(value, pd.DataFrame):
+            return len(value)
+    return None
+
+def traced(func):
+    """Decorate a pipeline stage so each call is a span, with rows from its frames."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _ACTIVE is None:
+            return func(*args, **kwargs)
+        with _ACTIVE.span(func.__name__) as record:
+            result = func(*args, **kwargs)
+            record['rows'] = _row_count(args, result)
+        return result
+    return wrapper
+
+def traced_chunks(name, chunks):
+    """Yield from an iterable of chunks, recording the time to produce each one."""
+    iterator = iter(chunks)
+    index = 0
+    while True:
+        with span(name, chunk=index) as record:
+            chunk = next(iterator, None)
+            record['rows'] = None if chunk is None else len(chunk)
+            record['discard'] = chunk is None
+        if chunk is None:
+            return
+        yield chunk
+        index += 1
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Memory-Mapped Userid Index
+==========================
+A persistent index over userid for answering "what are the scores and
+categories of these users?" without loading or scanning the dataset:
+
+    scored_users.csv.userid_index/
+        meta.json              row count, columns and category labels
+        userids.npy            every userid, sorted
+        rows.npy               row offset of each sorted userid in the scored output
+        engagement_score.npy   payload columns, in scored-output row order
+        user_category.npy      (categorical payloads are stored as codes)
+        primary_platform.npy
+
+Files are opened with np.load(mmap_mode='r'), so opening an index reads
+only the small .npy headers and lookups touch only the pages they need.
+A batch of keys costs one vectorised searchsorted, O(log n) per key.
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from columnar_output import CategoryEncoder
+
+INDEX_VERSION = 1
+
+# Batches larger than this are sorted before searching
+SORT_BATCH = 4096
+
+# Scored columns returned by lookups, and their storage dtypes
+PAYLOAD_COLUMNS = {
+    'engagement_score': 'float64',
+    'user_category': 'category',
+    'primary_platform': 'category',
+}
+
+def default_index_dir(scored_path):
+    """Return where the index for a scored output lives."""
+    return scored_path.rstrip(os.sep) + '.userid_index'
+
+class UseridIndexWriter:
+    """Collect scored chunks in output order and write the index on close()."""
+
+    def __init__(self, index_dir, columns=None):
+        self.index_dir = index_dir
+        self.columns = list(PAYLOAD_COLUMNS if columns is None else columns)
+        self._ids = []
+        self._values = {col: [] for col in self.columns}
+        self._encoder = CategoryEncoder()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def write(self, chunk):
+        """Add the next chunk of scored users."""
+        self._ids.append(chunk['userid'].to_numpy())
+        for col in self.columns:
+            series = chunk[col]
+            if PAYLOAD_COLUMNS.get(col) == 'category' or not pd.api.types.is_numeric_dtype(series):
+                # Codes against one label list for the whole index; chunks
+                # coded in narrower dtypes are widened when concatenated
+                self._values[col].append(self._encoder.encode(col, series))
+            else:
+                self._values[col].append(series.to_numpy())
+        return self
+
+    def close(self):
+        """Sort the keys and write every index file; returns the metadata."""
+        # int64 keys so int64 queries never force a converted copy of the index
+        userids = (np.concatenate(self._ids) if self._ids else np.empty(0)).astype(np.int64)
+        rows = np.argsort(userids, kind='stable')
+        sorted_ids = userids[rows]
+        if len(sorted_ids) > 1 and (sorted_ids[1:] == sorted_ids[:-1]).any():
+            raise ValueError("userid is not unique; cannot build a userid index")
+
+        tmp_dir = self.index_dir + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, 'userids.npy'), sorted_ids)
+        np.save(os.path.join(tmp_dir, 'rows.npy'), rows.astype(np.int64))
+        for col in self.columns:
+            parts = self._values[col]
+            np.save(os.path.join(tmp_dir, f'{col}.npy'),
+                    np.concatenate(parts) if parts else np.empty(0))
+        meta = {'version': INDEX_VERSION, 'rows': len(userids), 'columns': self.columns,
+                'categories': self._encoder.categories}
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+        # Swap the finished index in so readers never see a partial one
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+        os.replace(tmp_dir, self.index_dir)
+        return meta
+
+def build_userid_index(chunks, index_dir, columns=None):
+    """Index a scored DataFrame or an iterable of scored chunks."""
+    if isinstance(chunks, pd.DataFrame):
+        chunks = [chunks]
+    writer = UseridIndexWriter(index_dir, columns)
+    for chunk in chunks:
+        writer.write(chunk)
+    return writer.close()
+
+class UseridIndex:
+    """Read-only, memory-mapped view of a userid index."""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != INDEX_VERSION:
+            raise ValueError(f"'{index_dir}' has index version {self.meta['version']}, "
+                             f"expected {INDEX_VERSION}")
+        load = lambda name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r')
+        self.userids = load('userids')
+        self.rows = load('rows')
+        self.columns = {col: load(col) for col in self.meta['columns']}
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def lookup(self, userids):
+        """Return the scored-output row of each userid, or -1 if it is unknown."""
+        userids = np.asarray(userids, dtype=np.int64)
+        if len(self.userids) == 0:
+            return np.full(userids.shape, -1, dtype=np.int64)
+        # Sorted keys let searchsorted start from the previous hit, which
+        # more than pays for sorting large batches
+        order = np.argsort(userids, kind='stable') if len(userids) > SORT_BATCH else None
+        keys = userids if order is None else userids[order]
+        found = np.minimum(np.searchsorted(self.userids, keys), len(self.userids) - 1)
+        rows = np.where(self.userids[found] == keys, self.rows[found], -1)
+        if order is None:
+            return rows
+        result = np.empty_like(rows)
+        result[order] = rows
+        return result
+
+    def _column(self, col, rows):
+        known = rows >= 0
+        values = self.columns[col]
+        if col in self.meta['categories']:
+            codes = np.full(len(rows), -1, dtype=values.dtype)
+            codes[known] = values[rows[known]]
+            return pd.Categorical.from_codes(codes, self.meta['categories'][col])
+        result = np.full(len(rows), np.nan, dtype=np.float64 if values.dtype.kind in 'iuf'
+                         else object)
+        result[known] = values[rows[known]]
+        return result
+
+    def get(self, userids, columns=None):
+        """Return a frame of userid, found and payload columns in the order asked."""
+        userids = np.asarray(userids)
+        rows = self.lookup(userids)
+        data = {'userid': userids, 'found': rows >= 0}
+        for col in (self.meta['columns'] if columns is None else columns):
+            data[col] = self._column(col, rows)
+        return pd.DataFrame(data)
+
+    def join(self, frame, on='userid', columns=None):
+        """Left-join payload columns onto frame by its userid column."""
+        found = self.get(frame[on].to_numpy(), columns)
+        result = frame.copy()
+        for col in found.columns.drop(['userid', 'found']):
+            result[col] = found[col].values
+        return result
+
+def open_userid_index(scored_path):
+    """Open the index that sits next to a scored output."""
+    return UseridIndex(default_index_dir(scored_path))
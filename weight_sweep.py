@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Engagement Weight Sweep
+=======================
+What-if analysis for the engagement score weights. Instead of editing
+ENGAGEMENT_WEIGHTS and rerunning the pipeline once per idea, many weight
+vectors are scored together: the normalised feature matrix is multiplied
+by a (features x vectors) weight matrix, a block of users at a time, so
+W score columns cost one pass over the data and memory stays bounded by
+the block size.
+
+For every vector the sweep reports the resulting category distribution,
+how much of its top-N overlaps the baseline valuable users, and how the
+baseline valuable users are re-ranked under it (Spearman correlation).
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import facebook_eda_analysis as fea
+from topk import top_k_positions
+
+# Upper bound on users x vectors scored per block (64 MB of float64 scores)
+BLOCK_ELEMENTS = 8_000_000
+
+def weight_matrix(weight_vectors):
+    """
+    Return a (features x vectors) matrix from weight dicts, sequences in
+    ENGAGEMENT_WEIGHTS order, or a DataFrame with one row per vector.
+    """
+    features = list(fea.ENGAGEMENT_WEIGHTS)
+    if isinstance(weight_vectors, pd.DataFrame):
+        weight_vectors = weight_vectors.to_dict('records')
+    columns = []
+    for vector in weight_vectors:
+        if isinstance(vector, dict):
+            unknown = set(vector) - set(features)
+            if unknown:
+                raise ValueError(f"unknown feature(s) in weights: {', '.join(sorted(unknown))}")
+            vector = [vector.get(col, 0.0) for col in features]
+        if len(vector) != len(features):
+            raise ValueError(f"expected {len(features)} weights ({', '.join(features)}), "
+                             f"got {len(vector)}")
+        columns.append(np.asarray(vector, dtype=np.float64))
+    return np.column_stack(columns) if columns else np.empty((len(features), 0))
+
+def random_weight_vectors(n, seed=0):
+    """Return n random weight vectors that each sum to 1, as a DataFrame."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.dirichlet(np.ones(len(fea.ENGAGEMENT_WEIGHTS)), n),
+                        columns=list(fea.ENGAGEMENT_WEIGHTS))
+
+def normalised_features(df, bounds):
+    """Return the engagement features of df scaled to 0-1, one row per feature."""
+    features = fea.engagement_feature_matrix(df).T
+    for j, col in enumerate(fea.ENGAGEMENT_WEIGHTS):
+        col_min, col_max = (float(b) for b in bounds[col])
+        features[j] -= col_min
+        features[j] /= col_max - col_min + 1e-10
+    return features
+
+def score_blocks(df, weights, bounds=None, block_size=None):
+    """
+    Yield (start, scores) for consecutive blocks of users, where scores is a
+    (vectors x block users) matrix. Scores agree with create_engagement_score
+    to floating-point rounding.
+    """
+    weights = weight_matrix(weights) if not isinstance(weights, np.ndarray) else weights
+    bounds = fea.compute_feature_bounds(df) if bounds is None else bounds
+    if block_size is None:
+        block_size = max(1024, BLOCK_ELEMENTS // max(weights.shape[1], 1))
+    weights_t = np.ascontiguousarray(weights.T)
+    for start in range(0, len(df), block_size):
+        block = df.iloc[start:start + block_size]
+        yield start, weights_t @ normalised_features(block, bounds)
+
+def _category_counts(scores):
+    """Count each vector's scores per category (bins are right-inclusive, like pd.cut)."""
+    above = np.stack([(scores > edge).sum(axis=1) for edge in fea.CATEGORY_BINS])
+    return above[:-1] - above[1:]
+
+def sweep_weights(df, weight_vectors, top_n=1000, baseline_weights=None, block_size=None):
+    """
+    Score df under every weight vector and compare each with the baseline.
+    Returns one row per vector: its weights, user counts per category,
+    top_n_overlap (share of its top_n that are baseline valuable users) and
+    rank_correlation (Spearman correlation between the baseline and this
+    vector's scores over the baseline valuable users).
+    """
+    weights = weight_matrix(weight_vectors)
+    n_vectors = weights.shape[1]
+    bounds = fea.compute_feature_bounds(df)
+    userids = df['userid'].values
+
+    # The baseline is scored exactly as the pipeline scores it
+    baseline_scores = fea.score_feature_matrix(fea.engagement_feature_matrix(df), bounds,
+                                               baseline_weights)
+    baseline_top = top_k_positions(baseline_scores, userids, top_n)
+
+    counts = np.zeros((len(fea.CATEGORY_LABELS), n_vectors), dtype=np.int64)
+    # Candidates for each vector's top_n: (vector, position, score) triples.
+    # A block's top_n per vector bounds the global top_n from below, so
+    # anything under the best threshold seen so far can be dropped.
+    thresholds = np.full(n_vectors, -np.inf)
+    cand_vector, cand_pos, cand_score = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                                         np.empty(0))
+    for start, scores in score_blocks(df, weights, bounds, block_size):
+        counts += _category_counts(scores)
+        scores = np.where(np.isnan(scores), -np.inf, scores)
+        n_block = scores.shape[1]
+        if n_block > top_n:
+            block_kth = np.partition(scores, n_block - top_n, axis=1)[:, n_block - top_n]
+            thresholds = np.maximum(thresholds, block_kth)
+        vector, pos = np.nonzero(scores >= thresholds[:, None])
+        cand_vector = np.concatenate([cand_vector, vector])
+        cand_pos = np.concatenate([cand_pos, start + pos])
+        cand_score = np.concatenate([cand_score, scores[vector, pos]])
+        keep = cand_score >= thresholds[cand_vector]
+        cand_vector, cand_pos, cand_score = cand_vector[keep], cand_pos[keep], cand_score[keep]
+
+    baseline_set = set(baseline_top.tolist())
+    order = np.argsort(cand_vector, kind='stable')
+    splits = np.searchsorted(cand_vector[order], np.arange(1, n_vectors))
+    overlap = np.zeros(n_vectors)
+    for j, members in enumerate(np.split(order, splits)):
+        scores = np.where(np.isinf(cand_score[members]), np.nan, cand_score[members])
+        top = cand_pos[members][top_k_positions(scores, userids[cand_pos[members]], top_n)]
+        overlap[j] = len(baseline_set.intersection(top.tolist())) / max(len(top), 1)
+
+    # Re-rank the baseline valuable users under each vector
+    baseline_features = normalised_features(df.iloc[baseline_top], bounds)
+    ranks = pd.DataFrame(baseline_features.T @ weights).rank()
+    baseline_ranks = pd.Series(baseline_scores[baseline_top]).rank()
+    correlation = ranks.corrwith(baseline_ranks).to_numpy()
+
+    result = pd.DataFrame(weights.T, columns=list(fea.ENGAGEMENT_WEIGHTS))
+    for label, row in zip(fea.CATEGORY_LABELS, counts):
+        result[label] = row
+    result['top_n_overlap'] = overlap
+    result['rank_correlation'] = correlation
+    result.index.name = 'vector'
+    return result
+
+def print_sweep(result, top_n, limit=10):
+    """Print the vectors that change the valuable users the least and the most."""
+    print("\n" + "="*80)
+    print(f"WEIGHT SWEEP ({len(result)} vectors, top {top_n} users)")
+    print("="*80)
+    ranked = result.sort_values(['top_n_overlap', 'rank_correlation'], ascending=False)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print("\nClosest to the baseline valuable users:")
+        print(ranked.head(limit).round(3))
+        print("\nFurthest from the baseline valuable users:")
+        print(ranked.tail(limit).round(3))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare many engagement weightings at once")
+    parser.add_argument('--data', help="input CSV (default: pseudo_facebook.csv in FACEBOOK_EDA_DIR)")
+    parser.add_argument('--weights', help="CSV with one weight vector per row, a column per feature")
+    parser.add_argument('--random', type=int, default=100,
+                        help="number of random weight vectors when --weights is not given")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top-n', type=int, default=1000)
+    parser.add_argument('--output', help="write the full comparison to this CSV")
+    args = parser.parse_args(argv)
+
+    vectors = (pd.read_csv(args.weights) if args.weights
+               else random_weight_vectors(args.random, args.seed))
+    columns = list(dict.fromkeys(['userid'] + list(fea.ENGAGEMENT_WEIGHTS)))
+    df = fea.load_data(args.data or fea.DATA_PATH, columns)
+    result = sweep_weights(df, vectors, args.top_n)
+    print_sweep(result, args.top_n)
+    if args.output:
+        result.to_csv(args.output)
+        print(f"\nSweep results saved to '{args.output}'")
+    return 0
+
+if __name__ == "__main__":
+    main()